@@ -0,0 +1,11 @@
+import os
+from typing import Dict
+
+
+def data_files(directory: str) -> Dict[str, str]:
+    """Environment placing the service's databases and revocation index in ``directory``."""
+    return {
+        "PROXYME_DB_FILE": os.path.join(directory, "auth.db"),
+        "PROXYME_AUDIT_DB_FILE": os.path.join(directory, "audit.db"),
+        "PROXYME_REVOCATION_INDEX_FILE": os.path.join(directory, "revoked_tokens.idx"),
+    }
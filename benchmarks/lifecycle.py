@@ -0,0 +1,305 @@
+"""
+Load test of the token lifecycle: register -> delegate -> validate -> revoke.
+
+Each of ``--concurrency`` client threads runs ``--iterations`` lifecycles
+against the server and the latency of every request is recorded. Results are
+printed as a table and written as JSON so runs can be compared::
+
+    python -m benchmarks.lifecycle run --mode inprocess -c 16 -n 200 -o before.json
+    python -m benchmarks.lifecycle run --mode gunicorn --workers 4 -c 64 -n 200 -o after.json
+    python -m benchmarks.lifecycle compare before.json after.json --threshold 0.1
+
+``inprocess`` serves the Flask app from a thread of the benchmark process,
+``gunicorn`` starts a gunicorn server and ``--url`` targets a running one.
+Servers started by the benchmark keep their databases in a scratch directory.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+import requests
+
+from benchmarks import data_files
+
+OPERATIONS = ("register", "delegate", "validate", "revoke")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Seconds gunicorn gets to bind and have its workers import the app
+STARTUP_TIMEOUT = 60
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Linearly interpolated percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+class LifecycleClient:
+    """One simulated agent, running lifecycles over a keep-alive session."""
+
+    def __init__(self, base_url: str, validations: int = 1):
+        self.base_url = base_url.rstrip("/")
+        self.validations = validations
+        self.session = requests.Session()
+        self.latencies: Dict[str, List[float]] = {op: [] for op in OPERATIONS}
+        self.errors: Dict[str, int] = {op: 0 for op in OPERATIONS}
+
+    def _post(self, operation: str, path: str, body: dict, expected: int = 200) -> Optional[dict]:
+        start = time.perf_counter()
+        try:
+            response = self.session.post(self.base_url + path, json=body, timeout=30)
+        except requests.RequestException:
+            self.errors[operation] += 1
+            return None
+        self.latencies[operation].append(time.perf_counter() - start)
+        if response.status_code != expected:
+            self.errors[operation] += 1
+            return None
+        return response.json()
+
+    def run_lifecycle(self) -> None:
+        agent = self._post("register", "/register_agent", {"scopes": ["read", "write"]})
+        if agent is None:
+            return
+        delegation = self._post("delegate", "/delegate", {
+            "user_id": "bench_user", "agent_id": agent["client_id"], "scopes": ["read"]
+        })
+        if delegation is None:
+            return
+        token = {"delegation_token": delegation["delegation_token"]}
+        for _ in range(self.validations):
+            self._post("validate", "/validate_delegation", token)
+        self._post("revoke", "/revoke_delegation", token)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def run_load(base_url: str, concurrency: int, iterations: int, validations: int = 1,
+             warmup: int = 1) -> dict:
+    """Run the lifecycle on ``concurrency`` threads and return per-operation statistics."""
+    clients = [LifecycleClient(base_url, validations) for _ in range(concurrency)]
+    for client in clients:
+        for _ in range(warmup):
+            client.run_lifecycle()
+        client.latencies = {op: [] for op in OPERATIONS}
+        client.errors = {op: 0 for op in OPERATIONS}
+
+    start_barrier = threading.Barrier(concurrency + 1)
+
+    def drive(client):
+        start_barrier.wait()
+        for _ in range(iterations):
+            client.run_lifecycle()
+
+    threads = [threading.Thread(target=drive, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        client.close()
+
+    operations = {}
+    all_latencies, all_errors = [], 0
+    for op in OPERATIONS:
+        latencies = [value for client in clients for value in client.latencies[op]]
+        errors = sum(client.errors[op] for client in clients)
+        operations[op] = summarize(latencies, errors, elapsed)
+        all_latencies += latencies
+        all_errors += errors
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "operations": operations,
+        "total": summarize(all_latencies, all_errors, elapsed),
+    }
+
+
+@contextlib.contextmanager
+def inprocess_server() -> Iterator[str]:
+    """Serve the Flask app on a thread of this process and yield its URL."""
+    from werkzeug.serving import make_server
+
+    from packages.server.proxyme_service import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+@contextlib.contextmanager
+def gunicorn_server(workers: int, threads: int, port: int, workdir: str) -> Iterator[str]:
+    """Start gunicorn on ``port`` with its databases in ``workdir`` and yield its URL."""
+    env = dict(os.environ, **data_files(workdir),
+               PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--workers", str(workers), "--threads", str(threads),
+         "--bind", f"127.0.0.1:{port}", "--log-level", "warning",
+         "packages.server.proxyme_service:app"],
+        cwd=workdir, env=env
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        # The port accepts connections before the workers have imported the
+        # app, so a probe can also time out or fail while they start
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+            try:
+                if requests.get(f"{url}/.well-known/openid-configuration", timeout=1).ok:
+                    break
+            except requests.RequestException:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"gunicorn did not become ready within {STARTUP_TIMEOUT} seconds")
+            time.sleep(0.2)
+        yield url
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """Return a description of every operation that regressed by more than ``threshold``."""
+    regressions = []
+    for op, before in {**baseline["operations"], "total": baseline["total"]}.items():
+        after = current["total"] if op == "total" else current["operations"].get(op)
+        if not after:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if before[key] and after[key] > before[key] * (1 + threshold):
+                regressions.append(f"{op} {key}: {before[key]} -> {after[key]}")
+        if before["rps"] and after["rps"] < before["rps"] * (1 - threshold):
+            regressions.append(f"{op} rps: {before['rps']} -> {after['rps']}")
+        if after["errors"] > before["errors"]:
+            regressions.append(f"{op} errors: {before['errors']} -> {after['errors']}")
+    return regressions
+
+
+def format_table(results: dict) -> str:
+    lines = [f"{'operation':<10} {'count':>7} {'errors':>6} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"]
+    for op, stats in {**results["operations"], "total": results["total"]}.items():
+        lines.append(f"{op:<10} {stats['count']:>7} {stats['errors']:>6} {stats['rps']:>9} "
+                     f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}")
+    return "\n".join(lines)
+
+
+def run_command(args) -> int:
+    with contextlib.ExitStack() as stack:
+        if args.url:
+            url = args.url
+        else:
+            workdir = stack.enter_context(tempfile.TemporaryDirectory(prefix="proxyme-bench-"))
+            if args.mode == "gunicorn":
+                url = stack.enter_context(gunicorn_server(args.workers, args.threads, args.port, workdir))
+            else:
+                os.chdir(workdir)
+                os.environ.update(data_files(workdir))
+                url = stack.enter_context(inprocess_server())
+        results = run_load(url, args.concurrency, args.iterations, args.validations, args.warmup)
+
+    results["meta"] = {
+        "mode": "url" if args.url else args.mode,
+        "concurrency": args.concurrency,
+        "iterations": args.iterations,
+        "validations": args.validations,
+        "workers": args.workers if args.mode == "gunicorn" else None,
+        "threads": args.threads if args.mode == "gunicorn" else None,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started_at": datetime.datetime.utcnow().isoformat(),
+    }
+    print(format_table(results))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+def compare_command(args) -> int:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    print(f"baseline ({baseline['meta'].get('commit')}):\n{format_table(baseline)}\n")
+    print(f"current ({current['meta'].get('commit')}):\n{format_table(current)}\n")
+    regressions = compare(baseline, current, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the load test")
+    run.add_argument("--mode", choices=["inprocess", "gunicorn"], default="inprocess")
+    run.add_argument("--url", help="benchmark an already running server instead")
+    run.add_argument("-c", "--concurrency", type=int, default=8)
+    run.add_argument("-n", "--iterations", type=int, default=50, help="lifecycles per client thread")
+    run.add_argument("--validations", type=int, default=1, help="validations per issued token")
+    run.add_argument("--warmup", type=int, default=1, help="untimed lifecycles per client thread")
+    run.add_argument("--workers", type=int, default=4, help="gunicorn worker processes")
+    run.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker")
+    run.add_argument("--port", type=int, default=5099, help="gunicorn port")
+    run.add_argument("-o", "--output", help="write results as JSON")
+    run.set_defaults(handler=run_command)
+
+    diff = commands.add_parser("compare", help="compare two result files")
+    diff.add_argument("baseline")
+    diff.add_argument("current")
+    diff.add_argument("--threshold", type=float, default=0.1,
+                      help="allowed relative slowdown before failing (default 0.1)")
+    diff.set_defaults(handler=compare_command)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""
+Memory soak test: issue and validate tokens until hours of traffic have passed.
+
+Requests go through the Flask app in-process, on client threads that are
+replaced every batch as a thread-per-request server would. The clock seen by
+the service advances ``--seconds-per-op`` per request, so tokens, cached
+claims and cached clients expire as they would over the simulated period
+while the run itself takes minutes::
+
+    python -m benchmarks.soak --operations 2000000 --max-growth-mb 2 -o soak.json
+
+Every ``--report-every`` requests the RSS and the ``tracemalloc`` top
+allocation sites, relative to the end of the warm-up, are printed. Once the
+warm-up has filled the caches memory should be flat; the run fails if RSS
+grows faster than ``--max-growth-mb`` per 100k requests.
+"""
+import argparse
+import contextlib
+import gc
+import itertools
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Dict, List
+from unittest import mock
+
+from benchmarks import data_files
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> int:
+    """
+    Anonymous resident memory, or the whole RSS or its peak where /proc lacks it.
+
+    Pages of the memory-mapped SQLite files are left out where possible: they
+    grow with the databases and are reclaimable, so they aren't a leak.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def growth_per_100k(points: List[Dict[str, float]]) -> float:
+    """Least-squares slope of RSS, in MB per 100k operations."""
+    if len(points) < 2:
+        return 0.0
+    xs = [p["operations"] for p in points]
+    ys = [p["rss_mb"] for p in points]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if not variance:
+        return 0.0
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+    return slope * 100000
+
+
+class SimulatedClock:
+    """``time.time`` running ahead of the wall clock by a settable offset."""
+
+    def __init__(self):
+        self.offset = 0.0
+        self._real_time = time.time
+
+    def time(self) -> float:
+        return self._real_time() + self.offset
+
+
+class Workload:
+    """
+    The request mix of one soak run.
+
+    Each token is validated ``validations`` times, every ``revoke_every``-th
+    token is revoked and every ``audit_every`` requests one page of audit
+    logs is read.
+    """
+
+    def __init__(self, client, agent_ids, validations=2, revoke_every=10, audit_every=1000):
+        self.client = client
+        self.agent_ids = agent_ids
+        self.validations = validations
+        self.revoke_every = revoke_every
+        self.audit_every = audit_every
+        self.errors = 0
+        self._tokens = itertools.count()
+        self._since_audit = 0
+
+    def _post(self, path, body):
+        response = self.client.post(path, json=body)
+        if response.status_code != 200:
+            self.errors += 1
+        return response
+
+    def run(self, operations: int) -> int:
+        """Send about ``operations`` requests and return how many were sent."""
+        sent = 0
+        while sent < operations:
+            n = next(self._tokens)
+            response = self._post("/delegate", {
+                "user_id": f"soak_user_{n % 1000}",
+                "agent_id": self.agent_ids[n % len(self.agent_ids)],
+                "scopes": ["read"]
+            })
+            sent += 1
+            token = (response.get_json() or {}).get("delegation_token")
+            if token is None:
+                continue
+            for _ in range(self.validations):
+                self._post("/validate_delegation", {"delegation_token": token})
+                sent += 1
+            if n % self.revoke_every == 0:
+                self._post("/revoke_delegation", {"delegation_token": token})
+                sent += 1
+            if self._since_audit + sent >= self.audit_every:
+                self._post("/audit_logs", {"limit": 100})
+                sent += 1
+                self._since_audit = -sent
+        self._since_audit += sent
+        return sent
+
+
+def run_soak(operations: int, report_every: int = 100000, warmup: int = 200000, threads: int = 4,
+             batch: int = 2000, seconds_per_op: float = 0.05, validations: int = 2, agents: int = 20,
+             top: int = 10, frames: int = 1, report=print) -> dict:
+    """Drive the service for ``operations`` requests and return the memory measurements."""
+    from packages.server import proxyme_service
+
+    clock = SimulatedClock()
+    client = proxyme_service.app.test_client()
+    agent_ids = [client.post("/register_agent", json={"scopes": ["read"]}).get_json()["client_id"]
+                 for _ in range(agents)]
+    workloads = [Workload(proxyme_service.app.test_client(), agent_ids, validations) for _ in range(threads)]
+
+    tracemalloc.start(frames)
+    ignored = (tracemalloc.Filter(False, tracemalloc.__file__),
+               tracemalloc.Filter(False, "<frozen importlib._bootstrap>"))
+    baseline = None
+    points = []
+    done = 0
+    next_report = report_every
+    started = time.monotonic()
+    with mock.patch("time.time", clock.time):
+        while done < operations:
+            # Fresh threads each batch, as a thread-per-request server would use
+            per_thread = max(1, min(batch, operations - done) // threads)
+            counts = [0] * threads
+
+            def drive(i):
+                counts[i] = workloads[i].run(per_thread)
+
+            workers = [threading.Thread(target=drive, args=(i,)) for i in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            done += sum(counts)
+            clock.offset += sum(counts) * seconds_per_op
+
+            if done < next_report and done < operations:
+                continue
+            next_report = (done // report_every + 1) * report_every
+            gc.collect()
+            snapshot = tracemalloc.take_snapshot().filter_traces(ignored)
+            traced, _ = tracemalloc.get_traced_memory()
+            point = {
+                "operations": done,
+                "simulated_hours": round(done * seconds_per_op / 3600, 2),
+                "rss_mb": round(rss_bytes() / 2 ** 20, 2),
+                "traced_mb": round(traced / 2 ** 20, 2),
+                "elapsed_s": round(time.monotonic() - started, 1),
+            }
+            if done >= warmup and baseline is None:
+                baseline = snapshot
+                point["baseline"] = True
+            elif baseline is not None:
+                growth = [stat for stat in snapshot.compare_to(baseline, "lineno") if stat.size_diff > 0]
+                point["top_growth"] = [
+                    {"site": str(stat.traceback), "size_diff_kb": round(stat.size_diff / 1024, 1),
+                     "count_diff": stat.count_diff}
+                    for stat in growth[:top]
+                ]
+            points.append(point)
+            report(_format_point(point))
+    tracemalloc.stop()
+
+    measured = [p for p in points if "top_growth" in p or p.get("baseline")]
+    return {
+        "operations": done,
+        "errors": sum(workload.errors for workload in workloads),
+        "simulated_hours": round(done * seconds_per_op / 3600, 2),
+        "growth_mb_per_100k": round(growth_per_100k(measured), 3),
+        "points": points,
+    }
+
+
+def _format_point(point: dict) -> str:
+    lines = [f"{point['operations']:>10} ops  {point['simulated_hours']:>8}h simulated  "
+             f"rss {point['rss_mb']:>8} MB  traced {point['traced_mb']:>8} MB"
+             + ("  (baseline)" if point.get("baseline") else "")]
+    for stat in point.get("top_growth", []):
+        lines.append(f"    +{stat['size_diff_kb']:>9} KiB  +{stat['count_diff']:>7}  {stat['site']}")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--operations", type=int, default=1000000, help="requests to send")
+    parser.add_argument("--report-every", type=int, default=100000)
+    parser.add_argument("--warmup", type=int, default=200000,
+                        help="requests before the baseline, enough to fill the caches")
+    parser.add_argument("--threads", type=int, default=4, help="client threads per batch")
+    parser.add_argument("--batch", type=int, default=2000, help="requests per batch of threads")
+    parser.add_argument("--seconds-per-op", type=float, default=0.05,
+                        help="simulated seconds that pass per request")
+    parser.add_argument("--validations", type=int, default=2, help="validations per issued token")
+    parser.add_argument("--top", type=int, default=10, help="allocation sites to list")
+    parser.add_argument("--frames", type=int, default=1, help="tracemalloc frames per allocation")
+    parser.add_argument("--max-growth-mb", type=float, default=2.0,
+                        help="fail if RSS grows faster than this per 100k requests")
+    parser.add_argument("-o", "--output", help="write the measurements as JSON")
+    args = parser.parse_args(argv)
+    # Per-request log lines would swamp the report
+    logging.disable(logging.INFO)
+
+    with contextlib.ExitStack() as stack:
+        workdir = stack.enter_context(tempfile.TemporaryDirectory(prefix="proxyme-soak-"))
+        os.chdir(workdir)
+        os.environ.update(data_files(workdir))
+        results = run_soak(args.operations, args.report_every, args.warmup, args.threads, args.batch,
+                           args.seconds_per_op, args.validations, top=args.top, frames=args.frames)
+        from packages.server.audit_logger import audit_logger
+        audit_logger.close()
+
+    results["max_growth_mb_per_100k"] = args.max_growth_mb
+    results["passed"] = results["growth_mb_per_100k"] <= args.max_growth_mb
+    print(f"RSS growth {results['growth_mb_per_100k']} MB per 100k requests "
+          f"(limit {args.max_growth_mb}) over {results['simulated_hours']} simulated hours, "
+          f"{results['errors']} errors")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if results["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
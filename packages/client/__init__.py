@@ -0,0 +1,9 @@
+"""Python SDK for services that accept Proxyme delegation tokens."""
+
+from .relying_party import DelegationError, ProxymeClient, RevocationSet
+
+__all__ = [
+    "DelegationError",
+    "ProxymeClient",
+    "RevocationSet",
+]
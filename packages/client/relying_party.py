@@ -0,0 +1,193 @@
+"""Verify Proxyme delegation tokens inside a resource server."""
+import hashlib
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import jwt
+import requests
+from requests.adapters import HTTPAdapter
+
+# Minimum seconds between JWKS fetches triggered by an unknown kid
+KID_REFETCH_INTERVAL = 5.0
+
+
+class DelegationError(Exception):
+    """A delegation token was rejected; the message is safe to return to callers."""
+
+
+def token_digest(token: str) -> bytes:
+    # Must match the digest the service records revocations under
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+class RevocationSet:
+    """Digests of revoked tokens, each kept until the token itself expires."""
+
+    def __init__(self):
+        self._expiry: Dict[bytes, int] = {}
+
+    def add(self, token_id: bytes, expires_at: int) -> None:
+        self._expiry[token_id] = expires_at
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Forget revocations of expired tokens and return how many were dropped."""
+        now = time.time() if now is None else now
+        expired = [token_id for token_id, exp in self._expiry.items() if exp <= now]
+        for token_id in expired:
+            del self._expiry[token_id]
+        return len(expired)
+
+    def __contains__(self, token_id: bytes) -> bool:
+        return token_id in self._expiry
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+
+class ProxymeClient:
+    """
+    Local verifier for delegation tokens issued by a Proxyme service.
+
+    Tokens are checked against the service's published signing keys, which
+    are cached for ``jwks_ttl`` seconds and refetched early when a token
+    names an unknown ``kid``. Revocations are pulled from the ``/revocations``
+    feed every ``sync_interval`` seconds, re-reading the last ``sync_overlap``
+    seconds each time so revocations committed out of order aren't missed.
+    If the feed can't be reached for ``max_staleness`` seconds, verification
+    fails closed. All requests share one pooled ``requests.Session``.
+
+    Local verification needs asymmetric signing on the service
+    (``PROXYME_SIGNING_ALGORITHM``); with HS256 use ``validate_remote``.
+    """
+
+    def __init__(self, base_url: str, issuer: Optional[str] = None, session: Optional[requests.Session] = None,
+                 timeout: float = 5.0, pool_size: int = 10, jwks_ttl: float = 300,
+                 sync_interval: float = 5.0, sync_overlap: int = 30, max_staleness: float = 60.0):
+        self.base_url = base_url.rstrip("/")
+        self.issuer = issuer or self.base_url
+        self.timeout = timeout
+        self.jwks_ttl = jwks_ttl
+        self.sync_interval = sync_interval
+        self.sync_overlap = sync_overlap
+        self.max_staleness = max_staleness
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=1)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+        self.revocations = RevocationSet()
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._keys_fetched_at = 0.0
+        self._high_water = 0  # latest revoked_at seen in the feed
+        self._synced_at = 0.0
+        self._next_sync = 0.0
+        self._keys_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def verify(self, token: str, audience: Optional[str] = None,
+               required_scopes=()) -> Dict[str, Any]:
+        """
+        Return the claims of a valid, unrevoked token or raise DelegationError.
+
+        ``audience`` restricts the token to one agent and ``required_scopes``
+        must all have been delegated.
+        """
+        if not isinstance(token, str):
+            raise DelegationError("Invalid token")
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+            key = self._signing_key(kid)
+            if key is None:
+                raise DelegationError("Invalid token")
+            claims = jwt.decode(
+                token,
+                key.key,
+                algorithms=[key.algorithm_name],
+                issuer=self.issuer,
+                audience=audience,
+                options={
+                    "verify_aud": audience is not None,
+                    "require": ["exp", "iss", "aud", "sub", "agent_id", "scope", "jti"],
+                },
+            )
+        except jwt.ExpiredSignatureError:
+            raise DelegationError("Token has expired")
+        except jwt.InvalidTokenError:
+            raise DelegationError("Invalid token")
+
+        self._sync_if_due()
+        if token_digest(token) in self.revocations:
+            raise DelegationError("Token has been revoked")
+        if not set(required_scopes).issubset(claims["scope"].split()):
+            raise DelegationError("Insufficient scope")
+        return claims
+
+    def validate_remote(self, token: str) -> Dict[str, Any]:
+        """Validate ``token`` through the service's ``/validate_delegation`` endpoint."""
+        response = self.session.post(f"{self.base_url}/validate_delegation",
+                                     json={"delegation_token": token}, timeout=self.timeout)
+        return response.json()
+
+    def sync_revocations(self) -> int:
+        """Pull new revocations from the service and return how many were received."""
+        with self._sync_lock:
+            received = 0
+            cursor = str(max(0, self._high_water - self.sync_overlap))
+            while cursor:
+                response = self.session.get(f"{self.base_url}/revocations",
+                                            params={"since": cursor}, timeout=self.timeout)
+                response.raise_for_status()
+                for entry in response.json():
+                    self.revocations.add(bytes.fromhex(entry["token_id"]), entry["expires_at"])
+                    self._high_water = max(self._high_water, entry["revoked_at"])
+                    received += 1
+                cursor = response.headers.get("X-Next-Cursor")
+            self.revocations.prune()
+            self._synced_at = time.time()
+            return received
+
+    def refresh_keys(self) -> None:
+        response = self.session.get(f"{self.base_url}/.well-known/jwks.json", timeout=self.timeout)
+        response.raise_for_status()
+        keys = {}
+        for data in response.json().get("keys", []):
+            try:
+                keys[data["kid"]] = jwt.PyJWK(data)
+            except (KeyError, jwt.PyJWTError):
+                continue
+        self._keys = keys
+        self._keys_fetched_at = time.time()
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _signing_key(self, kid: Optional[str]) -> Optional[jwt.PyJWK]:
+        fetched_at = self._keys_fetched_at
+        age = time.time() - fetched_at
+        key = self._keys.get(kid)
+        if age >= self.jwks_ttl or (key is None and age >= KID_REFETCH_INTERVAL):
+            with self._keys_lock:
+                # Another thread may have refreshed while this one waited
+                if self._keys_fetched_at == fetched_at:
+                    try:
+                        self.refresh_keys()
+                    except (requests.RequestException, ValueError):
+                        if not self._keys:
+                            raise DelegationError("Signing keys unavailable")
+                        # Keep serving the cached keys and retry shortly
+                        self._keys_fetched_at = time.time() - self.jwks_ttl + KID_REFETCH_INTERVAL
+            key = self._keys.get(kid)
+        return key
+
+    def _sync_if_due(self) -> None:
+        now = time.time()
+        if now >= self._next_sync:
+            self._next_sync = now + self.sync_interval
+            try:
+                self.sync_revocations()
+            except (requests.RequestException, ValueError):
+                pass
+        if time.time() - self._synced_at >= self.max_staleness:
+            raise DelegationError("Revocation status unavailable")
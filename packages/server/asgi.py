@@ -0,0 +1,288 @@
+"""
+ASGI entry point for the core Proxyme API.
+
+Serves ``/register_agent``, ``/delegate``, ``/validate_delegation``,
+``/revoke_delegation`` and ``/audit_logs`` with the same behaviour as the
+Flask app, plus ``GET /metrics``, on any ASGI server::
+
+    uvicorn packages.server.asgi:app
+
+Validation runs on the event loop: verified claims are cached and the
+revocation index is in shared memory, so the common path does no I/O. Only
+a validation that would first reload signing keys from disk is moved to the
+thread pool.
+Database queries, password hashing and token signing run on a bounded
+thread pool, so a single process can keep thousands of requests in flight.
+"""
+import asyncio
+import datetime
+import functools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+
+from . import proxyme_service as service
+from .metrics import REQUEST_SECONDS, REQUESTS, registry as metrics_registry
+
+# Threads available for blocking work such as SQLite queries
+BLOCKING_THREADS = int(os.environ.get("PROXYME_ASGI_THREADS", 32))
+MAX_BODY_BYTES = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix="proxyme-asgi")
+
+_CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-expose-headers", b"X-Next-Cursor"),
+]
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run ``func`` on the blocking-work thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def log_event(**event):
+    audit_logger = service.audit_logger
+    # Queuing an event only blocks when audit writes are synchronous or the
+    # queue is full; keep both cases off the event loop.
+    if audit_logger.async_writes and audit_logger.queue_depth() < audit_logger.queue_size:
+        audit_logger.log_event(**event)
+    else:
+        await run_blocking(audit_logger.log_event, **event)
+
+
+async def register_agent(data, ip_address):
+    if not data or "scopes" not in data:
+        return 500, {"error": "Invalid request data"}, None
+    response = await run_blocking(service.register_client, data.get("scopes", []))
+    return 400 if "error" in response else 200, response, None
+
+
+async def delegate(data, ip_address):
+    user_id = data.get("user_id")
+    agent_id = data.get("agent_id")
+    scopes = data.get("scopes", [])
+
+    def issue():
+        client = service.client_registry.get(agent_id)
+        return service.issue_delegation(user_id, agent_id, scopes, client, ip_address)
+
+    body, status, event = await run_blocking(issue)
+    await log_event(**event)
+    if status == 200:
+        service.event_log.info("token_issued", agent_id=agent_id, user_id=user_id, scopes=scopes)
+    return status, body, None
+
+
+def key_refresh_due(token):
+    """Whether verifying ``token`` may reload signing keys, which takes a file lock."""
+    key_manager = service.key_manager
+    if key_manager is None or not isinstance(token, str):
+        return False
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+    except jwt.InvalidTokenError:
+        kid = None
+    return key_manager.refresh_due(kid)
+
+
+async def validate_delegation(data, ip_address):
+    token = data.get("delegation_token")
+    if not token:
+        return 401, {"valid": False, "error": "No token provided"}, None
+
+    if key_refresh_due(token):
+        delegation, error = await run_blocking(service.verify_delegation, token)
+    else:
+        delegation, error = service.verify_delegation(token)
+    if not error:
+        token_id = service.token_digest(token)
+        # Only possible revocations need the database
+        if (service.revocation_index.might_contain(token_id)
+                and await run_blocking(service.auth_store.find_revoked, [token_id])):
+            delegation, error = None, "Token revoked"
+
+    body, status, event = service.validation_outcome(token, delegation, error, ip_address)
+    await log_event(**event)
+    service.event_log.info("token_validated", token=token, valid=not error, error=error)
+    return status, body, None
+
+
+async def revoke_delegation(data, ip_address):
+    token = data.get("delegation_token")
+    if not token:
+        return 400, {"error": "No token provided"}, None
+    if not isinstance(token, str):
+        return 400, {"error": "delegation_token must be a string"}, None
+
+    revoked_at = datetime.datetime.utcnow().isoformat()
+    if not await run_blocking(service.revoke_delegation_token, token):
+        return 200, {"status": "already_revoked"}, None
+
+    await log_event(
+        event_type="token_revocation",
+        action="revoke_delegation",
+        status="success",
+        details={"revoked_at": revoked_at},
+        ip_address=ip_address,
+        token_id=token
+    )
+    service.event_log.info("token_revoked", token=token)
+    return 200, {"status": "revoked"}, None
+
+
+async def audit_logs(data, ip_address):
+    try:
+        logs, next_cursor = await run_blocking(
+            service.audit_logger.get_events_page,
+            event_type=data.get("event_type"),
+            user_id=data.get("user_id"),
+            agent_id=data.get("agent_id"),
+            status=data.get("status"),
+            limit=data.get("limit", 100),
+            cursor=data.get("cursor"),
+            since=data.get("since"),
+            until=data.get("until")
+        )
+    except (TypeError, ValueError):
+        return 400, {"error": "Invalid limit, cursor or time range"}, None
+    # The body stays a plain list; the next page is advertised in a header
+    headers = [(b"x-next-cursor", next_cursor.encode())] if next_cursor else []
+    return 200, logs, headers
+
+
+# path -> (handler, audit event type for failures, action)
+ROUTES = {
+    "/register_agent": (register_agent, None, "register_agent"),
+    "/delegate": (delegate, "token_delegation", "delegate"),
+    "/validate_delegation": (validate_delegation, "token_validation", "validate_delegation"),
+    "/revoke_delegation": (revoke_delegation, "token_revocation", "revoke_delegation"),
+    "/audit_logs": (audit_logs, "audit_logs", "get_audit_logs"),
+}
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    started = time.perf_counter()
+    statuses = []
+
+    async def send_recording(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+        await send(message)
+
+    metrics_registry.ensure_exporter()
+    try:
+        await _dispatch(scope, receive, send_recording)
+    finally:
+        route = scope["path"] if scope["path"] in ROUTES or scope["path"] == "/metrics" else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=route)
+        REQUESTS.inc(route=route, method=scope["method"], status=statuses[0] if statuses else 500)
+
+
+async def _dispatch(scope, receive, send):
+    if scope["path"] == "/metrics" and scope["method"] == "GET":
+        body = (await run_blocking(metrics_registry.render)).encode()
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/plain; version=0.0.4"),
+            (b"content-length", str(len(body)).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+        return
+
+    route = ROUTES.get(scope["path"])
+    if route is None:
+        await _respond(send, 404, {"error": "Not found"})
+        return
+    if scope["method"] == "OPTIONS":
+        await _respond(send, 204, None, [
+            (b"access-control-allow-methods", b"POST, OPTIONS"),
+            (b"access-control-allow-headers", b"Content-Type"),
+        ])
+        return
+    if scope["method"] != "POST":
+        await _respond(send, 405, {"error": "Method not allowed"}, [(b"allow", b"POST, OPTIONS")])
+        return
+
+    handler, event_type, action = route
+    ip_address = scope["client"][0] if scope.get("client") else None
+    body = await _read_body(receive)
+    if body is None:
+        await _respond(send, 413, {"error": "Request body too large"})
+        return
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        await _respond(send, 400, {"error": "Invalid JSON body"})
+        return
+    if data is not None and not isinstance(data, dict):
+        await _respond(send, 400, {"error": "Request body must be a JSON object"})
+        return
+
+    try:
+        status, payload, headers = await handler(data or {}, ip_address)
+    except Exception as e:
+        logger.error(f"Error in {action}: {str(e)}", exc_info=True)
+        if event_type:
+            await log_event(
+                event_type=event_type,
+                action=action,
+                status="error",
+                details={"error": str(e)},
+                ip_address=ip_address
+            )
+        status, payload, headers = 500, {"error": str(e)}, None
+    await _respond(send, status, payload, headers)
+
+
+async def _read_body(receive):
+    """Return the request body, or None if it exceeds MAX_BODY_BYTES."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def _respond(send, status, payload, headers=None):
+    body = b"" if payload is None else json.dumps(payload).encode()
+    response_headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        *_CORS_HEADERS,
+        *(headers or []),
+    ]
+    await send({"type": "http.response.start", "status": status, "headers": response_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # Commit queued audit events before the server exits
+            await run_blocking(service.audit_logger.flush, 10.0)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
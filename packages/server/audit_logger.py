@@ -1,45 +1,145 @@
+import atexit
+import collections
+import contextlib
+import gzip
 import logging
 import json
 import datetime
+import os
+import queue
+import re
+import shutil
 import sqlite3
-from typing import Dict, Any, Optional
+import tempfile
+import time
+from typing import Dict, Any, Iterator, List, NamedTuple, Optional, Tuple, Union
 from flask import current_app
+from .metrics import AUDIT_LOG_EVENT_SECONDS
+from .profiling import phase
+from .storage import AuditStore, SQLiteAuditStore
 import threading
 
-# Thread-local storage for database connections
-thread_local = threading.local()
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("block", "drop", "sync")
+
+_INSERT_EVENT = """
+    INSERT INTO audit_logs 
+    (timestamp, event_type, action, status, user_id, agent_id, details, ip_address, token_id, ts)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_EVENT_COLUMNS = "id, timestamp, event_type, action, status, user_id, agent_id, details, ip_address, token_id, ts"
+
+# Each index ends in ts so filtered queries return rows already in time order
+_INDEXES = {
+    "idx_audit_logs_ts": "ts",
+    "idx_audit_logs_event_type": "event_type, ts",
+    "idx_audit_logs_event_type_status": "event_type, status, ts",
+    "idx_audit_logs_agent_id": "agent_id, ts",
+    "idx_audit_logs_user_id": "user_id, ts",
+}
+
+MAX_PAGE_SIZE = 1000
+
+# Per-minute counters maintained alongside the raw events. A missing agent_id
+# or ip_address is stored as '' so it can be part of the primary key.
+_UPSERT_ROLLUP = """
+    INSERT INTO audit_rollups (minute, event_type, status, agent_id, count)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (minute, event_type, status, agent_id) DO UPDATE SET count = count + excluded.count
+"""
+_UPSERT_IP_ROLLUP = """
+    INSERT INTO audit_ip_rollups (minute, ip_address, count)
+    VALUES (?, ?, ?)
+    ON CONFLICT (minute, ip_address) DO UPDATE SET count = count + excluded.count
+"""
+ROLLUP_DIMENSIONS = ("minute", "event_type", "status", "agent_id")
+MINUTE_MS = 60000
+
+DAY_MS = 86400000
+_SEGMENT_NAME = re.compile(r"^audit-(\d{4}-\d{2}-\d{2})\.db(\.gz)?$")
+# Segments are only compressed once no late write can still be queued for them
+_SEAL_GRACE_MS = 300000
+
+
+class Segment(NamedTuple):
+    """One audit database file and the time range (epoch ms) it covers."""
+    path: str
+    start: Optional[int]
+    end: Optional[int]
+    compressed: bool
+
+# Queue marker asking the writer to stop after committing what precedes it
+_STOP = object()
+
 
 class AuditLogger:
-    def __init__(self, db_file="audit.db"):
+    """
+    Audit trail stored in SQLite.
+
+    With ``async_writes`` enabled, ``log_event`` only enqueues the event. A
+    background writer commits queued events in batches of up to
+    ``batch_size``, waiting at most ``flush_interval`` seconds to fill a
+    batch. When the queue holds ``queue_size`` events, ``overflow`` decides
+    what happens to new ones: ``"block"`` waits for space, ``"drop"``
+    discards the event and ``"sync"`` writes it on the calling thread.
+
+    With ``partition_dir`` set, events are written to one SQLite file per UTC
+    day (``audit-YYYY-MM-DD.db``) and queries only open the days they cover.
+    Days older than ``compress_after_days`` are sealed into gzip archives and
+    days older than ``retention_days`` are deleted by ``rotate``, which runs in
+    the background whenever writing moves to a new day unless ``auto_rotate``
+    is off. An existing ``db_file`` is still read as the oldest segment.
+
+    Every segment is reached through ``store``, by default a SQLiteAuditStore
+    holding at most ``pool_size`` connections per segment.
+    """
+
+    def __init__(self, db_file="audit.db", async_writes=True, batch_size=256,
+                 flush_interval=0.05, queue_size=10000, overflow="block",
+                 partition_dir=None, compress_after_days=2, retention_days=None,
+                 auto_rotate=True, store: Optional[AuditStore] = None, pool_size=4):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}")
         self.db_file = db_file
+        self.async_writes = async_writes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.partition_dir = partition_dir
+        self.compress_after_days = max(1, compress_after_days)
+        self.retention_days = retention_days
+        self.auto_rotate = auto_rotate
+        self.dropped = 0
+        self._listeners = []
+        self._queue = None
+        self._writer = None
+        self._writer_pid = None
+        self._start_lock = threading.Lock()
+        self._current_segment = None
+        # Segments this process has created the schema in
+        self._prepared = set()
+        self.store = store or SQLiteAuditStore(pool_size=pool_size)
         self._init_db()
-        
-    def _get_db(self):
-        if not hasattr(thread_local, 'conn'):
-            thread_local.conn = sqlite3.connect(self.db_file)
-        return thread_local.conn
-        
+        if async_writes:
+            atexit.register(self.close)
+
     def _init_db(self):
         try:
-            conn = self._get_db()
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS audit_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    event_type TEXT NOT NULL,
-                    action TEXT NOT NULL,
-                    status TEXT NOT NULL,
-                    user_id TEXT,
-                    agent_id TEXT,
-                    details TEXT,
-                    ip_address TEXT,
-                    token_id TEXT
-                )
-            """)
-            conn.commit()
+            if self.partition_dir:
+                os.makedirs(self.partition_dir, exist_ok=True)
+                if not os.path.exists(self.db_file):
+                    return
+            self._prepare_segment(self.db_file)
         except Exception as e:
-            logging.error(f"Error initializing audit database: {str(e)}")
+            logger.error(f"Error initializing audit database: {str(e)}")
             raise
 
     def log_event(self, 
@@ -55,78 +155,738 @@ class AuditLogger:
         Log an audit event with structured data
         """
         try:
-            timestamp = datetime.datetime.utcnow().isoformat()
-            if isinstance(details, dict):
-                details = json.dumps(details)
-            
-            conn = self._get_db()
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO audit_logs 
-                (timestamp, event_type, action, status, user_id, agent_id, details, ip_address, token_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (timestamp, event_type, action, status, user_id, agent_id, details, ip_address, token_id))
-            conn.commit()
+            with AUDIT_LOG_EVENT_SECONDS.time(), phase("audit"):
+                self._submit([_event_row(event_type, action, status, user_id, agent_id,
+                                         details, ip_address, token_id)])
+        except Exception as e:
+            logger.error(f"Error logging audit event: {str(e)}")
+            raise
+
+    def log_events(self, events: List[Dict[str, Any]]):
+        """
+        Log several events, given as ``log_event`` keyword arguments, in one transaction
+        """
+        if not events:
+            return
+        try:
+            with AUDIT_LOG_EVENT_SECONDS.time(), phase("audit"):
+                self._submit([_event_row(**event) for event in events])
         except Exception as e:
-            logging.error(f"Error logging audit event: {str(e)}")
+            logger.error(f"Error logging {len(events)} audit events: {str(e)}")
             raise
 
+    def _submit(self, rows):
+        if not self.async_writes:
+            self._write_batch(rows)
+            return
+        # Rows are queued together so the writer commits them in one batch
+        item = rows[0] if len(rows) == 1 else rows
+        events = self._ensure_writer()
+        if self.overflow == "block":
+            events.put(item)
+            return
+        try:
+            events.put_nowait(item)
+        except queue.Full:
+            if self.overflow == "sync":
+                self._write_batch(rows)
+            else:
+                self.dropped += len(rows)
+
+    def add_listener(self, callback):
+        """
+        Call ``callback`` with every batch of events once it is committed.
+
+        Events are passed as row tuples in ``_EVENT_COLUMNS`` order, with
+        ``details`` still JSON-encoded. Callbacks run on the writing thread
+        and must not block.
+        """
+        self._listeners.append(callback)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every event queued before this call has been committed.
+
+        Returns False if the writer did not catch up within ``timeout``.
+        """
+        if not self._writer_running():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 10.0):
+        """Commit all queued events and stop the background writer."""
+        if not self._writer_running():
+            return
+        self._queue.put(_STOP)
+        self._writer.join(timeout)
+        self._writer_pid = None
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._writer_running() else 0
+
+    def _writer_running(self) -> bool:
+        return (self._writer_pid == os.getpid() and self._writer is not None
+                and self._writer.is_alive())
+
+    def _ensure_writer(self) -> queue.Queue:
+        # Started lazily and per process, so a writer created before a
+        # gunicorn fork is replaced in each worker.
+        if self._writer_pid != os.getpid():
+            with self._start_lock:
+                if self._writer_pid != os.getpid():
+                    self._queue = queue.Queue(self.queue_size)
+                    self._writer = threading.Thread(
+                        target=self._run_writer, args=(self._queue,),
+                        name="audit-writer", daemon=True
+                    )
+                    self._writer.start()
+                    self._writer_pid = os.getpid()
+        return self._queue
+
+    def _run_writer(self, events: queue.Queue):
+        stopping = False
+        while not stopping:
+            batch, waiters = [], []
+            item = events.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                if isinstance(item, list):
+                    batch.extend(item)
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = events.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception:
+                    logger.exception(f"Error writing {len(batch)} audit events")
+            for waiter in waiters:
+                waiter.set()
+        if self.dropped:
+            logger.warning(f"Audit queue overflowed; {self.dropped} events were dropped")
+
+    def _write_batch(self, rows):
+        by_segment = {}
+        for row in rows:
+            by_segment.setdefault(self._segment_path(row[9]), []).append(row)
+        for path, segment_rows in by_segment.items():
+            self._prepare_segment(path)
+            with self.store.connection(path, "audit_write") as conn:
+                try:
+                    committed = self._insert_rows(conn, segment_rows)
+                except Exception:
+                    if len(segment_rows) == 1:
+                        raise
+                    # Retry one by one so a bad event doesn't lose the rest of the batch
+                    committed = []
+                    for row in segment_rows:
+                        try:
+                            committed.extend(self._insert_rows(conn, [row]))
+                        except Exception:
+                            logger.exception(f"Dropping audit event that could not be stored: {row[1]}/{row[2]}")
+            if self._listeners and committed:
+                for listener in self._listeners:
+                    try:
+                        listener(committed)
+                    except Exception:
+                        logger.exception("Error in audit event listener")
+
+    def _insert_rows(self, conn, rows):
+        """Insert ``rows`` in one transaction and return them prefixed with their ids."""
+        with conn:
+            conn.executemany(_INSERT_EVENT, rows)
+            # The write lock is held until commit, so the batch got
+            # consecutive ids ending at the last inserted one
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            _update_rollups(conn, rows)
+        first_id = last_id - len(rows) + 1
+        return [(first_id + i, *row) for i, row in enumerate(rows)]
+
+    def _segment_path(self, ts: int) -> str:
+        if not self.partition_dir:
+            return self.db_file
+        day = datetime.datetime.utcfromtimestamp(ts / 1000).strftime("%Y-%m-%d")
+        return os.path.join(self.partition_dir, f"audit-{day}.db")
+
+    def _prepare_segment(self, path: str):
+        """Create the schema in the segment at ``path`` the first time it is written."""
+        if path in self._prepared:
+            return
+        with self.store.connection(path, "audit_init_schema") as conn:
+            _init_schema(conn)
+        self._prepared.add(path)
+        if self.auto_rotate and path != self.db_file and path != self._current_segment:
+            # A new day has started; seal and expire old ones off the write path
+            self._current_segment = path
+            threading.Thread(target=self._rotate_quietly, name="audit-rotate", daemon=True).start()
+
+    def segments(self, since: Optional[int] = None, until: Optional[int] = None) -> List[Segment]:
+        """Return the segments overlapping ``[since, until)`` (epoch ms), oldest first."""
+        if not self.partition_dir:
+            return [Segment(self.db_file, None, None, False)]
+        found = {}
+        for name in os.listdir(self.partition_dir):
+            match = _SEGMENT_NAME.match(name)
+            if not match:
+                continue
+            day, archived = match.groups()
+            if archived and day in found:
+                # Mid-compression both files exist; the plain one is complete
+                continue
+            start = _day_start(day)
+            found[day] = Segment(os.path.join(self.partition_dir, name), start, start + DAY_MS, bool(archived))
+        segments = [
+            segment for _, segment in sorted(found.items())
+            if (since is None or segment.end > since) and (until is None or segment.start < until)
+        ]
+        if os.path.exists(self.db_file):
+            segments.insert(0, Segment(self.db_file, None, None, False))
+        return segments
+
+    @contextlib.contextmanager
+    def _read_segment(self, segment: Segment, operation: str = "audit_read"):
+        if not segment.compressed and os.path.exists(segment.path):
+            with self.store.connection(segment.path, operation) as conn:
+                yield conn
+            return
+        # Archives (or segments compressed since they were listed) are
+        # unpacked to a temporary file for the duration of the query
+        fd, path = tempfile.mkstemp(suffix=".db")
+        try:
+            with os.fdopen(fd, "wb") as out, gzip.open(_archive_path(segment.path), "rb") as archive:
+                shutil.copyfileobj(archive, out)
+            conn = sqlite3.connect(path)
+            try:
+                yield conn
+            finally:
+                conn.close()
+        finally:
+            os.remove(path)
+
+    def rotate(self, now: Optional[float] = None) -> Dict[str, List[str]]:
+        """
+        Compress finished day segments and delete those past retention.
+
+        Safe to call from several processes at once; only one of them does
+        the work. Returns the paths that were compressed and deleted.
+        """
+        result = {"compressed": [], "deleted": []}
+        if not self.partition_dir:
+            return result
+        now_ms = int((time.time() if now is None else now) * 1000)
+        today = now_ms - now_ms % DAY_MS
+        with _rotation_lock(self.partition_dir) as acquired:
+            if not acquired:
+                return result
+            for segment in self.segments():
+                if segment.start is None:
+                    continue
+                age_days = (today - segment.start) // DAY_MS
+                if self.retention_days and age_days >= self.retention_days:
+                    self.store.discard(segment.path)
+                    _remove(segment.path)
+                    result["deleted"].append(segment.path)
+                elif (not segment.compressed and age_days >= self.compress_after_days
+                      and now_ms - segment.end >= _SEAL_GRACE_MS):
+                    self.store.discard(segment.path)
+                    _compress_segment(segment.path)
+                    result["compressed"].append(segment.path)
+        return result
+
+    def _rotate_quietly(self):
+        try:
+            self.rotate()
+        except Exception:
+            logger.exception("Error rotating audit segments")
+
     def get_events(self, 
                   event_type: Optional[str] = None,
                   user_id: Optional[str] = None,
                   agent_id: Optional[str] = None,
                   status: Optional[str] = None,
-                  limit: int = 100):
+                  limit: int = 100,
+                  cursor: Optional[str] = None,
+                  since: Optional[Union[float, str]] = None,
+                  until: Optional[Union[float, str]] = None):
         """
         Retrieve audit events with optional filtering
         """
+        events, _ = self.get_events_page(
+            event_type=event_type, user_id=user_id, agent_id=agent_id, status=status,
+            limit=limit, cursor=cursor, since=since, until=until
+        )
+        return events
+
+    def get_events_page(self,
+                        event_type: Optional[str] = None,
+                        user_id: Optional[str] = None,
+                        agent_id: Optional[str] = None,
+                        status: Optional[str] = None,
+                        limit: int = 100,
+                        cursor: Optional[str] = None,
+                        since: Optional[Union[float, str]] = None,
+                        until: Optional[Union[float, str]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Retrieve one page of audit events, newest first.
+
+        Returns the events and a cursor for the next page, or None on the last
+        page. Pages are fetched by seeking past the cursor's (ts, id) position,
+        so deep pages cost the same as the first one. ``since`` and ``until``
+        accept epoch seconds or ISO 8601 strings (UTC).
+        """
         try:
-            conn = self._get_db()
-            cursor = conn.cursor()
-            
-            query = "SELECT * FROM audit_logs WHERE 1=1"
-            params = []
-            
-            if event_type:
-                query += " AND event_type = ?"
-                params.append(event_type)
-            if user_id:
-                query += " AND user_id = ?"
-                params.append(user_id)
-            if agent_id:
-                query += " AND agent_id = ?"
-                params.append(agent_id)
-            if status:
-                query += " AND status = ?"
-                params.append(status)
-                
-            query += " ORDER BY timestamp DESC LIMIT ?"
-            params.append(limit)
+            self.flush()
+            since_ms = to_millis(since) if since is not None else None
+            until_ms = to_millis(until) if until is not None else None
+            where, params = _event_filters(event_type, user_id, agent_id, status, since_ms, until_ms)
+            if cursor:
+                position = decode_cursor(cursor)
+                where += " AND (ts, id) < (?, ?)"
+                params.extend(position)
+                until_ms = position[0] + 1 if until_ms is None else min(until_ms, position[0] + 1)
+            limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+            query = (f"SELECT {_EVENT_COLUMNS} FROM audit_logs WHERE {where} "
+                     "ORDER BY ts DESC, id DESC LIMIT ?")
             
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-            
-            # Convert rows to list of dictionaries
-            events = []
-            for row in rows:
-                event = {
-                    "id": row[0],
-                    "timestamp": row[1],
-                    "event_type": row[2],
-                    "action": row[3],
-                    "status": row[4],
-                    "user_id": row[5],
-                    "agent_id": row[6],
-                    "details": json.loads(row[7]) if row[7] else None,
-                    "ip_address": row[8],
-                    "token_id": row[9]
-                }
-                events.append(event)
-                
-            return events
+            # Segments cover disjoint time ranges, so reading them newest
+            # first yields rows already in order
+            rows = []
+            for segment in reversed(self.segments(since_ms, until_ms)):
+                with self._read_segment(segment) as conn:
+                    rows.extend(conn.execute(query, [*params, limit + 1 - len(rows)]).fetchall())
+                if len(rows) > limit:
+                    break
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor(rows[-1][10], rows[-1][0])
+            return [_row_to_event(row) for row in rows], next_cursor
         except Exception as e:
-            logging.error(f"Error retrieving audit events: {str(e)}")
+            logger.error(f"Error retrieving audit events: {str(e)}")
             raise
 
+    def events_after(self,
+                     cursor: str,
+                     event_type: Optional[str] = None,
+                     user_id: Optional[str] = None,
+                     agent_id: Optional[str] = None,
+                     limit: int = MAX_PAGE_SIZE) -> List[tuple]:
+        """
+        Return up to ``limit`` event rows positioned after ``cursor``, oldest first.
+
+        Rows are tuples in ``_EVENT_COLUMNS`` order, as passed to listeners.
+        """
+        after = decode_cursor(cursor)
+        where, params = _event_filters(event_type, user_id, agent_id, None, after[0], None)
+        where += " AND (ts, id) > (?, ?)"
+        params.extend(after)
+        query = f"SELECT {_EVENT_COLUMNS} FROM audit_logs WHERE {where} ORDER BY ts, id LIMIT ?"
+        self.flush()
+        rows = []
+        for segment in self.segments(after[0], None):
+            with self._read_segment(segment) as conn:
+                rows.extend(conn.execute(query, [*params, limit - len(rows)]).fetchall())
+            if len(rows) >= limit:
+                break
+        return rows
+
+    def committed_since(self, positions: Optional[Dict[str, int]] = None,
+                        limit: int = MAX_PAGE_SIZE) -> Tuple[List[tuple], Dict[str, int]]:
+        """
+        Return rows committed by any process after ``positions``, and the new positions.
+
+        Positions map each segment still being written to the last id read
+        from it; ids follow commit order within a segment. Without
+        ``positions`` no rows are returned, only the current ends, so a
+        caller can follow the log from now on. At most ``limit`` rows are
+        read per segment.
+        """
+        if self.partition_dir:
+            # Events land in the segment of their day, so yesterday's may
+            # still be written to just after midnight
+            since = int(time.time() * 1000) - DAY_MS
+            segments = [s for s in self.segments(since) if s.start is not None and not s.compressed]
+        else:
+            segments = self.segments()
+        rows, ends = [], {}
+        for segment in segments:
+            with self._read_segment(segment) as conn:
+                if positions is None:
+                    ends[segment.path] = conn.execute("SELECT COALESCE(MAX(id), 0) FROM audit_logs").fetchone()[0]
+                    continue
+                after = positions.get(segment.path, 0)
+                found = conn.execute(f"SELECT {_EVENT_COLUMNS} FROM audit_logs WHERE id > ? ORDER BY id LIMIT ?",
+                                     (after, limit)).fetchall()
+            rows.extend(found)
+            ends[segment.path] = found[-1][0] if found else after
+        return rows, ends
+
+    def get_metrics(self,
+                    group_by=("event_type", "status"),
+                    event_type: Optional[str] = None,
+                    status: Optional[str] = None,
+                    agent_id: Optional[str] = None,
+                    since: Optional[Union[float, str]] = None,
+                    until: Optional[Union[float, str]] = None) -> List[Dict[str, Any]]:
+        """
+        Count events per group from the per-minute rollups.
+
+        ``group_by`` is any combination of ``ROLLUP_DIMENSIONS``; ``minute``
+        groups are reported as epoch seconds. Time bounds are applied at
+        minute granularity. Raises ValueError for unknown dimensions.
+        """
+        unknown = set(group_by) - set(ROLLUP_DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Unknown group_by dimensions: {sorted(unknown)}")
+        group_by = list(group_by)
+        where, params, since_ms, until_ms = _rollup_filters(
+            since, until, event_type=event_type, status=status, agent_id=agent_id
+        )
+        columns = ", ".join(group_by)
+        query = (f"SELECT {columns + ', ' if columns else ''}SUM(count) FROM audit_rollups "
+                 f"WHERE {where}" + (f" GROUP BY {columns}" if columns else ""))
+        totals = self._sum_rollups(query, params, since_ms, until_ms)
+        rows = []
+        for key, count in sorted(totals.items()):
+            row = dict(zip(group_by, key))
+            if "minute" in row:
+                row["minute"] *= 60
+            if "agent_id" in row:
+                row["agent_id"] = row["agent_id"] or None
+            row["count"] = count
+            rows.append(row)
+        return rows
+
+    def get_top_ips(self,
+                    limit: int = 10,
+                    since: Optional[Union[float, str]] = None,
+                    until: Optional[Union[float, str]] = None) -> List[Dict[str, Any]]:
+        """
+        Return the ``limit`` IP addresses with the most events in the range.
+
+        Raises ValueError unless ``limit`` is positive.
+        """
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        where, params, since_ms, until_ms = _rollup_filters(since, until)
+        query = (f"SELECT ip_address, SUM(count) FROM audit_ip_rollups "
+                 f"WHERE {where} AND ip_address != '' GROUP BY ip_address")
+        totals = self._sum_rollups(query, params, since_ms, until_ms)
+        top = sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [{"ip_address": key[0], "count": count} for key, count in top]
+
+    def _sum_rollups(self, query, params, since_ms, until_ms) -> Dict[tuple, int]:
+        # Rollups live in each segment; add up the partial counts
+        self.flush()
+        totals = collections.Counter()
+        for segment in self.segments(since_ms, until_ms):
+            with self._read_segment(segment) as conn:
+                for row in conn.execute(query, params):
+                    totals[tuple(row[:-1])] += row[-1]
+        return totals
+
+    def export_events(self,
+                      event_type: Optional[str] = None,
+                      user_id: Optional[str] = None,
+                      agent_id: Optional[str] = None,
+                      status: Optional[str] = None,
+                      since: Optional[Union[float, str]] = None,
+                      until: Optional[Union[float, str]] = None,
+                      chunk_size: int = 1000) -> Iterator[str]:
+        """
+        Stream matching audit events, oldest first, as newline-delimited JSON.
+
+        Returns an iterator of text chunks holding up to ``chunk_size`` lines
+        each. Rows are read in keyset-ordered chunks on one pooled connection,
+        so memory use does not depend on the size of the export and no read
+        transaction is held open between chunks. The stored ``details`` JSON
+        is copied into each line as-is. Invalid filters raise ValueError
+        before anything is streamed.
+        """
+        since_ms = to_millis(since) if since is not None else None
+        until_ms = to_millis(until) if until is not None else None
+        where, params = _event_filters(event_type, user_id, agent_id, status, since_ms, until_ms)
+        self.flush()
+        return self._export_chunks(self.segments(since_ms, until_ms), where, params, chunk_size)
+
+    def _export_chunks(self, segments, where, params, chunk_size):
+        for segment in segments:
+            with self._read_segment(segment, "audit_export") as conn:
+                after = ()
+                while True:
+                    query = f"SELECT {_EVENT_COLUMNS} FROM audit_logs WHERE {where}"
+                    if after:
+                        query += " AND (ts, id) > (?, ?)"
+                    query += " ORDER BY ts, id LIMIT ?"
+                    rows = conn.execute(query, [*params, *after, chunk_size]).fetchall()
+                    if rows:
+                        yield "".join(row_to_json(row) + "\n" for row in rows)
+                    if len(rows) < chunk_size:
+                        break
+                    after = (rows[-1][10], rows[-1][0])
+
+
+def to_millis(value: Union[float, str]) -> int:
+    """Convert epoch seconds or an ISO 8601 string (UTC if naive) to epoch ms."""
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value * 1000)
+    if not isinstance(value, str):
+        raise ValueError(f"Unsupported time value: {value!r}")
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def encode_cursor(ts: int, event_id: int) -> str:
+    return f"{ts}:{event_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """Parse a pagination cursor, raising ValueError if it is malformed."""
+    if not isinstance(cursor, str):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    ts, event_id = cursor.split(":")
+    return int(ts), int(event_id)
+
+
+def _event_row(event_type, action, status, user_id=None, agent_id=None,
+               details=None, ip_address=None, token_id=None):
+    now = time.time()
+    timestamp = datetime.datetime.utcfromtimestamp(now).isoformat()
+    if details is not None and not isinstance(details, str):
+        details = json.dumps(details, default=str)
+    return (timestamp, _text(event_type), _text(action), _text(status), _text(user_id),
+            _text(agent_id), details, _text(ip_address), _text(token_id), int(now * 1000))
+
+
+def _text(value):
+    # Fields often come straight from request bodies; store anything that
+    # isn't a string as JSON text rather than failing the insert
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+
+def _event_filters(event_type, user_id, agent_id, status, since_ms, until_ms):
+    where = "1=1"
+    params = []
+    for column, value in (("event_type", event_type), ("user_id", user_id),
+                          ("agent_id", agent_id), ("status", status)):
+        if value:
+            where += f" AND {column} = ?"
+            params.append(value)
+    if since_ms is not None:
+        where += " AND ts >= ?"
+        params.append(since_ms)
+    if until_ms is not None:
+        where += " AND ts < ?"
+        params.append(until_ms)
+    return where, params
+
+
+def _update_rollups(conn, rows):
+    counts = collections.Counter()
+    ip_counts = collections.Counter()
+    for row in rows:
+        minute = row[9] // MINUTE_MS
+        counts[(minute, row[1], row[3], row[5] or "")] += 1
+        if row[7]:
+            ip_counts[(minute, row[7])] += 1
+    conn.executemany(_UPSERT_ROLLUP, [(*key, count) for key, count in counts.items()])
+    conn.executemany(_UPSERT_IP_ROLLUP, [(*key, count) for key, count in ip_counts.items()])
+
+
+def _rollup_filters(since, until, **filters):
+    since_ms = to_millis(since) if since is not None else None
+    until_ms = to_millis(until) if until is not None else None
+    where = "1=1"
+    params = []
+    for column, value in filters.items():
+        if value:
+            where += f" AND {column} = ?"
+            params.append(value)
+    if since_ms is not None:
+        where += " AND minute >= ?"
+        params.append(since_ms // MINUTE_MS)
+    if until_ms is not None:
+        where += " AND minute < ?"
+        params.append(-(-until_ms // MINUTE_MS))
+    return where, params, since_ms, until_ms
+
+
+def _init_schema(conn):
+    cursor = conn.cursor()
+    existing = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS audit_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            action TEXT NOT NULL,
+            status TEXT NOT NULL,
+            user_id TEXT,
+            agent_id TEXT,
+            details TEXT,
+            ip_address TEXT,
+            token_id TEXT,
+            ts INTEGER
+        )
+    """)
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(audit_logs)")]
+    if "ts" not in columns:
+        # Older databases only have the ISO timestamp; derive epoch ms from it
+        cursor.execute("ALTER TABLE audit_logs ADD COLUMN ts INTEGER")
+        cursor.execute("""
+            UPDATE audit_logs
+            SET ts = COALESCE(CAST((julianday(timestamp) - 2440587.5) * 86400000 AS INTEGER), 0)
+        """)
+    for name, columns in _INDEXES.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON audit_logs ({columns})")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS audit_rollups (
+            minute INTEGER NOT NULL,
+            event_type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            agent_id TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (minute, event_type, status, agent_id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS audit_ip_rollups (
+            minute INTEGER NOT NULL,
+            ip_address TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (minute, ip_address)
+        ) WITHOUT ROWID
+    """)
+    # Seed new counter tables from events logged before they existed
+    if "audit_rollups" not in existing:
+        cursor.execute(f"""
+            INSERT INTO audit_rollups (minute, event_type, status, agent_id, count)
+            SELECT ts / {MINUTE_MS}, event_type, status, COALESCE(agent_id, ''), COUNT(*)
+            FROM audit_logs GROUP BY 1, 2, 3, 4
+        """)
+    if "audit_ip_rollups" not in existing:
+        cursor.execute(f"""
+            INSERT INTO audit_ip_rollups (minute, ip_address, count)
+            SELECT ts / {MINUTE_MS}, ip_address, COUNT(*)
+            FROM audit_logs WHERE ip_address IS NOT NULL AND ip_address != '' GROUP BY 1, 2
+        """)
+    conn.commit()
+
+
+def _day_start(day: str) -> int:
+    parsed = datetime.datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+
+def _archive_path(path: str) -> str:
+    return path if path.endswith(".gz") else path + ".gz"
+
+
+def _compress_segment(path: str):
+    conn = sqlite3.connect(path)
+    try:
+        # Leave WAL mode so the archive is a single self-contained file
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    partial = f"{path}.gz.{os.getpid()}.tmp"
+    with open(path, "rb") as src, gzip.open(partial, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(partial, _archive_path(path))
+    _remove(path)
+
+
+def _remove(path: str):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path + suffix)
+
+
+@contextlib.contextmanager
+def _rotation_lock(directory: str):
+    """Yield True if this process won the non-blocking rotation lock."""
+    if fcntl is None:
+        yield True
+        return
+    with open(os.path.join(directory, ".rotate.lock"), "a") as lock:
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def _row_to_event(row) -> Dict[str, Any]:
+    return {
+        "id": row[0],
+        "timestamp": row[1],
+        "event_type": row[2],
+        "action": row[3],
+        "status": row[4],
+        "user_id": row[5],
+        "agent_id": row[6],
+        "details": json.loads(row[7]) if row[7] else None,
+        "ip_address": row[8],
+        "token_id": row[9],
+        "ts": row[10]
+    }
+
+def row_to_json(row) -> str:
+    """Encode an event row as a JSON object, copying ``details`` verbatim."""
+    # Encode every column except details, then splice the stored details JSON
+    # in rather than decoding and re-encoding it.
+    head = json.dumps({
+        "id": row[0],
+        "timestamp": row[1],
+        "event_type": row[2],
+        "action": row[3],
+        "status": row[4],
+        "user_id": row[5],
+        "agent_id": row[6],
+        "ip_address": row[8],
+        "token_id": row[9],
+        "ts": row[10]
+    })
+    return f'{head[:-1]}, "details": {row[7] or "null"}}}'
+
+
 # Create a singleton instance
-audit_logger = AuditLogger() 
\ No newline at end of file
+audit_logger = AuditLogger(
+    db_file=os.environ.get("PROXYME_AUDIT_DB_FILE", "audit.db"),
+    async_writes=os.environ.get("PROXYME_AUDIT_ASYNC", "1") == "1",
+    batch_size=int(os.environ.get("PROXYME_AUDIT_BATCH_SIZE", 256)),
+    flush_interval=float(os.environ.get("PROXYME_AUDIT_FLUSH_INTERVAL", 0.05)),
+    queue_size=int(os.environ.get("PROXYME_AUDIT_QUEUE_SIZE", 10000)),
+    overflow=os.environ.get("PROXYME_AUDIT_OVERFLOW", "block"),
+    partition_dir=os.environ.get("PROXYME_AUDIT_PARTITION_DIR") or None,
+    compress_after_days=int(os.environ.get("PROXYME_AUDIT_COMPRESS_AFTER_DAYS", 2)),
+    retention_days=int(os.environ.get("PROXYME_AUDIT_RETENTION_DAYS", 0)) or None,
+    pool_size=int(os.environ.get("PROXYME_AUDIT_DB_POOL_SIZE", 4)),
+)
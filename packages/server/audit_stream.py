@@ -0,0 +1,197 @@
+"""Live fan-out of committed audit events to Server-Sent Events subscribers."""
+import collections
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from .audit_logger import MAX_PAGE_SIZE, AuditLogger, audit_logger, encode_cursor, row_to_json
+
+logger = logging.getLogger(__name__)
+
+# Column positions in audit event rows
+_EVENT_TYPE, _USER_ID, _AGENT_ID, _TS = 2, 5, 6, 10
+
+
+class Subscription:
+    """
+    Events matching one subscriber's filters, buffered until sent.
+
+    The buffer holds at most ``buffer_size`` events. A subscriber that falls
+    further behind is marked ``overflowed`` and stops receiving events; its
+    stream should end so the client reconnects and resumes from the last
+    event id it saw.
+    """
+
+    def __init__(self, event_type: Optional[str] = None, user_id: Optional[str] = None,
+                 agent_id: Optional[str] = None, buffer_size: int = 1000):
+        self.event_type = event_type
+        self.user_id = user_id
+        self.agent_id = agent_id
+        self.buffer_size = buffer_size
+        self.overflowed = False
+        self.created_ms = int(time.time() * 1000)
+        self._events = collections.deque()
+        self._ready = threading.Condition()
+
+    def matches(self, row) -> bool:
+        return ((not self.event_type or row[_EVENT_TYPE] == self.event_type)
+                and (not self.user_id or row[_USER_ID] == self.user_id)
+                and (not self.agent_id or row[_AGENT_ID] == self.agent_id))
+
+    def offer(self, rows) -> None:
+        matching = [row for row in rows if self.matches(row)]
+        if not matching or self.overflowed:
+            return
+        with self._ready:
+            if len(self._events) + len(matching) > self.buffer_size:
+                self.overflowed = True
+            else:
+                self._events.extend(matching)
+            self._ready.notify()
+
+    def take(self, timeout: float) -> List[tuple]:
+        """Wait up to ``timeout`` seconds for events and return all buffered ones."""
+        with self._ready:
+            if not self._events and not self.overflowed:
+                self._ready.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+
+class AuditBroadcaster:
+    """
+    Registry of live subscribers.
+
+    Either register ``publish`` as an audit listener, which only sees events
+    written by this process, or call ``follow`` to poll the audit database
+    for events committed by every process.
+    """
+
+    def __init__(self, buffer_size: int = 1000):
+        self.buffer_size = buffer_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._source = None
+        self._follower_pid = None
+
+    def follow(self, audit_log: AuditLogger, interval: float = 0.5) -> None:
+        """
+        Publish events committed to ``audit_log``'s database by any process.
+
+        New rows are read every ``interval`` seconds by a background thread,
+        started in each process when its first subscriber arrives.
+        """
+        self._source = (audit_log, interval)
+
+    def subscribe(self, event_type: Optional[str] = None, user_id: Optional[str] = None,
+                  agent_id: Optional[str] = None) -> Subscription:
+        self._ensure_follower()
+        subscription = Subscription(event_type, user_id, agent_id, self.buffer_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, rows) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.offer(rows)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def _ensure_follower(self) -> None:
+        # Per process, so a follower started before a gunicorn fork is
+        # replaced in each worker
+        if self._source is None or self._follower_pid == os.getpid():
+            return
+        with self._lock:
+            if self._follower_pid != os.getpid():
+                audit_log, _ = self._source
+                _, positions = audit_log.committed_since()
+                self._follower_pid = os.getpid()
+                threading.Thread(target=self._follow_loop, args=(positions,),
+                                 name="audit-follow", daemon=True).start()
+
+    def _follow_loop(self, positions) -> None:
+        audit_log, interval = self._source
+        pid = os.getpid()
+        while self._follower_pid == pid:
+            time.sleep(interval)
+            while True:
+                try:
+                    rows, positions = audit_log.committed_since(positions)
+                except sqlite3.Error:
+                    # E.g. a day segment created but not yet initialized
+                    logger.warning("Error reading new audit events", exc_info=True)
+                    break
+                if rows:
+                    self.publish(rows)
+                if len(rows) < MAX_PAGE_SIZE:
+                    break
+
+
+def format_sse(row) -> str:
+    """Render an event row as an SSE message whose id is its resume cursor."""
+    return f"id: {encode_cursor(row[_TS], row[0])}\nevent: audit\ndata: {row_to_json(row)}\n\n"
+
+
+def sse_events(logger, subscription: Subscription, last: Optional[Tuple[int, int]] = None,
+               keepalive: float = 15.0, retry_ms: int = 3000) -> Iterator[str]:
+    """
+    Yield SSE messages for ``subscription``, first replaying stored events after ``last``.
+
+    ``last`` is the (ts, id) position of the last event the client saw. The
+    subscription must already be registered so that events committed while
+    replaying are buffered rather than missed. The stream ends when the
+    subscriber overflows its buffer; the client then reconnects with the
+    last id it received and the gap is replayed from storage.
+    """
+    yield f"retry: {retry_ms}\n\n"
+    start = last
+    # Events committed during the replay can also be buffered. Buffered events
+    # were committed after subscribing, so only recent replayed ones are kept
+    # to check against; with several writers commit order isn't time order,
+    # hence the margin.
+    recent = subscription.created_ms - 60000
+    replayed = set()
+    while last is not None:
+        rows = logger.events_after(encode_cursor(*last), subscription.event_type,
+                                   subscription.user_id, subscription.agent_id)
+        for row in rows:
+            yield format_sse(row)
+        replayed.update((row[_TS], row[0]) for row in rows if row[_TS] >= recent)
+        if rows:
+            last = (rows[-1][_TS], rows[-1][0])
+        if len(rows) < MAX_PAGE_SIZE:
+            break
+    while True:
+        rows = subscription.take(keepalive)
+        fresh = [row for row in rows
+                 if (start is None or (row[_TS], row[0]) > start) and (row[_TS], row[0]) not in replayed]
+        for row in fresh:
+            yield format_sse(row)
+        if subscription.overflowed:
+            return
+        if not rows:
+            yield ": keep-alive\n\n"
+
+
+# Create a singleton instance fed by the audit logger. By default it polls the
+# audit database, so a stream served by any worker carries every worker's
+# events. An interval of 0 publishes this process's own events as they are
+# committed instead, which only suits a single worker.
+audit_broadcaster = AuditBroadcaster()
+_poll_interval = float(os.environ.get("PROXYME_AUDIT_STREAM_POLL_INTERVAL", 0.5))
+if _poll_interval > 0:
+    audit_broadcaster.follow(audit_logger, _poll_interval)
+else:
+    audit_logger.add_listener(audit_broadcaster.publish)
@@ -0,0 +1,79 @@
+"""Read-through cache of registered clients and their granted scopes."""
+import time
+from typing import Callable, Dict, FrozenSet, Iterable, NamedTuple, Optional, Tuple
+
+from .cache import LRUCache
+
+# Cached in place of a client that isn't registered
+_UNKNOWN = None
+
+
+class Client(NamedTuple):
+    client_id: str
+    scopes: Tuple[str, ...]
+    scope_set: FrozenSet[str]
+
+    @classmethod
+    def from_row(cls, client_id: str, scopes: str) -> "Client":
+        parsed = tuple(scopes.split(",")) if scopes else ()
+        return cls(client_id, parsed, frozenset(parsed))
+
+
+class ClientRegistry:
+    """
+    Registered clients keyed by ``client_id``, loaded on a miss.
+
+    ``load_clients`` maps a collection of ids to the comma-joined scopes of
+    those that are registered, as ``AuthStore.load_clients`` does.
+
+    Scopes are parsed once when a client is loaded. Unknown ids are cached
+    too, for ``negative_ttl`` seconds, so repeated requests for a bad agent
+    id don't reach the database. Call ``invalidate`` whenever a client row is
+    written; ``ttl`` bounds how long other processes serve a stale entry.
+    """
+
+    def __init__(self, load_clients: Callable, max_size: int = 10000, ttl: float = 300,
+                 negative_ttl: float = 5):
+        self._load_clients = load_clients
+        self.negative_ttl = negative_ttl
+        self._cache = LRUCache(max_size=max_size, ttl=ttl)
+
+    def get(self, client_id: str) -> Optional[Client]:
+        return self.get_many([client_id]).get(client_id)
+
+    def get_many(self, client_ids: Iterable[str]) -> Dict[str, Client]:
+        """Return the registered clients among ``client_ids`` using one query for all misses."""
+        found, missing = {}, set()
+        for client_id in client_ids:
+            if client_id in found or client_id in missing:
+                continue
+            client = self._cache.get(client_id, default=False)
+            if client is False:
+                missing.add(client_id)
+            elif client is not _UNKNOWN:
+                found[client_id] = client
+        if missing:
+            loaded = self._load(missing)
+            unknown_until = time.time() + self.negative_ttl
+            for client_id in missing:
+                client = loaded.get(client_id)
+                if client is None:
+                    self._cache.put(client_id, _UNKNOWN, expires_at=unknown_until)
+                else:
+                    self._cache.put(client_id, client)
+                    found[client_id] = client
+        return found
+
+    def invalidate(self, client_ids: Iterable[str]) -> None:
+        for client_id in client_ids:
+            self._cache.discard(client_id)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+    def _load(self, client_ids) -> Dict[str, Client]:
+        return {client_id: Client.from_row(client_id, scopes)
+                for client_id, scopes in self._load_clients(client_ids).items()}
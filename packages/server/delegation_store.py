@@ -0,0 +1,105 @@
+"""Bounded in-memory store for issued delegation tokens."""
+import hashlib
+import heapq
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+def token_digest(token: str) -> bytes:
+    """Return the fixed-size key used to index a token instead of the full JWT."""
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+class DelegationStore:
+    """
+    Delegations keyed by token digest, evicted in expiry order.
+
+    Expired entries are dropped as new tokens are stored. When the store is
+    full the entry closest to expiry is evicted to make room, so memory stays
+    bounded by ``max_size`` no matter how many tokens are issued.
+    """
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._entries: Dict[bytes, Any] = {}
+        # Min-heap of (expires_at, key). Entries removed from ``_entries`` are
+        # left in place and skipped when they reach the top.
+        self._expiry = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def put(self, token: str, delegation) -> None:
+        key = token_digest(token)
+        with self._lock:
+            self._purge_expired(time.time())
+            if key not in self._entries:
+                while self._entries and len(self._entries) >= self.max_size:
+                    self._evict_next()
+            self._entries[key] = delegation
+            heapq.heappush(self._expiry, (delegation.expires_at, key))
+            if len(self._expiry) > 2 * self.max_size:
+                self._compact()
+
+    def get(self, token: str):
+        # Reads are lock-free; the counters are best-effort under contention.
+        delegation = self._entries.get(token_digest(token))
+        if delegation is None or not delegation.is_valid():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return delegation
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._expiry = []
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _is_live(self, expires_at, key: bytes) -> bool:
+        delegation = self._entries.get(key)
+        return delegation is not None and delegation.expires_at == expires_at
+
+    def _purge_expired(self, now: float) -> int:
+        removed = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry)
+            if self._is_live(expires_at, key):
+                del self._entries[key]
+                removed += 1
+        self.expirations += removed
+        return removed
+
+    def _evict_next(self) -> Optional[bytes]:
+        while self._expiry:
+            expires_at, key = heapq.heappop(self._expiry)
+            if self._is_live(expires_at, key):
+                del self._entries[key]
+                self.evictions += 1
+                return key
+        # Heap and entries disagree; fall back to dropping an arbitrary entry.
+        key = next(iter(self._entries))
+        del self._entries[key]
+        self.evictions += 1
+        return key
+
+    def _compact(self) -> None:
+        self._expiry = [(d.expires_at, key) for key, d in self._entries.items()]
+        heapq.heapify(self._expiry)
@@ -0,0 +1,235 @@
+"""Asymmetric signing keys with kid tagging, rotation and a published JWKS."""
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import jwt
+
+try:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+except ImportError:  # pragma: no cover - optional dependency
+    serialization = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+ASYMMETRIC_ALGORITHMS = ("RS256", "ES256", "EdDSA")
+
+
+def generate_private_key(algorithm: str):
+    if algorithm == "RS256":
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    if algorithm == "ES256":
+        return ec.generate_private_key(ec.SECP256R1())
+    if algorithm == "EdDSA":
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f"Unsupported signing algorithm: {algorithm}")
+
+
+def key_algorithm(private_key) -> str:
+    """Return the JWS algorithm a private key is used with."""
+    if isinstance(private_key, rsa.RSAPrivateKey):
+        return "RS256"
+    if isinstance(private_key, ec.EllipticCurvePrivateKey):
+        return "ES256"
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return "EdDSA"
+    raise ValueError(f"Unsupported key type: {type(private_key).__name__}")
+
+
+class SigningKey:
+    """A private key loaded once, with its ``kid`` and public JWK."""
+    __slots__ = ("kid", "algorithm", "private_key", "public_key", "created_at", "jwk")
+
+    def __init__(self, kid: str, algorithm: str, private_key, created_at: int):
+        self.kid = kid
+        self.algorithm = algorithm
+        self.private_key = private_key
+        self.public_key = private_key.public_key()
+        self.created_at = created_at
+        self.jwk = jwt.get_algorithm_by_name(algorithm).to_jwk(self.public_key, as_dict=True)
+        self.jwk.update({"kid": kid, "alg": algorithm, "use": "sig"})
+
+
+class KeyManager:
+    """
+    Signing keys for one algorithm, rotated every ``rotation_interval`` seconds.
+
+    A key's ``created_at`` is when it starts signing. The next key is created
+    and published in the JWKS ``publish_ahead`` seconds before that, so
+    workers and resource servers caching the JWKS know it before any token
+    carries its kid; ``publish_ahead`` should exceed ``refresh_interval`` plus
+    the JWKS cache lifetime. A key replaced by a newer one stays in the JWKS
+    for ``overlap`` seconds so tokens it signed keep verifying; ``overlap``
+    should be at least the token lifetime.
+
+    With ``key_dir`` the keys are PEM files shared by every worker: whichever
+    worker first sees a rotation is due creates the next key, and the others
+    load it on their next refresh. A token with a kid this process doesn't
+    know also triggers a reload, at most once per ``kid_refresh_interval``
+    seconds. Without ``key_dir`` keys live only in this process, which only
+    suits a single worker.
+    """
+
+    def __init__(self, algorithm: str = "RS256", key_dir: Optional[str] = None,
+                 rotation_interval: float = 30 * 86400, overlap: float = 86400,
+                 refresh_interval: float = 60, publish_ahead: float = 600,
+                 kid_refresh_interval: float = 1):
+        if algorithm not in ASYMMETRIC_ALGORITHMS:
+            raise ValueError(f"Unsupported signing algorithm: {algorithm}")
+        if serialization is None:
+            raise RuntimeError(f"{algorithm} signing requires the 'cryptography' package")
+        self.algorithm = algorithm
+        self.key_dir = key_dir
+        self.rotation_interval = rotation_interval
+        self.overlap = overlap
+        self.refresh_interval = refresh_interval
+        self.publish_ahead = publish_ahead
+        self.kid_refresh_interval = kid_refresh_interval
+        self._keys: List[SigningKey] = []  # oldest first
+        self._by_kid: Dict[str, SigningKey] = {}
+        self._jwks: Dict[str, Any] = {"keys": []}
+        self._lock = threading.Lock()
+        self._next_refresh = 0.0
+        self._next_kid_refresh = 0.0
+        if key_dir:
+            os.makedirs(key_dir, exist_ok=True)
+        self.refresh()
+
+    def signing_key(self) -> SigningKey:
+        """Return the active key, rotating or reloading keys when due."""
+        now = time.time()
+        if now >= self._next_refresh:
+            self.refresh(now)
+        keys = self._keys
+        return next((key for key in reversed(keys) if key.created_at <= now), keys[0])
+
+    def verification_key(self, kid: Optional[str]) -> Optional[SigningKey]:
+        key = self._by_kid.get(kid)
+        if key is None and kid is not None and self.refresh_due(kid):
+            self.refresh()
+            key = self._by_kid.get(kid)
+        return key
+
+    def refresh_due(self, kid: Optional[str] = None) -> bool:
+        """
+        Whether looking up ``kid``, or signing, would reload keys first.
+
+        A kid that isn't known may belong to a key another worker has just
+        created, so it forces a reload unless one ran within
+        ``kid_refresh_interval`` seconds.
+        """
+        now = time.time()
+        if now >= self._next_refresh:
+            return True
+        return kid is not None and kid not in self._by_kid and now >= self._next_kid_refresh
+
+    def jwks(self) -> Dict[str, Any]:
+        if time.time() >= self._next_refresh:
+            self.refresh()
+        return self._jwks
+
+    def refresh(self, now: Optional[float] = None) -> None:
+        """Load keys, create the next one if rotation is due and drop expired ones."""
+        now = time.time() if now is None else now
+        with self._lock, self._dir_lock():
+            keys = self._load() if self.key_dir else list(self._keys)
+            if not keys or keys[-1].algorithm != self.algorithm:
+                # Nothing can hold the kid of a new algorithm's key yet
+                keys.append(self._create(int(now)))
+            elif keys[-1].created_at + self.rotation_interval <= now + self.publish_ahead:
+                keys.append(self._create(max(int(now + self.publish_ahead), keys[-1].created_at + 1)))
+            # A key is retired once its successor has been signing for the overlap
+            live = [key for key, successor in zip(keys, keys[1:])
+                    if successor.created_at + self.overlap > now]
+            for key in keys[:len(keys) - 1]:
+                if key not in live:
+                    self._remove(key)
+            self._publish(live + keys[-1:])
+            self._next_refresh = now + self.refresh_interval
+            self._next_kid_refresh = now + self.kid_refresh_interval
+
+    def rotate(self, now: Optional[float] = None) -> SigningKey:
+        """Publish a new key now; it starts signing ``publish_ahead`` seconds later."""
+        now = time.time() if now is None else now
+        with self._lock, self._dir_lock():
+            keys = self._load() if self.key_dir else list(self._keys)
+            created_at = int(now + self.publish_ahead)
+            keys.append(self._create(max(created_at, keys[-1].created_at + 1 if keys else 0)))
+            self._publish(keys)
+            return keys[-1]
+
+    def _publish(self, keys: List[SigningKey]) -> None:
+        self._keys = keys
+        self._by_kid = {key.kid: key for key in keys}
+        self._jwks = {"keys": [key.jwk for key in reversed(keys)]}
+
+    def _create(self, created_at: int) -> SigningKey:
+        kid = f"{created_at}-{os.urandom(4).hex()}"
+        key = SigningKey(kid, self.algorithm, generate_private_key(self.algorithm), created_at)
+        if self.key_dir:
+            pem = key.private_key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+            path = os.path.join(self.key_dir, f"{kid}.pem")
+            tmp_path = f"{path}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(pem)
+            os.replace(tmp_path, path)
+        return key
+
+    def _load(self) -> List[SigningKey]:
+        # Reuse already-parsed key objects; only new files are read
+        keys = []
+        for name in os.listdir(self.key_dir):
+            if not name.endswith(".pem"):
+                continue
+            kid = name[:-4]
+            key = self._by_kid.get(kid)
+            if key is None:
+                try:
+                    created_at = int(kid.split("-", 1)[0])
+                    with open(os.path.join(self.key_dir, name), "rb") as f:
+                        private_key = serialization.load_pem_private_key(f.read(), password=None)
+                    key = SigningKey(kid, key_algorithm(private_key), private_key, created_at)
+                except (ValueError, TypeError, OSError):
+                    continue
+            keys.append(key)
+        keys.sort(key=lambda key: key.created_at)
+        return keys
+
+    def _remove(self, key: SigningKey) -> None:
+        if self.key_dir:
+            try:
+                os.remove(os.path.join(self.key_dir, f"{key.kid}.pem"))
+            except FileNotFoundError:
+                pass
+
+    def _dir_lock(self):
+        return _DirLock(self.key_dir)
+
+
+class _DirLock:
+    """Exclusive ``flock`` on the key directory's lock file, if there is one."""
+
+    def __init__(self, key_dir: Optional[str]):
+        self._path = os.path.join(key_dir, ".lock") if key_dir and fcntl else None
+        self._file = None
+
+    def __enter__(self):
+        if self._path:
+            self._file = open(self._path, "a")
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
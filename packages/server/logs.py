@@ -0,0 +1,200 @@
+"""
+Structured, sampled logging that keeps formatting off the request thread.
+
+Code logs named events with keyword fields::
+
+    event_log.info("token_issued", agent_id=agent_id)
+
+The record is only created if the level is enabled and the event passes its
+sampling rate. It is queued as is; the listener thread redacts tokens and
+secrets, formats it as JSON or text and writes it. Field values are read
+when the record is written, so don't mutate them after logging.
+"""
+import atexit
+import datetime
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+from typing import Any, Dict, Optional, Tuple
+
+# Values of these fields are replaced by a short fingerprint, so log lines
+# about the same token can still be correlated
+TOKEN_FIELDS = re.compile(r"token", re.IGNORECASE)
+# Values of these fields are removed
+SECRET_FIELDS = re.compile(r"secret|password|authorization|api_key|private_key", re.IGNORECASE)
+# JWTs embedded in messages or other field values
+JWT_PATTERN = re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]*")
+
+REDACTED = "[REDACTED]"
+
+
+def fingerprint(value: Any) -> str:
+    return "fp:" + hashlib.blake2b(str(value).encode(), digest_size=6).hexdigest()
+
+
+def redact(value: Any, name: str = "") -> Any:
+    """Return ``value`` with the redaction rules applied, keyed by its field ``name``."""
+    if SECRET_FIELDS.search(name):
+        return REDACTED
+    if TOKEN_FIELDS.search(name) and isinstance(value, (str, bytes)):
+        return fingerprint(value)
+    if isinstance(value, dict):
+        return {key: redact(item, str(key)) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item, name) for item in value]
+    if isinstance(value, str):
+        return JWT_PATTERN.sub(lambda m: fingerprint(m.group(0)), value)
+    return value
+
+
+def parse_sample_rates(spec: Optional[str]) -> Dict[str, float]:
+    """Parse ``"token_validated=0.01,token_issued=0.1"``; ``*`` sets the default rate."""
+    rates = {}
+    for item in (spec or "").split(","):
+        if item.strip():
+            event, _, rate = item.partition("=")
+            rates[event.strip()] = float(rate)
+    return rates
+
+
+class EventLogger:
+    """Logs named events with fields, keeping ``sample_rates[event]`` of them."""
+
+    def __init__(self, logger: logging.Logger, sample_rates: Optional[Dict[str, float]] = None):
+        self.logger = logger
+        self.sample_rates = dict(sample_rates or {})
+        self._default_rate = self.sample_rates.pop("*", 1.0)
+
+    def debug(self, event: str, **fields) -> None:
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields) -> None:
+        self._log(logging.INFO, event, fields)
+
+    def _log(self, level, event, fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        rate = self.sample_rates.get(event, self._default_rate)
+        if rate < 1.0 and random.random() >= rate:
+            return
+        if rate < 1.0:
+            fields["sample_rate"] = rate
+        self.logger.log(level, event, stacklevel=3,
+                        extra={"event": event, "fields": fields})
+
+
+class _Formatter(logging.Formatter):
+    def _parts(self, record) -> Dict[str, Any]:
+        parts = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                    .isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        event = getattr(record, "event", None)
+        if event:
+            parts["event"] = event
+            parts.update(redact(getattr(record, "fields", {})))
+        else:
+            parts["message"] = redact(record.getMessage())
+        if record.exc_info:
+            parts["exception"] = self.formatException(record.exc_info)
+        return parts
+
+
+class JsonFormatter(_Formatter):
+    def format(self, record) -> str:
+        return json.dumps(self._parts(record), default=str)
+
+
+class TextFormatter(_Formatter):
+    def format(self, record) -> str:
+        parts = self._parts(record)
+        exception = parts.pop("exception", None)
+        line = " ".join([parts.pop("time"), parts.pop("level"), parts.pop("logger"),
+                         str(parts.pop("event", None) or parts.pop("message", ""))]
+                        + [f"{key}={value}" for key, value in parts.items()])
+        return f"{line}\n{exception}" if exception else line
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records without formatting them and never blocks.
+
+    The stock handler renders the message and traceback before queuing;
+    here that is left to the listener. Records that don't fit in the queue
+    are counted in ``dropped``.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# Logger name -> (handler, listener) installed by configure_logging
+_configured: Dict[str, Tuple[DeferredQueueHandler, logging.handlers.QueueListener]] = {}
+
+
+def configure_logging(logger_name: str, level: str = "INFO", fmt: str = "json",
+                      queue_size: int = 10000, stream=None) -> Optional[DeferredQueueHandler]:
+    """
+    Send ``logger_name``'s records through a queue to a formatting thread.
+
+    Does nothing if the application has already given the logger a handler,
+    so an embedding application keeps control of its logging setup.
+    """
+    logger = logging.getLogger(logger_name)
+    previous = _configured.pop(logger_name, None)
+    if previous:
+        handler, listener = previous
+        listener.stop()
+        logger.removeHandler(handler)
+    if logger.handlers:
+        return None
+    logger.setLevel(level.upper())
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(TextFormatter() if fmt == "text" else JsonFormatter())
+    log_queue = queue.Queue(queue_size)
+    handler = DeferredQueueHandler(log_queue)
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    logger.addHandler(handler)
+    logger.propagate = False
+    _configured[logger_name] = (handler, listener)
+    return handler
+
+
+def _stop_listeners():
+    for _, listener in _configured.values():
+        if listener._thread is not None:
+            listener.stop()
+
+
+def _restart_listeners():
+    # Listener threads aren't copied into forked workers, and a queue's lock
+    # may have been held by another thread at the fork
+    for handler, listener in _configured.values():
+        listener.queue = handler.queue = queue.Queue(handler.queue.maxsize)
+        listener._thread = None
+        listener.start()
+
+
+atexit.register(_stop_listeners)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listeners)
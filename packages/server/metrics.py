@@ -0,0 +1,327 @@
+"""Prometheus metrics with per-thread counters, aggregated across worker processes."""
+import abc
+import contextlib
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # Each thread updates only its own shard, so recording never takes a
+        # lock; readers merge the shards. Shards of exited threads are folded
+        # into _retired so thread-per-request servers don't accumulate them.
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, dict]] = []
+        self._retired: dict = {}
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._retire_exited()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire_exited(self) -> None:
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._merge(self._retired, shard)
+        self._shards = live
+
+    @abc.abstractmethod
+    def _merge(self, totals: dict, shard: dict) -> None:
+        """Add the values of ``shard`` into ``totals``."""
+
+    def samples(self) -> dict:
+        with self._shards_lock:
+            self._retire_exited()
+            totals = {}
+            self._merge(totals, self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            self._merge(totals, shard.copy())
+        return totals
+
+    def _key(self, labels) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def reset(self) -> None:
+        with self._shards_lock:
+            self._shards = []
+            self._retired = {}
+        self._local = threading.local()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _merge(self, totals, shard):
+        for key, value in shard.items():
+            totals[key] = totals.get(key, 0) + value
+
+
+class Histogram(_Metric):
+    """Bucketed observations; each sample is per-bucket counts plus sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        shard = self._shard()
+        key = self._key(labels)
+        counts = shard.get(key)
+        if counts is None:
+            # One slot per bucket, then +Inf, sum and count
+            counts = shard[key] = [0] * (len(self.buckets) + 3)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[len(self.buckets)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _merge(self, totals, shard):
+        for key, counts in shard.items():
+            merged = totals.setdefault(key, [0] * len(counts))
+            for i, value in enumerate(counts):
+                merged[i] += value
+
+
+# A collected sample: (name, kind, help, labels, value). Kind is "counter" or
+# "gauge"; gauges from exited workers are left out of the aggregate.
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+
+class Registry:
+    """
+    Metrics of one process, exported to a shared directory for aggregation.
+
+    With ``directory`` set, every worker writes its snapshot there at most
+    ``interval`` seconds apart and ``render`` sums the snapshots of all
+    workers, so any worker can answer a scrape for the whole host. Clear the
+    directory when the service is redeployed.
+    """
+
+    def __init__(self, directory: Optional[str] = None, interval: float = 5.0):
+        self.directory = directory
+        self.interval = interval
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Callable[[], Iterable[Sample]]] = {}
+        self._exporter_pid = None
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if hasattr(os, "register_at_fork"):
+            # Workers forked from a preloaded master start from zero
+            os.register_at_fork(after_in_child=self._reset)
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, name: str, collector: Callable[[], Iterable[Sample]]) -> None:
+        """
+        Register a callback returning samples read from other objects at scrape time.
+
+        Registering another collector under the same ``name`` replaces it.
+        """
+        self._collectors[name] = collector
+
+    def ensure_exporter(self) -> None:
+        """Start this process's snapshot writer if it isn't running yet."""
+        if self.directory and self._exporter_pid != os.getpid():
+            with self._lock:
+                if self._exporter_pid != os.getpid():
+                    self._exporter_pid = os.getpid()
+                    threading.Thread(target=self._export_loop, name="metrics-export", daemon=True).start()
+
+    def snapshot(self) -> dict:
+        metrics = {}
+        for metric in list(self._metrics.values()):
+            entry = {"kind": metric.kind, "help": metric.help, "labelnames": metric.labelnames,
+                     "samples": [[list(key), value] for key, value in metric.samples().items()]}
+            if isinstance(metric, Histogram):
+                entry["buckets"] = metric.buckets
+            metrics[metric.name] = entry
+        for collector in list(self._collectors.values()):
+            for name, kind, help, labels, value in collector():
+                entry = metrics.setdefault(name, {"kind": kind, "help": help,
+                                                  "labelnames": tuple(labels), "samples": []})
+                entry["samples"].append([[str(labels[n]) for n in entry["labelnames"]], value])
+        return {"pid": os.getpid(), "time": time.time(), "metrics": metrics}
+
+    def write_snapshot(self) -> None:
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def render(self) -> str:
+        """Return the Prometheus text exposition of every worker's metrics."""
+        if not self.directory:
+            return render_snapshots([self.snapshot()])
+        self.write_snapshot()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return render_snapshots(snapshots)
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def _reset(self) -> None:
+        for metric in self._metrics.values():
+            metric.reset()
+        self._exporter_pid = None
+        self._lock = threading.Lock()
+
+    def _export_loop(self) -> None:
+        pid = os.getpid()
+        while self._exporter_pid == pid:
+            time.sleep(self.interval)
+            try:
+                self.write_snapshot()
+            except OSError:
+                pass
+
+
+def _alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def render_snapshots(snapshots: List[dict]) -> str:
+    merged: Dict[str, dict] = {}
+    for snapshot in snapshots:
+        alive = _alive(snapshot["pid"])
+        for name, entry in snapshot["metrics"].items():
+            if entry["kind"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(name, dict(entry, samples={}))
+            for key, value in entry["samples"]:
+                key = tuple(key)
+                if entry["kind"] == "histogram":
+                    totals = target["samples"].setdefault(key, [0] * len(value))
+                    for i, count in enumerate(value):
+                        totals[i] += count
+                else:
+                    target["samples"][key] = target["samples"].get(key, 0) + value
+
+    lines = []
+    for name in sorted(merged):
+        entry = merged[name]
+        lines.append(f"# HELP {name} {entry['help']}")
+        lines.append(f"# TYPE {name} {entry['kind']}")
+        for key, value in sorted(entry["samples"].items()):
+            labels = list(zip(entry["labelnames"], key))
+            if entry["kind"] != "histogram":
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            bounds = [_number(b) for b in entry["buckets"]] + ["+Inf"]
+            for bound, count in zip(bounds, value):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + [('le', bound)])} {_number(cumulative)}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(value[-2])}")
+            lines.append(f"{name}_count{_labels(labels)} {_number(value[-1])}")
+    return "\n".join(lines) + "\n"
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value) -> str:
+    """Escape a label value as the exposition format requires."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def default_directory() -> str:
+    """
+    Return a snapshot directory shared by the processes of one deployment.
+
+    Gunicorn's master and workers share a process group and a restart starts
+    a new one, so counters of an earlier deployment are never summed in.
+    """
+    group = os.getpgrp() if hasattr(os, "getpgrp") else os.getpid()
+    return os.path.join(tempfile.gettempdir(), f"proxyme-metrics-{group}")
+
+
+# Create a singleton registry. PROXYME_METRICS_DIR must be shared by all
+# workers on the host for /metrics to cover them all; set it empty to have
+# each worker report only itself.
+_directory = os.environ.get("PROXYME_METRICS_DIR")
+registry = Registry(default_directory() if _directory is None else _directory or None)
+
+REQUESTS = registry.counter(
+    "proxyme_http_requests_total", "HTTP requests handled", ("route", "method", "status"))
+REQUEST_SECONDS = registry.histogram(
+    "proxyme_http_request_duration_seconds", "Time to handle an HTTP request", ("route",))
+SQLITE_SECONDS = registry.histogram(
+    "proxyme_sqlite_query_duration_seconds", "Time spent in SQLite operations", ("operation",))
+AUDIT_LOG_EVENT_SECONDS = registry.histogram(
+    "proxyme_audit_log_event_duration_seconds", "Time callers spend in AuditLogger.log_event(s)")
@@ -0,0 +1,154 @@
+"""Opt-in per-request phase timing and a sampling profiler for slow requests."""
+import collections
+import contextvars
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+# Phase name -> seconds spent in it during the current request, or None when
+# the request isn't being timed
+_timings: contextvars.ContextVar = contextvars.ContextVar("proxyme_phase_timings", default=None)
+
+
+class _Phase:
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        record_phase(self.name, time.perf_counter() - self.start, self.timings)
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+def start_timing() -> None:
+    """Begin collecting phase timings for the request running in this context."""
+    _timings.set({})
+
+
+def finish_timing() -> Dict[str, float]:
+    """Stop collecting and return the seconds spent in each phase."""
+    timings = _timings.get()
+    _timings.set(None)
+    return timings or {}
+
+
+def phase(name: str):
+    """Time the enclosed block as ``name``; a no-op unless the request is timed."""
+    timings = _timings.get()
+    return _NO_PHASE if timings is None else _Phase(timings, name)
+
+
+def record_phase(name: str, seconds: float, timings: Optional[dict] = None) -> None:
+    """Add ``seconds`` to phase ``name``, for callers that timed the work themselves."""
+    if timings is None:
+        timings = _timings.get()
+        if timings is None:
+            return
+    timings[name] = timings.get(name, 0.0) + seconds
+
+
+def server_timing_header(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    """Format phase timings, in seconds, as a ``Server-Timing`` header value."""
+    entries = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(entries)
+
+
+class SlowRequestProfiler:
+    """
+    Samples the stacks of in-flight requests and keeps the ``slowest`` of them.
+
+    A background thread reads every request thread's stack each ``interval``
+    seconds. Whenever a request joins the slowest set, ``path`` is rewritten
+    in the folded format read by flamegraph.pl and speedscope, with each
+    stack prefixed by the request it came from. ``{pid}`` in ``path`` is
+    replaced by the process id so workers don't overwrite each other.
+
+    Requests must run on their own threads, as with the Flask app.
+    """
+
+    def __init__(self, path: str, slowest: int = 10, interval: float = 0.005):
+        self.path = path
+        self.slowest = slowest
+        self.interval = interval
+        self._active: Dict[int, collections.Counter] = {}
+        self._kept = []  # min-heap of (duration, seq, label, stacks)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._sampler_pid = None
+
+    def start(self) -> None:
+        """Start sampling the calling thread's request."""
+        if self._sampler_pid != os.getpid():
+            with self._lock:
+                if self._sampler_pid != os.getpid():
+                    self._sampler_pid = os.getpid()
+                    self._active, self._kept = {}, []
+                    threading.Thread(target=self._sample, name="request-profiler", daemon=True).start()
+        self._active[threading.get_ident()] = collections.Counter()
+
+    def finish(self, label: str, duration: float) -> None:
+        """Stop sampling the calling thread's request, keeping it if it is among the slowest."""
+        stacks = self._active.pop(threading.get_ident(), None)
+        if not stacks:
+            return
+        with self._lock:
+            entry = (duration, next(self._seq), label, stacks)
+            if len(self._kept) < self.slowest:
+                heapq.heappush(self._kept, entry)
+            elif duration > self._kept[0][0]:
+                heapq.heapreplace(self._kept, entry)
+            else:
+                return
+            self._write()
+
+    def _write(self) -> None:
+        path = self.path.format(pid=os.getpid())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            for duration, _, label, stacks in sorted(self._kept, reverse=True):
+                request = f"{label} {duration * 1000:.1f}ms".replace(";", ",")
+                for stack, count in stacks.items():
+                    f.write(f"{request};{stack} {count}\n")
+        os.replace(tmp_path, path)
+
+    def _sample(self) -> None:
+        pid = os.getpid()
+        while self._sampler_pid == pid:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for ident, stacks in list(self._active.items()):
+                frame = frames.get(ident)
+                if frame is not None:
+                    stacks[_fold(frame)] += 1
+
+
+def _fold(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
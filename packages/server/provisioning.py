@@ -0,0 +1,149 @@
+"""Bulk agent registration from request bodies or CSV/JSON import streams."""
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from werkzeug.security import generate_password_hash
+
+from .profiling import phase
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def hash_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    Return the shared process pool used to hash client secrets.
+
+    Workers are spawned rather than forked so they never inherit the locks
+    or SQLite connections held by the server's threads.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def hash_secrets(secrets: List[str], executor: Optional[Executor] = None,
+                  workers: Optional[int] = None) -> List[str]:
+    """
+    Hash ``secrets`` in order, spread across ``executor`` when one is given.
+
+    ``workers`` is the executor's worker count, used to size the chunks
+    handed to each worker; it defaults to the number of CPUs.
+    """
+    with phase("hash"):
+        if executor is None or len(secrets) < 2:
+            return [generate_password_hash(secret) for secret in secrets]
+        workers = workers or os.cpu_count() or 1
+        chunksize = max(1, len(secrets) // (4 * workers))
+        return list(executor.map(generate_password_hash, secrets, chunksize=chunksize))
+
+
+def read_agent_records(stream: TextIO, fmt: str = "json") -> Iterator[Dict[str, Any]]:
+    """
+    Yield agent records from a CSV or JSON import stream.
+
+    CSV input needs a ``scopes`` column holding space-separated scopes and
+    may have a ``client_id`` column. JSON input is either newline-delimited
+    objects, read one line at a time, or a single array of objects.
+    """
+    if fmt == "csv":
+        for row in csv.DictReader(stream):
+            record = {"scopes": (row.get("scopes") or "").split()}
+            if row.get("client_id"):
+                record["client_id"] = row["client_id"]
+            yield record
+        return
+    if fmt != "json":
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+    first = ""
+    for first in stream:
+        if first.strip():
+            break
+    if first.lstrip().startswith("["):
+        yield from json.loads(first + stream.read())
+        return
+    for line in itertools.chain([first], stream):
+        if line.strip():
+            yield json.loads(line)
+
+
+def _validate(record) -> Optional[str]:
+    if not isinstance(record, dict):
+        return "Invalid request data"
+    scopes = record.get("scopes")
+    if isinstance(scopes, str):
+        scopes = record["scopes"] = scopes.split()
+    if not isinstance(scopes, list) or not all(isinstance(s, str) for s in scopes):
+        return "Invalid scopes"
+    client_id = record.get("client_id")
+    if client_id is not None and (not isinstance(client_id, str) or not client_id):
+        return "Invalid client_id"
+    return None
+
+
+def provision_agents(store, records: Iterable[Any], executor: Optional[Executor] = None,
+                     batch_size: int = 500, workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Register ``records`` in ``store`` and yield one result per record, in input order.
+
+    Records are consumed ``batch_size`` at a time: their secrets are hashed
+    on ``executor``, which has ``workers`` workers, and the batch is inserted in a single transaction before
+    its credentials are yielded, so memory stays bounded for any input size.
+    A successful result holds the plaintext ``client_secret``; it is the
+    only time the secret is available, as just its hash is stored. An id
+    registered concurrently by another request is reported as already
+    registered rather than failing the batch.
+    """
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+
+        results: List[Dict[str, Any]] = []
+        accepted = []
+        for record in batch:
+            error = _validate(record)
+            if error:
+                result = {"error": error}
+                if isinstance(record, dict) and isinstance(record.get("client_id"), str):
+                    result["client_id"] = record["client_id"]
+                results.append(result)
+                continue
+            result = {
+                "client_id": record.get("client_id") or os.urandom(16).hex(),
+                "client_secret": os.urandom(32).hex(),
+                "scopes": record["scopes"],
+            }
+            results.append(result)
+            accepted.append(result)
+
+        # Reject ids that are already registered or repeated within the batch
+        taken = store.registered_client_ids(result["client_id"] for result in accepted)
+        rows = []
+        for result in accepted:
+            if result["client_id"] in taken:
+                del result["client_secret"], result["scopes"]
+                result["error"] = "Client already registered"
+                continue
+            taken.add(result["client_id"])
+            rows.append(result)
+
+        hashes = hash_secrets([result["client_secret"] for result in rows], executor, workers)
+        skipped = store.add_clients([(result["client_id"], hashed, ",".join(result["scopes"]))
+                                     for result, hashed in zip(rows, hashes)])
+        for result in rows:
+            if result["client_id"] in skipped:
+                del result["client_secret"], result["scopes"]
+                result["error"] = "Client already registered"
+        yield from results
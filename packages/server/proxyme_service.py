@@ -1,72 +1,100 @@
 import os
-import sqlite3
 import logging
 import datetime
 import jwt
 import json
-from flask import Flask, request, jsonify, current_app
-from werkzeug.security import generate_password_hash, check_password_hash
+import click
+from flask import Flask, Response, g, request, jsonify, current_app, stream_with_context
+from werkzeug.security import check_password_hash
 from flask_cors import CORS
-from .audit_logger import audit_logger
-import threading
+from .audit_logger import audit_logger, decode_cursor
+from .audit_stream import audit_broadcaster, sse_events
+from .cache import LRUCache
+from .clients import ClientRegistry
+from .delegation_store import DelegationStore, token_digest
+from .keys import KeyManager
+from .logs import EventLogger, configure_logging, parse_sample_rates
+from .metrics import REQUEST_SECONDS, REQUESTS, registry as metrics_registry
+from .profiling import SlowRequestProfiler, finish_timing, phase, server_timing_header, start_timing
+from .provisioning import hash_pool, provision_agents, read_agent_records
+from .revocation import RevocationIndex, token_expiry
+from .storage import SQLiteAuthStore
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 # Secure configuration
 SECRET_KEY = "development-secret-key"  # Only for testing
-DB_FILE = "auth.db"
+DB_FILE = os.environ.get("PROXYME_DB_FILE", "auth.db")
 OIDC_ISSUER = "http://127.0.0.1:5001"  # Your OIDC issuer URL
+# HS256 signs with SECRET_KEY. RS256, ES256 or EdDSA sign with rotating keys
+# published at /.well-known/jwks.json so resource servers can verify offline.
+SIGNING_ALGORITHM = os.environ.get("PROXYME_SIGNING_ALGORITHM", "HS256")
+# Shared by every worker and kept across restarts, so a token signed by one
+# worker verifies on the others and outlives a deploy
+SIGNING_KEY_DIR = (os.environ.get("PROXYME_SIGNING_KEY_DIR")
+                   or os.path.join(os.path.dirname(os.path.abspath(DB_FILE)), "signing_keys"))
+KEY_ROTATION_DAYS = float(os.environ.get("PROXYME_KEY_ROTATION_DAYS", 30))
+# How long resource servers may cache the JWKS, and how long before a new key
+# signs that it is published; keep the latter above the former plus a minute
+JWKS_MAX_AGE = int(os.environ.get("PROXYME_JWKS_MAX_AGE", 300))
+KEY_PUBLISH_AHEAD_SECONDS = float(os.environ.get("PROXYME_KEY_PUBLISH_AHEAD_SECONDS", 600))
+# Seconds a replaced key stays published; keep it above the token lifetime
+KEY_OVERLAP_SECONDS = float(os.environ.get("PROXYME_KEY_OVERLAP_SECONDS", 86400))
+# Longest a cached introspection result may outlive a revocation
+REVOCATION_PROPAGATION_SECONDS = int(os.environ.get("PROXYME_REVOCATION_PROPAGATION_SECONDS", 30))
+# "stateful" only accepts tokens issued by this process; "stateless" trusts the
+# signed claims so any worker or node sharing SECRET_KEY can validate a token.
+VALIDATION_MODE = os.environ.get("PROXYME_VALIDATION_MODE", "stateful")
+DELEGATION_STORE_MAX_SIZE = int(os.environ.get("PROXYME_DELEGATION_STORE_MAX_SIZE", 100000))
+MAX_BATCH_SIZE = int(os.environ.get("PROXYME_MAX_BATCH_SIZE", 1000))
+# Processes used to hash client secrets during bulk registration (default: CPU count)
+HASH_WORKERS = int(os.environ.get("PROXYME_HASH_WORKERS", 0)) or None
+VALIDATION_CACHE_SIZE = int(os.environ.get("PROXYME_VALIDATION_CACHE_SIZE", 10000))
+CLIENT_CACHE_SIZE = int(os.environ.get("PROXYME_CLIENT_CACHE_SIZE", 10000))
+# Seconds a cached client may be served after another process changes it
+CLIENT_CACHE_TTL = float(os.environ.get("PROXYME_CLIENT_CACHE_TTL", 300))
+# Connections to the auth database shared by each worker's request threads
+AUTH_DB_POOL_SIZE = int(os.environ.get("PROXYME_AUTH_DB_POOL_SIZE", 8))
+# Add a Server-Timing header with the time spent signing, decoding, in SQLite
+# and queuing audit events
+SERVER_TIMING = os.environ.get("PROXYME_SERVER_TIMING") == "1"
+# Keep sampled stacks of the N slowest requests (0 disables the profiler)
+PROFILE_SLOWEST = int(os.environ.get("PROXYME_PROFILE_SLOWEST", 0))
+PROFILE_FILE = os.environ.get("PROXYME_PROFILE_FILE", "slow_requests-{pid}.folded")
+PROFILE_INTERVAL_MS = float(os.environ.get("PROXYME_PROFILE_INTERVAL_MS", 5))
+# Logging is structured and written from a background thread. Sampling keeps
+# a fraction of chatty events, e.g. "token_validated=0.01,token_issued=0.1".
+LOG_LEVEL = os.environ.get("PROXYME_LOG_LEVEL", "INFO")
+LOG_FORMAT = os.environ.get("PROXYME_LOG_FORMAT", "json")
+LOG_SAMPLING = parse_sample_rates(os.environ.get("PROXYME_LOG_SAMPLING", "token_validated=0.01"))
+LOG_QUEUE_SIZE = int(os.environ.get("PROXYME_LOG_QUEUE_SIZE", 10000))
+REVOCATION_INDEX_FILE = os.environ.get("PROXYME_REVOCATION_INDEX_FILE", "revoked_tokens.idx")
+REVOCATION_INDEX_CAPACITY = int(os.environ.get("PROXYME_REVOCATION_INDEX_CAPACITY", 1000000))
 
 # Initialize Flask App
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["X-Next-Cursor"])
 
-# Logging setup
-logging.basicConfig(level=logging.DEBUG)
+# Logging setup. Applies to the packages.server loggers only, and not at all
+# if the embedding application has configured them.
+log_handler = configure_logging(__package__ or __name__, level=LOG_LEVEL, fmt=LOG_FORMAT,
+                                queue_size=LOG_QUEUE_SIZE)
 logger = logging.getLogger(__name__)
+event_log = EventLogger(logger, LOG_SAMPLING)
 
-# Thread-local storage for database connections
-thread_local = threading.local()
+# Registered clients and revoked tokens
+auth_store = SQLiteAuthStore(DB_FILE, pool_size=AUTH_DB_POOL_SIZE)
 
-def get_auth_db():
-    if not hasattr(thread_local, 'auth_conn'):
-        if app.testing:
-            from pythonHTTPcode.test_proxyme import TestProxyme
-            thread_local.auth_conn = TestProxyme.auth_conn
-        else:
-            thread_local.auth_conn = sqlite3.connect(DB_FILE)
-    return thread_local.auth_conn
-
-def get_audit_db():
-    if not hasattr(thread_local, 'audit_conn'):
-        if app.testing:
-            from pythonHTTPcode.test_proxyme import TestProxyme
-            thread_local.audit_conn = TestProxyme.audit_conn
-        else:
-            thread_local.audit_conn = sqlite3.connect("audit.db")
-    return thread_local.audit_conn
+# Revoked token digests shared by all workers on this host
+revocation_index = RevocationIndex(REVOCATION_INDEX_FILE, capacity=REVOCATION_INDEX_CAPACITY)
 
 # Initialize SQLite Database
 def init_db():
     try:
-        conn = get_auth_db()
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS clients (
-                client_id TEXT PRIMARY KEY,
-                client_secret TEXT,
-                scopes TEXT,
-                redirect_uris TEXT,
-                grant_types TEXT,
-                response_types TEXT,
-                token_endpoint_auth_method TEXT
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS revoked_tokens (
-                token TEXT PRIMARY KEY,
-                revoked_at TEXT NOT NULL
-            )
-        """)
-        conn.commit()
+        migrated = auth_store.init_schema()
+        if migrated:
+            logger.info(f"Migrated {migrated} revoked tokens to digest keys")
+        revocation_index.rebuild(auth_store.revoked_token_ids())
         logger.info("Database initialized successfully")
     except Exception as e:
         logger.error(f"Error initializing database: {str(e)}")
@@ -76,51 +104,229 @@ def init_db():
 init_db()
 logger.info("Database initialization completed")
 
+# Asymmetric signing keys, or None when tokens are signed with SECRET_KEY
+key_manager = None
+if SIGNING_ALGORITHM != "HS256":
+    key_manager = KeyManager(
+        SIGNING_ALGORITHM,
+        key_dir=SIGNING_KEY_DIR,
+        rotation_interval=KEY_ROTATION_DAYS * 86400,
+        overlap=KEY_OVERLAP_SECONDS,
+        publish_ahead=KEY_PUBLISH_AHEAD_SECONDS
+    )
+
+def sign_token(payload):
+    """Sign ``payload`` with the active key, tagging asymmetric tokens with its kid."""
+    with phase("sign"):
+        if key_manager is None:
+            return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+        key = key_manager.signing_key()
+        return jwt.encode(payload, key.private_key, algorithm=key.algorithm, headers={"kid": key.kid})
+
+# Verified token claims keyed by token digest, so repeat validations skip the
+# signature check and JSON parsing. Entries expire with the token.
+verified_tokens = LRUCache(max_size=VALIDATION_CACHE_SIZE)
+
+# Registered clients with pre-parsed scopes, so delegation needs no database I/O
+client_registry = ClientRegistry(auth_store.load_clients, max_size=CLIENT_CACHE_SIZE, ttl=CLIENT_CACHE_TTL)
+
 # Store delegation tokens securely
-delegations = {}
+delegations = DelegationStore(max_size=DELEGATION_STORE_MAX_SIZE)
+
+# Gauges and cache counters read from the service's objects at scrape time
+def service_metrics():
+    yield ("proxyme_audit_queue_depth", "gauge", "Audit events waiting to be written",
+           {}, audit_logger.queue_depth())
+    yield ("proxyme_audit_dropped_events_total", "counter", "Audit events dropped on queue overflow",
+           {}, audit_logger.dropped)
+    yield ("proxyme_log_records_dropped_total", "counter", "Log records dropped on queue overflow",
+           {}, log_handler.dropped if log_handler else 0)
+    yield ("proxyme_delegation_store_size", "gauge", "Delegation tokens held in memory",
+           {}, len(delegations))
+    caches = {"delegations": delegations, "clients": client_registry, "validation": verified_tokens}
+    for name, cache in caches.items():
+        stats = cache.stats()
+        labels = {"cache": name}
+        yield ("proxyme_cache_hits_total", "counter", "Cache lookups that found an entry", labels, stats["hits"])
+        yield ("proxyme_cache_misses_total", "counter", "Cache lookups that found no entry", labels, stats["misses"])
+        yield ("proxyme_cache_evictions_total", "counter", "Cache entries evicted for space", labels, stats["evictions"])
+        yield ("proxyme_cache_size", "gauge", "Entries held in a cache", labels, stats["size"])
+
+metrics_registry.add_collector("service", service_metrics)
+
+# Folded stacks of the slowest requests, for flame graphs
+profiler = None
+if PROFILE_SLOWEST:
+    profiler = SlowRequestProfiler(PROFILE_FILE, slowest=PROFILE_SLOWEST,
+                                   interval=PROFILE_INTERVAL_MS / 1000)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics_registry.ensure_exporter()
+    if SERVER_TIMING:
+        start_timing()
+    if profiler:
+        profiler.start()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        # Label by route pattern, not path, so the number of series stays bounded
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(elapsed, route=route)
+        REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = server_timing_header(finish_timing(), elapsed)
+        if profiler:
+            profiler.finish(f"{request.method} {route}", elapsed)
+    return response
 
 # Delegation Token Model
 class DelegationToken:
+    __slots__ = ("user_id", "agent_id", "scopes", "expires_at")
+
     def __init__(self, user_id, agent_id, scopes, expires_in=3600):
         self.user_id = user_id
         self.agent_id = agent_id
-        self.scopes = scopes
-        self.expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in)
+        self.scopes = tuple(scopes)
+        # Unix timestamp, matching the token's exp claim
+        self.expires_at = int(time.time()) + expires_in
+
+    @classmethod
+    def from_claims(cls, payload):
+        """Rebuild a delegation from verified JWT claims without any local state."""
+        delegation = cls.__new__(cls)
+        delegation.user_id = payload["sub"]
+        delegation.agent_id = payload.get("agent_id", payload.get("aud"))
+        delegation.scopes = tuple(payload.get("scope", "").split())
+        delegation.expires_at = payload["exp"]
+        return delegation
 
     def is_valid(self):
-        return datetime.datetime.utcnow() < self.expires_at
+        return time.time() < self.expires_at
+
+def register_client(scopes):
+    """
+    Store a new client granted ``scopes`` and return its credentials, or an error.
+
+    As with bulk registration the response carries the plaintext secret and
+    only its hash is stored. ``scopes`` must be a list of strings; the
+    space-separated form is only accepted in bulk imports.
+    """
+    if not isinstance(scopes, list):
+        return {"error": "Invalid scopes"}
+    result = next(provision_agents(auth_store, [{"scopes": scopes}]))
+    if "error" in result:
+        return result
+    client_registry.invalidate([result["client_id"]])
+
+    event_log.info("agent_registered", client_id=result["client_id"], scopes=result["scopes"])
+    return {"client_id": result["client_id"], "client_secret": result["client_secret"]}
 
 # Register Agent
 @app.route("/register_agent", methods=["POST"])
 def register_agent():
     try:
         data = request.json
-        logger.debug("Received registration request")
-        logger.debug(f"Request data: {data}")
+        event_log.debug("registration_requested", request=data)
 
         if not data or 'scopes' not in data:
             return jsonify({"error": "Invalid request data"}), 500
 
-        scopes = data.get("scopes", [])
-        client_id = os.urandom(16).hex()
-        client_secret = generate_password_hash(os.urandom(32).hex())
-
-        with get_auth_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO clients (client_id, client_secret, scopes)
-                VALUES (?, ?, ?)
-            """, (client_id, client_secret, ",".join(scopes)))
-            conn.commit()
-
-        logger.info(f"AI Agent {client_id} registered with scopes {','.join(scopes)}")
-        response = {"client_id": client_id, "client_secret": client_secret}
-        logger.debug(f"Sending response: {response}")
+        response = register_client(data.get("scopes", []))
+        if "error" in response:
+            return jsonify(response), 400
         return jsonify(response)
     except Exception as e:
         logger.error(f"Error in register_agent: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+# Register Many AI Agents
+@app.route("/register_agent/batch", methods=["POST"])
+def register_agent_batch():
+    try:
+        agents = request.json.get("agents")
+        if not isinstance(agents, list):
+            return jsonify({"error": "agents must be a list"}), 400
+        if len(agents) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"At most {MAX_BATCH_SIZE} agents per batch"}), 400
+
+        def credentials():
+            registered = 0
+            for result in provision_agents(auth_store, agents, hash_pool(HASH_WORKERS),
+                                           workers=HASH_WORKERS):
+                if "client_secret" in result:
+                    client_registry.invalidate([result["client_id"]])
+                    registered += 1
+                yield json.dumps(result) + "\n"
+            event_log.info("agents_registered", registered=registered, requested=len(agents))
+
+        return Response(stream_with_context(credentials()), mimetype="application/x-ndjson")
+    except Exception as e:
+        logger.error(f"Error in register_agent_batch: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+def issue_delegation(user_id, agent_id, scopes, client, ip_address):
+    """
+    Sign a delegation token for ``agent_id`` if its registered ``client`` was granted ``scopes``.
+
+    ``client`` is None for an unknown agent. Returns the response body,
+    status code and audit event.
+    """
+    if client is None:
+        event = dict(
+            event_type="token_delegation",
+            action="delegate",
+            status="error",
+            user_id=user_id,
+            agent_id=agent_id,
+            details={"error": "Invalid agent ID"},
+            ip_address=ip_address
+        )
+        return {"error": "Invalid agent ID"}, 403, event
+
+    if not client.scope_set.issuperset(scopes):
+        event = dict(
+            event_type="token_delegation",
+            action="delegate",
+            status="error",
+            user_id=user_id,
+            agent_id=agent_id,
+            details={"error": "Invalid scope request", "requested_scopes": scopes, "granted_scopes": list(client.scopes)},
+            ip_address=ip_address
+        )
+        return {"error": "Invalid scope request"}, 403, event
+
+    delegation_token = DelegationToken(user_id, agent_id, scopes)
+    token_payload = {
+        "iss": OIDC_ISSUER,
+        "sub": user_id,
+        "aud": agent_id,
+        "iat": int(datetime.datetime.utcnow().timestamp()),
+        "exp": delegation_token.expires_at,
+        "agent_id": agent_id,
+        "scope": " ".join(scopes),
+        "jti": os.urandom(16).hex()
+    }
+    
+    token = sign_token(token_payload)
+    delegations.put(token, delegation_token)
+
+    event = dict(
+        event_type="token_delegation",
+        action="delegate",
+        status="success",
+        user_id=user_id,
+        agent_id=agent_id,
+        details={"scopes": scopes},
+        ip_address=ip_address,
+        token_id=token
+    )
+    return {"delegation_token": token}, 200, event
+
 # Issue Delegation Token
 @app.route("/delegate", methods=["POST"])
 def delegate():
@@ -130,197 +336,201 @@ def delegate():
         agent_id = data.get("agent_id")
         scopes = data.get("scopes", [])
 
-        with get_auth_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT scopes FROM clients WHERE client_id=?", (agent_id,))
-            row = cursor.fetchone()
-
-        if not row:
-            audit_logger.log_event(
-                event_type="token_delegation",
-                action="delegate",
-                status="error",
-                user_id=user_id,
-                agent_id=agent_id,
-                details={"error": "Invalid agent ID"},
-                ip_address=request.remote_addr
-            )
-            return jsonify({"error": "Invalid agent ID"}), 403
-
-        granted_scopes = row[0].split(",")
-        if not set(scopes).issubset(set(granted_scopes)):
-            audit_logger.log_event(
-                event_type="token_delegation",
-                action="delegate",
-                status="error",
-                user_id=user_id,
-                agent_id=agent_id,
-                details={"error": "Invalid scope request", "requested_scopes": scopes, "granted_scopes": granted_scopes},
-                ip_address=request.remote_addr
-            )
-            return jsonify({"error": "Invalid scope request"}), 403
-
-        delegation_token = DelegationToken(user_id, agent_id, scopes)
-        token_payload = {
-            "iss": OIDC_ISSUER,
-            "sub": user_id,
-            "aud": agent_id,
-            "iat": int(datetime.datetime.utcnow().timestamp()),
-            "exp": int(delegation_token.expires_at.timestamp()),
-            "agent_id": agent_id,
-            "scope": " ".join(scopes)
-        }
-        
-        token = jwt.encode(token_payload, SECRET_KEY, algorithm="HS256")
-        delegations[token] = delegation_token
+        client = client_registry.get(agent_id)
+        body, status, event = issue_delegation(user_id, agent_id, scopes, client, request.remote_addr)
+        audit_logger.log_event(**event)
 
+        if status == 200:
+            event_log.info("token_issued", agent_id=agent_id, user_id=user_id, scopes=scopes)
+        return jsonify(body), status
+    except Exception as e:
+        logger.error(f"Error in delegate: {str(e)}", exc_info=True)
         audit_logger.log_event(
             event_type="token_delegation",
             action="delegate",
-            status="success",
+            status="error",
             user_id=user_id,
             agent_id=agent_id,
-            details={"scopes": scopes},
-            ip_address=request.remote_addr,
-            token_id=token
+            details={"error": str(e)},
+            ip_address=request.remote_addr
         )
+        return jsonify({"error": str(e)}), 500
 
-        logger.info(f"Delegation token issued for agent {agent_id}")
-        return jsonify({"delegation_token": token})
+def is_delegation_request(item):
+    """Check the field types of one /delegate/batch item before any lookup."""
+    if not isinstance(item, dict):
+        return False
+    scopes = item.get("scopes", [])
+    return (isinstance(item.get("user_id"), str)
+            and isinstance(item.get("agent_id"), str)
+            and isinstance(scopes, list)
+            and all(isinstance(scope, str) for scope in scopes))
+
+# Issue Many Delegation Tokens
+@app.route("/delegate/batch", methods=["POST"])
+def delegate_batch():
+    try:
+        items = request.json.get("delegations")
+        if not isinstance(items, list):
+            return jsonify({"error": "delegations must be a list"}), 400
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"At most {MAX_BATCH_SIZE} delegations per batch"}), 400
+
+        well_formed = [is_delegation_request(item) for item in items]
+        clients = client_registry.get_many(
+            item["agent_id"] for item, ok in zip(items, well_formed) if ok
+        )
+
+        results, events = [], []
+        for item, ok in zip(items, well_formed):
+            if not ok:
+                results.append({"error": "Invalid request data"})
+                continue
+            agent_id = item.get("agent_id")
+            body, _, event = issue_delegation(
+                item.get("user_id"), agent_id, item.get("scopes", []),
+                clients.get(agent_id), request.remote_addr
+            )
+            results.append(body)
+            events.append(event)
+
+        # One audit transaction for the whole batch
+        audit_logger.log_events(events)
+        event_log.info("tokens_issued", issued=sum("delegation_token" in r for r in results), requested=len(items))
+        return jsonify({"results": results})
     except Exception as e:
-        logger.error(f"Error in delegate: {str(e)}", exc_info=True)
+        logger.error(f"Error in delegate_batch: {str(e)}", exc_info=True)
         audit_logger.log_event(
             event_type="token_delegation",
-            action="delegate",
+            action="delegate_batch",
             status="error",
-            user_id=user_id,
-            agent_id=agent_id,
             details={"error": str(e)},
             ip_address=request.remote_addr
         )
         return jsonify({"error": str(e)}), 500
 
+def decode_delegation(token):
+    """Verify a token's signature and claims, returning its payload."""
+    required_claims = ["exp", "iss", "aud", "sub"]
+    if VALIDATION_MODE == "stateless":
+        required_claims += ["agent_id", "scope", "jti"]
+
+    if key_manager is None:
+        key, algorithm = SECRET_KEY, "HS256"
+    else:
+        key = key_manager.verification_key(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            raise jwt.InvalidTokenError("Unknown signing key")
+        key, algorithm = key.public_key, key.algorithm
+
+    # The audience is the agent the token was issued to and is only required
+    # to be present, so the token is decoded once without matching it.
+    with phase("jwt"):
+        payload = jwt.decode(
+            token,
+            key,
+            algorithms=[algorithm],
+            issuer=OIDC_ISSUER,
+            options={
+                "verify_signature": True,
+                "verify_exp": True,
+                "verify_iss": True,
+                "verify_aud": False,
+                "verify_iat": False,  # Don't verify iat
+                "require": required_claims
+            }
+        )
+    event_log.debug("token_decoded", claims=payload)
+    return payload
+
+def verify_delegation(token):
+    """
+    Check a token's signature, claims and expiry.
+
+    Returns ``(delegation, None)`` for a usable token or ``(None, error)``
+    with the message reported to the caller. Revocation is checked separately.
+    """
+    if not isinstance(token, str):
+        return None, "Invalid token"
+    try:
+        token_id = token_digest(token)
+        payload = verified_tokens.get(token_id)
+        if payload is None:
+            payload = decode_delegation(token)
+            # Valid until exp unless the token is revoked first
+            verified_tokens.put(token_id, payload, expires_at=payload["exp"])
+    except jwt.ExpiredSignatureError:
+        event_log.debug("token_rejected", reason="expired")
+        return None, "Token has expired"
+    except jwt.InvalidTokenError as e:
+        event_log.debug("token_rejected", reason="invalid", error=e)
+        return None, "Invalid token"
+
+    if VALIDATION_MODE == "stateless":
+        delegation = DelegationToken.from_claims(payload)
+    else:
+        delegation = delegations.get(token)
+    if not delegation or not delegation.is_valid():
+        event_log.debug("token_rejected", reason="no_delegation")
+        return None, "Invalid or expired token"
+    return delegation, None
+
+def find_revoked(token_ids):
+    """Return the subset of ``token_ids`` that have been revoked."""
+    # The shared index answers the common "not revoked" case without a
+    # database round trip; the rest are confirmed in a single query.
+    candidates = [token_id for token_id in token_ids if revocation_index.might_contain(token_id)]
+    if not candidates:
+        return set()
+    return auth_store.find_revoked(candidates)
+
+def validation_outcome(token, delegation, error, ip_address):
+    """Build the response body, status code and audit event for one validation."""
+    if error:
+        event = dict(
+            event_type="token_validation",
+            action="validate_delegation",
+            status="error",
+            details={"error": error},
+            ip_address=ip_address,
+            token_id=token
+        )
+        return {"valid": False, "error": error}, 401, event
+
+    event = dict(
+        event_type="token_validation",
+        action="validate_delegation",
+        status="success",
+        user_id=delegation.user_id,
+        agent_id=delegation.agent_id,
+        details={"scopes": delegation.scopes},
+        ip_address=ip_address,
+        token_id=token
+    )
+    body = {
+        "valid": True,
+        "user_id": delegation.user_id,
+        "agent_id": delegation.agent_id,
+        "scopes": delegation.scopes
+    }
+    return body, 200, event
+
 # Validate Delegation Token
 @app.route("/validate_delegation", methods=["POST"])
 def validate_delegation():
     try:
         token = request.json.get("delegation_token")
-        logger.debug(f"Validating token: {token}")
-        
         if not token:
-            logger.debug("No token provided")
             return jsonify({"valid": False, "error": "No token provided"}), 401
         
-        try:
-            # Add more debug logging
-            logger.debug(f"Using SECRET_KEY: {SECRET_KEY}")
-            
-            # First decode without verification to get the audience
-            unverified_payload = jwt.decode(token, options={"verify_signature": False})
-            audience = unverified_payload.get("aud")
-            logger.debug(f"Token audience: {audience}")
-            
-            # Decode token with less strict options
-            payload = jwt.decode(
-                token, 
-                SECRET_KEY, 
-                algorithms=["HS256"],
-                audience=audience,  # Set the expected audience
-                options={
-                    "verify_signature": True,
-                    "verify_exp": True,
-                    "verify_iss": True,
-                    "verify_aud": True,
-                    "verify_iat": False,  # Don't verify iat
-                    "require": ["exp", "iss", "aud", "sub"]
-                }
-            )
-            logger.debug(f"Token payload: {payload}")
-            
-            delegation = delegations.get(token)
-            logger.debug(f"Found delegation: {delegation}")
-            
-            if not delegation:
-                logger.debug("No delegation found for token")
-                audit_logger.log_event(
-                    event_type="token_validation",
-                    action="validate_delegation",
-                    status="error",
-                    details={"error": "Invalid or expired token"},
-                    ip_address=request.remote_addr,
-                    token_id=token
-                )
-                return jsonify({"valid": False, "error": "Invalid or expired token"}), 401
-
-            if not delegation.is_valid():
-                logger.debug("Token has expired")
-                audit_logger.log_event(
-                    event_type="token_validation",
-                    action="validate_delegation",
-                    status="error",
-                    details={"error": "Invalid or expired token"},
-                    ip_address=request.remote_addr,
-                    token_id=token
-                )
-                return jsonify({"valid": False, "error": "Invalid or expired token"}), 401
-
-            # Check if the token is revoked
-            with get_auth_db() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT 1 FROM revoked_tokens WHERE token=?", (token,))
-                if cursor.fetchone():
-                    logger.debug("Token is revoked")
-                    audit_logger.log_event(
-                        event_type="token_validation",
-                        action="validate_delegation",
-                        status="error",
-                        details={"error": "Token revoked"},
-                        ip_address=request.remote_addr,
-                        token_id=token
-                    )
-                    return jsonify({"valid": False, "error": "Token revoked"}), 401
-
-            logger.debug("Token is valid")
-            audit_logger.log_event(
-                event_type="token_validation",
-                action="validate_delegation",
-                status="success",
-                user_id=delegation.user_id,
-                agent_id=delegation.agent_id,
-                details={"scopes": delegation.scopes},
-                ip_address=request.remote_addr,
-                token_id=token
-            )
-
-            return jsonify({
-                "valid": True,
-                "user_id": delegation.user_id,
-                "agent_id": delegation.agent_id,
-                "scopes": delegation.scopes
-            })
-        except jwt.ExpiredSignatureError:
-            logger.debug("Token has expired (JWT)")
-            audit_logger.log_event(
-                event_type="token_validation",
-                action="validate_delegation",
-                status="error",
-                details={"error": "Token has expired"},
-                ip_address=request.remote_addr,
-                token_id=token
-            )
-            return jsonify({"valid": False, "error": "Token has expired"}), 401
-        except jwt.InvalidTokenError as e:
-            logger.debug(f"Invalid token (JWT): {str(e)}")
-            audit_logger.log_event(
-                event_type="token_validation",
-                action="validate_delegation",
-                status="error",
-                details={"error": "Invalid token"},
-                ip_address=request.remote_addr,
-                token_id=token
-            )
-            return jsonify({"valid": False, "error": "Invalid token"}), 401
-            
+        delegation, error = verify_delegation(token)
+        if not error and find_revoked([token_digest(token)]):
+            delegation, error = None, "Token revoked"
+
+        body, status, event = validation_outcome(token, delegation, error, request.remote_addr)
+        audit_logger.log_event(**event)
+        event_log.info("token_validated", token=token, valid=not error, error=error)
+        return jsonify(body), status
     except Exception as e:
         logger.error(f"Error in validate_delegation: {str(e)}", exc_info=True)
         audit_logger.log_event(
@@ -332,6 +542,107 @@ def validate_delegation():
         )
         return jsonify({"error": str(e)}), 500
 
+# Token Introspection (RFC 7662)
+@app.route("/introspect", methods=["POST"])
+def introspect():
+    try:
+        data = request.form if request.form else (request.get_json(silent=True) or {})
+        token = data.get("token")
+        if not token:
+            return jsonify({"error": "invalid_request"}), 400
+
+        delegation, error = verify_delegation(token)
+        if not error and find_revoked([token_digest(token)]):
+            delegation, error = None, "Token revoked"
+        _, _, event = validation_outcome(token, delegation, error, request.remote_addr)
+        event["action"] = "introspect"
+        audit_logger.log_event(**event)
+
+        # Expired, revoked and badly signed tokens never become active again;
+        # active ones may be revoked, so callers only reuse them for the
+        # propagation window. In stateful mode a token missing from this
+        # worker's store may be live on another worker, so that is not cached.
+        max_age = REVOCATION_PROPAGATION_SECONDS
+        if error:
+            body = {"active": False}
+            if error == "Invalid or expired token" and VALIDATION_MODE != "stateless":
+                max_age = None
+        else:
+            body = {
+                "active": True,
+                "scope": " ".join(delegation.scopes),
+                "sub": delegation.user_id,
+                "client_id": delegation.agent_id,
+                "exp": delegation.expires_at
+            }
+            max_age = max(0, min(max_age, delegation.expires_at - int(time.time())))
+
+        # Introspection is a POST, which shared caches don't store; the
+        # header tells the calling resource server how long it may reuse it
+        response = jsonify(body)
+        response.headers["Cache-Control"] = "no-store" if max_age is None else f"private, max-age={max_age}"
+        return response
+    except Exception as e:
+        logger.error(f"Error in introspect: {str(e)}", exc_info=True)
+        audit_logger.log_event(
+            event_type="token_validation",
+            action="introspect",
+            status="error",
+            details={"error": str(e)},
+            ip_address=request.remote_addr
+        )
+        return jsonify({"error": str(e)}), 500
+
+# Validate Many Delegation Tokens
+@app.route("/validate_delegation/batch", methods=["POST"])
+def validate_delegation_batch():
+    try:
+        tokens = request.json.get("delegation_tokens")
+        if not isinstance(tokens, list):
+            return jsonify({"error": "delegation_tokens must be a list"}), 400
+        if len(tokens) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"At most {MAX_BATCH_SIZE} tokens per batch"}), 400
+
+        verified = [verify_delegation(token) if token else (None, None) for token in tokens]
+        revoked = find_revoked([
+            token_digest(token) for token, (_, error) in zip(tokens, verified) if token and not error
+        ])
+
+        results, events = [], []
+        for token, (delegation, error) in zip(tokens, verified):
+            if not token:
+                results.append({"valid": False, "error": "No token provided"})
+                continue
+            if not error and token_digest(token) in revoked:
+                delegation, error = None, "Token revoked"
+            body, _, event = validation_outcome(token, delegation, error, request.remote_addr)
+            results.append(body)
+            events.append(event)
+
+        # One audit transaction for the whole batch
+        audit_logger.log_events(events)
+        return jsonify({"results": results})
+    except Exception as e:
+        logger.error(f"Error in validate_delegation_batch: {str(e)}", exc_info=True)
+        audit_logger.log_event(
+            event_type="token_validation",
+            action="validate_delegation_batch",
+            status="error",
+            details={"error": str(e)},
+            ip_address=request.remote_addr
+        )
+        return jsonify({"error": str(e)}), 500
+
+def revoke_delegation_token(token):
+    """Record ``token`` as revoked; returns False if it already was."""
+    token_id = token_digest(token)
+    # Store in database. The row is only needed until the token expires.
+    revoked = auth_store.revoke(token_id, token_expiry(token), int(time.time()))
+    # Publish only after the commit so a concurrent index rebuild can't drop it
+    revocation_index.add(token_id)
+    verified_tokens.discard(token_id)
+    return revoked
+
 # Revoke Delegation Token
 @app.route("/revoke_delegation", methods=["POST"])
 def revoke_token():
@@ -339,18 +650,12 @@ def revoke_token():
         token = request.json.get("delegation_token")
         if not token:
             return jsonify({"error": "No token provided"}), 400
+        if not isinstance(token, str):
+            return jsonify({"error": "delegation_token must be a string"}), 400
             
         revoked_at = datetime.datetime.utcnow().isoformat()
-
-        # Store in database
-        with get_auth_db() as conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute("INSERT INTO revoked_tokens (token, revoked_at) VALUES (?, ?)", (token, revoked_at))
-                conn.commit()
-            except sqlite3.IntegrityError:
-                # Token already revoked
-                return jsonify({"status": "already_revoked"})
+        if not revoke_delegation_token(token):
+            return jsonify({"status": "already_revoked"})
 
         audit_logger.log_event(
             event_type="token_revocation",
@@ -361,7 +666,7 @@ def revoke_token():
             token_id=token
         )
 
-        logger.info("Delegation token revoked for security reasons")
+        event_log.info("token_revoked", token=token)
         return jsonify({"status": "revoked"})
     except Exception as e:
         logger.error(f"Error in revoke_token: {str(e)}", exc_info=True)
@@ -374,6 +679,26 @@ def revoke_token():
         )
         return jsonify({"error": str(e)}), 500
 
+# Incremental Revocation Feed for relying parties
+@app.route("/revocations", methods=["GET"])
+def list_revocations():
+    try:
+        try:
+            limit = min(int(request.args.get("limit", 1000)), 1000)
+            if limit < 1:
+                raise ValueError("limit must be positive")
+            revocations, next_cursor = auth_store.revocations_since(request.args.get("since"), limit)
+        except ValueError:
+            return jsonify({"error": "Invalid limit or cursor"}), 400
+
+        response = jsonify(revocations)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return response
+    except Exception as e:
+        logger.error(f"Error in list_revocations: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
 # OIDC Discovery Endpoint
 @app.route("/.well-known/openid-configuration", methods=["GET"])
 def oidc_configuration():
@@ -383,15 +708,29 @@ def oidc_configuration():
         "token_endpoint": f"{OIDC_ISSUER}/token",
         "userinfo_endpoint": f"{OIDC_ISSUER}/userinfo",
         "registration_endpoint": f"{OIDC_ISSUER}/register_agent",
+        "introspection_endpoint": f"{OIDC_ISSUER}/introspect",
         "jwks_uri": f"{OIDC_ISSUER}/.well-known/jwks.json",
         "response_types_supported": ["code", "token", "id_token"],
         "subject_types_supported": ["public"],
-        "id_token_signing_alg_values_supported": ["HS256"],
+        "id_token_signing_alg_values_supported": [SIGNING_ALGORITHM],
         "scopes_supported": ["openid", "profile", "email", "read", "write"],
         "token_endpoint_auth_methods_supported": ["client_secret_basic", "client_secret_post"],
-        "claims_supported": ["sub", "iss", "aud", "exp", "iat", "agent_id", "scope"]
+        "claims_supported": ["sub", "iss", "aud", "exp", "iat", "jti", "agent_id", "scope"]
     })
 
+# JSON Web Key Set
+@app.route("/.well-known/jwks.json", methods=["GET"])
+def jwks():
+    # Symmetric keys are never published; HS256 deployments serve an empty set
+    response = jsonify(key_manager.jwks() if key_manager else {"keys": []})
+    response.headers["Cache-Control"] = f"public, max-age={JWKS_MAX_AGE}"
+    return response
+
+# Prometheus Metrics for every worker on this host
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
 # Get Audit Logs
 @app.route("/audit_logs", methods=["POST"])
 def get_audit_logs():
@@ -402,15 +741,25 @@ def get_audit_logs():
         agent_id = data.get("agent_id")
         status = data.get("status")
 
-        logs = audit_logger.get_events(
-            event_type=event_type,
-            user_id=user_id,
-            agent_id=agent_id,
-            status=status,
-            limit=100
-        )
-
-        return jsonify(logs)
+        try:
+            logs, next_cursor = audit_logger.get_events_page(
+                event_type=event_type,
+                user_id=user_id,
+                agent_id=agent_id,
+                status=status,
+                limit=data.get("limit", 100),
+                cursor=data.get("cursor"),
+                since=data.get("since"),
+                until=data.get("until")
+            )
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid limit, cursor or time range"}), 400
+
+        # The body stays a plain list; the next page is advertised in a header
+        response = jsonify(logs)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return response
     except Exception as e:
         logger.error(f"Error in get_audit_logs: {str(e)}", exc_info=True)
         audit_logger.log_event(
@@ -422,6 +771,121 @@ def get_audit_logs():
         )
         return jsonify({"error": str(e)}), 500
 
+# Aggregate Audit Metrics from the per-minute rollups
+@app.route("/audit_metrics", methods=["POST"])
+def get_audit_metrics():
+    try:
+        data = request.json or {}
+        try:
+            if data.get("metric") == "top_ips":
+                rows = audit_logger.get_top_ips(
+                    limit=int(data.get("limit", 10)),
+                    since=data.get("since"),
+                    until=data.get("until")
+                )
+            else:
+                rows = audit_logger.get_metrics(
+                    group_by=data.get("group_by", ["event_type", "status"]),
+                    event_type=data.get("event_type"),
+                    status=data.get("status"),
+                    agent_id=data.get("agent_id"),
+                    since=data.get("since"),
+                    until=data.get("until")
+                )
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+
+        return jsonify(rows)
+    except Exception as e:
+        logger.error(f"Error in get_audit_metrics: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+# Export Audit Logs as newline-delimited JSON
+@app.route("/audit_logs/export", methods=["GET"])
+def export_audit_logs():
+    try:
+        args = request.args
+        try:
+            chunks = audit_logger.export_events(
+                event_type=args.get("event_type"),
+                user_id=args.get("user_id"),
+                agent_id=args.get("agent_id"),
+                status=args.get("status"),
+                since=args.get("since"),
+                until=args.get("until")
+            )
+        except ValueError:
+            return jsonify({"error": "Invalid time range"}), 400
+
+        return Response(stream_with_context(chunks), mimetype="application/x-ndjson")
+    except Exception as e:
+        logger.error(f"Error in export_audit_logs: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+# Live Audit Events (Server-Sent Events)
+@app.route("/audit_logs/stream", methods=["GET"])
+def stream_audit_logs():
+    args = request.args
+    last_event_id = request.headers.get("Last-Event-ID") or args.get("last_event_id")
+    try:
+        last = decode_cursor(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({"error": "Invalid last event id"}), 400
+
+    subscription = audit_broadcaster.subscribe(
+        event_type=args.get("event_type"),
+        user_id=args.get("user_id"),
+        agent_id=args.get("agent_id")
+    )
+
+    def events():
+        try:
+            yield from sse_events(audit_logger, subscription, last)
+        finally:
+            audit_broadcaster.unsubscribe(subscription)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Purge revocations of expired tokens, e.g. from cron:
+#   flask --app packages.server.proxyme_service purge-revocations
+@app.cli.command("purge-revocations")
+def purge_revocations_command():
+    result = auth_store.purge_expired_revocations()
+    revocation_index.rebuild(auth_store.revoked_token_ids())
+    click.echo(json.dumps(result))
+
+# Compress and expire day-partitioned audit segments:
+#   flask --app packages.server.proxyme_service rotate-audit-logs
+@app.cli.command("rotate-audit-logs")
+def rotate_audit_logs_command():
+    click.echo(json.dumps(audit_logger.rotate()))
+
+# Register agents from a CSV or JSON export, writing credentials as NDJSON:
+#   flask --app packages.server.proxyme_service import-agents agents.csv --format csv > credentials.ndjson
+@app.cli.command("import-agents")
+@click.argument("source", type=click.File("r"), default="-")
+@click.option("--format", "fmt", type=click.Choice(["csv", "json"]), default="json")
+@click.option("--batch-size", type=int, default=500)
+@click.option("--workers", type=int, default=None)
+def import_agents_command(source, fmt, batch_size, workers):
+    records = read_agent_records(source, fmt)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in provision_agents(auth_store, records, executor, batch_size, workers):
+            click.echo(json.dumps(result))
+
+# Publish a new key, which starts signing once PROXYME_KEY_PUBLISH_AHEAD_SECONDS
+# have passed; the previous one stays published for the overlap:
+#   flask --app packages.server.proxyme_service rotate-keys
+@app.cli.command("rotate-keys")
+def rotate_keys_command():
+    if key_manager is None:
+        raise click.ClickException("Key rotation requires an asymmetric PROXYME_SIGNING_ALGORITHM")
+    click.echo(json.dumps({"kid": key_manager.rotate().kid}))
+
 # Add error handler
 @app.errorhandler(Exception)
 def handle_error(error):
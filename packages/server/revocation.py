@@ -0,0 +1,290 @@
+"""Revocation storage and the shared revocation index for delegation tokens."""
+import datetime
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import jwt
+
+from .delegation_store import token_digest
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+_HEADER = struct.Struct("<8sQQ")
+_MAGIC = b"PXREVIX1"
+
+
+class RevocationIndex:
+    """
+    Bloom filter of revoked token digests.
+
+    When backed by a file the bitmap is memory-mapped with ``MAP_SHARED``, so
+    every gunicorn worker on the host reads the same bits and sees a
+    revocation as soon as any worker records it. A negative answer means the
+    token is definitely not revoked; a positive answer must be confirmed
+    against the database.
+
+    The filter's size is part of the file name (``revoked_tokens.idx`` is
+    stored as ``revoked_tokens.<bits>.<hashes>.idx``), so workers started
+    with a different capacity during a rolling restart use their own file
+    and never resize one that others have mapped.
+    """
+
+    def __init__(self, path: Optional[str] = None, capacity: int = 1000000,
+                 error_rate: float = 0.001):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.path = None
+        if path and fcntl is not None:
+            root, ext = os.path.splitext(path)
+            self.path = f"{root}.{self.num_bits}.{self.num_hashes}{ext}"
+        self._size = _HEADER.size + (self.num_bits + 7) // 8
+        self._lock = threading.Lock()
+        self._file = None
+        if self.path:
+            self._map_file()
+        else:
+            self._buf = bytearray(self._size)
+            self._write_header()
+
+    def _map_file(self):
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            file = os.fdopen(fd, "r+b")
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino != os.stat(self.path).st_ino:
+                    # Replaced by another process while we waited for the lock
+                    file.close()
+                    continue
+                size = os.fstat(fd).st_size
+                if size == 0:
+                    # New file; growing it can't disturb any reader
+                    os.ftruncate(fd, self._size)
+                    os.pwrite(fd, self._header(), 0)
+                elif size != self._size or os.pread(fd, _HEADER.size, 0) != self._header():
+                    # Damaged; other workers may have it mapped, so swap in
+                    # an empty one. Callers rebuild from the database on startup.
+                    self._replace_file()
+                    file.close()
+                    continue
+                self._buf = mmap.mmap(fd, self._size, mmap.MAP_SHARED)
+                self._file = file
+                return
+            finally:
+                if not file.closed:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _replace_file(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.truncate(self._size)
+            f.write(self._header())
+        os.replace(tmp_path, self.path)
+
+    def _header(self) -> bytes:
+        return _HEADER.pack(_MAGIC, self.num_bits, self.num_hashes)
+
+    def _write_header(self):
+        self._buf[:_HEADER.size] = self._header()
+
+    def _positions(self, key: bytes):
+        # Keys are already uniformly distributed digests, so double hashing
+        # over their two halves is enough to derive the k bit positions.
+        h1 = int.from_bytes(key[:8], "little")
+        h2 = int.from_bytes(key[8:16], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def _exclusive(self):
+        return _FileLock(self._lock, self._file)
+
+    def add(self, key: bytes) -> None:
+        with self._exclusive():
+            buf = self._buf
+            for pos in self._positions(key):
+                offset = _HEADER.size + (pos >> 3)
+                buf[offset] |= 1 << (pos & 7)
+
+    def might_contain(self, key: bytes) -> bool:
+        buf = self._buf
+        for pos in self._positions(key):
+            if not buf[_HEADER.size + (pos >> 3)] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def rebuild(self, keys: Iterable[bytes]) -> None:
+        """
+        Replace the bitmap with one built from ``keys``.
+
+        ``keys`` is consumed while the index is locked. Pass a lazy iterable
+        over the revocation table so that a revocation committed after the
+        read is added only once the rebuild has finished.
+        """
+        with self._exclusive():
+            bitmap = bytearray(self._size - _HEADER.size)
+            for key in keys:
+                for pos in self._positions(key):
+                    bitmap[pos >> 3] |= 1 << (pos & 7)
+            # Every key still revoked is set in both the old and new bitmap,
+            # so readers never see a false negative while this is copied.
+            self._buf[_HEADER.size:] = bitmap
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._buf.close()
+            self._file.close()
+            self._file = None
+
+
+class _FileLock:
+    """Hold a thread lock plus an exclusive ``flock`` on the index file."""
+
+    def __init__(self, lock, file):
+        self._lock = lock
+        self._file = file
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._lock.release()
+
+
+def token_expiry(token: str, default_lifetime: int = 3600) -> int:
+    """
+    Return the ``exp`` claim of ``token`` without verifying it.
+
+    Tokens that can't be decoded are given ``default_lifetime`` seconds from
+    now, which is the longest a delegation token issued by this service lives.
+    """
+    try:
+        exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+    except jwt.InvalidTokenError:
+        exp = None
+    if not isinstance(exp, (int, float)):
+        return int(time.time()) + default_lifetime
+    return int(exp)
+
+
+def migrate_legacy_revocations(conn) -> int:
+    """
+    Convert a ``revoked_tokens`` table keyed by full JWT text to digest keys.
+
+    Returns the number of rows migrated. Does nothing when the table is
+    missing or already uses the compact layout.
+    """
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(revoked_tokens)")]
+    if "token" not in columns:
+        return 0
+    rows = conn.execute("SELECT token, revoked_at FROM revoked_tokens").fetchall()
+    with conn:
+        conn.execute("DROP TABLE revoked_tokens")
+        create_revocation_table(conn)
+        conn.executemany(
+            "INSERT OR IGNORE INTO revoked_tokens (token_id, expires_at, revoked_at) VALUES (?, ?, ?)",
+            [(token_digest(token), token_expiry(token), _parse_revoked_at(revoked_at))
+             for token, revoked_at in rows],
+        )
+    return len(rows)
+
+
+def create_revocation_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            token_id BLOB PRIMARY KEY,
+            expires_at INTEGER NOT NULL,
+            revoked_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    # Serves the incremental feed in revocation order
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_revoked_tokens_revoked_at ON revoked_tokens (revoked_at, token_id)"
+    )
+
+
+def encode_revocation_cursor(revoked_at: int, token_id: bytes) -> str:
+    return f"{revoked_at}:{token_id.hex()}"
+
+
+def decode_revocation_cursor(cursor: str) -> Tuple[int, bytes]:
+    """
+    Parse a feed cursor, raising ValueError if it is malformed.
+
+    A bare epoch-seconds value starts the feed at that time.
+    """
+    revoked_at, _, token_id = cursor.partition(":")
+    return int(revoked_at), bytes.fromhex(token_id)
+
+
+def revocations_since(conn, cursor: Optional[str] = None, limit: int = 1000,
+                      now: Optional[int] = None) -> Tuple[List[Dict[str, object]], Optional[str]]:
+    """
+    Return revocations recorded after ``cursor``, oldest first, and the next cursor.
+
+    Rows are ordered by ``(revoked_at, token_id)``. Tokens that have already
+    expired are skipped. The next cursor is None once the feed is caught up.
+    """
+    since, after_id = decode_revocation_cursor(cursor) if cursor else (0, b"")
+    now = int(time.time()) if now is None else now
+    rows = conn.execute(
+        "SELECT token_id, expires_at, revoked_at FROM revoked_tokens "
+        "WHERE (revoked_at > ? OR (revoked_at = ? AND token_id > ?)) "
+        "ORDER BY revoked_at, token_id LIMIT ?",
+        (since, since, after_id, limit)
+    ).fetchall()
+    next_cursor = encode_revocation_cursor(rows[-1][2], rows[-1][0]) if len(rows) == limit else None
+    return [
+        {"token_id": token_id.hex(), "expires_at": expires_at, "revoked_at": revoked_at}
+        for token_id, expires_at, revoked_at in rows if expires_at > now
+    ], next_cursor
+
+
+def _parse_revoked_at(value) -> int:
+    try:
+        return int(datetime.datetime.fromisoformat(value)
+                   .replace(tzinfo=datetime.timezone.utc).timestamp())
+    except (TypeError, ValueError):
+        return int(time.time())
+
+
+def purge_expired_revocations(conn, now: Optional[int] = None) -> Dict[str, int]:
+    """
+    Delete revocations for tokens that have expired anyway.
+
+    Returns the number of rows removed, the bytes of row data they held and
+    the bytes of database pages released. Freed space is reused by later
+    inserts; the file itself only shrinks after a VACUUM.
+    """
+    now = int(time.time()) if now is None else now
+    used_before = _used_bytes(conn)
+    with conn:
+        # Row data is the digest plus the two 64-bit timestamps
+        rows, data_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length(token_id) + 16), 0) "
+            "FROM revoked_tokens WHERE expires_at <= ?", (now,)
+        ).fetchone()
+        conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= ?", (now,))
+    return {
+        "rows": rows,
+        "bytes": data_bytes,
+        "page_bytes": max(0, used_before - _used_bytes(conn)),
+    }
+
+
+def _used_bytes(conn) -> int:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return (page_count - freelist) * page_size
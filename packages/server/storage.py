@@ -0,0 +1,374 @@
+"""Storage backends for registered clients, revoked tokens and the audit log."""
+import abc
+import collections
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, ContextManager, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from .metrics import SQLITE_SECONDS
+from .profiling import record_phase
+from .revocation import (
+    create_revocation_table,
+    migrate_legacy_revocations,
+    purge_expired_revocations,
+    revocations_since,
+)
+
+# Applied to every connection. WAL lets readers run alongside the single
+# writer, and NORMAL sync is durable across application crashes in WAL mode.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+    "cache_size": -16000,  # KiB
+    "mmap_size": 64 * 1024 * 1024,
+}
+
+
+def connect_sqlite(path: str, **pragmas) -> sqlite3.Connection:
+    """
+    Open a connection to ``path`` with the tuned pragmas applied.
+
+    The connection may be handed between threads, and it keeps up to 256
+    compiled statements so repeated queries skip re-preparing them.
+    Keyword arguments override individual pragmas.
+    """
+    settings = dict(SQLITE_PRAGMAS, **pragmas)
+    conn = sqlite3.connect(path, timeout=settings["busy_timeout"] / 1000,
+                           check_same_thread=False, cached_statements=256)
+    for name, value in settings.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+class PoolTimeout(Exception):
+    """No pooled connection became free in time."""
+
+
+class ConnectionPool:
+    """
+    At most ``max_size`` connections from ``connect``, shared between threads.
+
+    A connection is returned to the pool with any open transaction rolled
+    back. The pool starts empty in a forked child rather than reusing its
+    parent's connections. ``close`` closes idle connections at once and
+    those in use when they are returned.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], max_size: int = 8,
+                 timeout: float = 30.0):
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle: List[sqlite3.Connection] = []
+        self._leased: Set[sqlite3.Connection] = set()
+        self._created = 0
+        self._stale: Set[sqlite3.Connection] = set()
+        self._pid = os.getpid()
+        self._available = threading.Condition()
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def close(self) -> None:
+        with self._available:
+            for conn in self._idle:
+                conn.close()
+            self._created -= len(self._idle)
+            self._idle = []
+            self._stale = set(self._leased)
+
+    def _acquire(self) -> sqlite3.Connection:
+        deadline = time.monotonic() + self.timeout
+        with self._available:
+            if self._pid != os.getpid():
+                self._idle, self._created, self._pid = [], 0, os.getpid()
+                self._leased, self._stale = set(), set()
+            while not self._idle and self._created >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No database connection free after {self.timeout}s")
+                self._available.wait(remaining)
+            if self._idle:
+                conn = self._idle.pop()
+                self._leased.add(conn)
+                return conn
+            self._created += 1
+        try:
+            conn = self._connect()
+        except BaseException:
+            with self._available:
+                self._created -= 1
+                self._available.notify()
+            raise
+        with self._available:
+            self._leased.add(conn)
+        return conn
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        with self._available:
+            self._leased.discard(conn)
+            if conn in self._stale:
+                self._stale.discard(conn)
+                self._created -= 1
+                conn.close()
+            else:
+                self._idle.append(conn)
+            self._available.notify()
+
+
+class AuthStore(abc.ABC):
+    """
+    Persistence for registered clients and revoked tokens.
+
+    Route code only talks to this interface, so another database can be
+    used by implementing it. Token ids are the 16-byte token digests.
+    """
+
+    @abc.abstractmethod
+    def init_schema(self) -> int:
+        """Create or migrate the tables; return the number of revocations migrated."""
+
+    @abc.abstractmethod
+    def load_clients(self, client_ids: Iterable[str]) -> Dict[str, str]:
+        """Return the comma-joined scopes of each registered client in ``client_ids``."""
+
+    @abc.abstractmethod
+    def registered_client_ids(self, client_ids: Iterable[str]) -> Set[str]:
+        """Return the ids in ``client_ids`` that are registered."""
+
+    @abc.abstractmethod
+    def add_clients(self, clients: Sequence[Tuple[str, str, str]]) -> Set[str]:
+        """
+        Insert ``(client_id, client_secret_hash, scopes)`` rows in one transaction.
+
+        Rows whose client id is already registered are skipped; their ids are returned.
+        """
+
+    @abc.abstractmethod
+    def revoke(self, token_id: bytes, expires_at: int, revoked_at: int) -> bool:
+        """Record a revocation; return False if the token was already revoked."""
+
+    @abc.abstractmethod
+    def find_revoked(self, token_ids: Sequence[bytes]) -> Set[bytes]:
+        """Return the ids in ``token_ids`` that have been revoked."""
+
+    @abc.abstractmethod
+    def revoked_token_ids(self) -> Iterator[bytes]:
+        """Yield the id of every recorded revocation."""
+
+    @abc.abstractmethod
+    def revocations_since(self, cursor: Optional[str], limit: int) -> Tuple[List[dict], Optional[str]]:
+        """Return up to ``limit`` revocations after ``cursor`` and the next cursor."""
+
+    @abc.abstractmethod
+    def purge_expired_revocations(self) -> Dict[str, int]:
+        """Delete revocations of expired tokens; return what was removed."""
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteAuthStore(AuthStore):
+    """
+    AuthStore on a SQLite file, reached through a bounded connection pool.
+
+    The time each operation holds its connection is recorded in
+    ``proxyme_sqlite_query_duration_seconds``; waiting for the pool is not.
+    """
+
+    def __init__(self, path: str, pool_size: int = 8, connect: Optional[Callable] = None):
+        self.path = path
+        self.pool = ConnectionPool(connect or (lambda: connect_sqlite(path)), max_size=pool_size)
+
+    @contextlib.contextmanager
+    def _connection(self, operation: str) -> Iterator[sqlite3.Connection]:
+        with self.pool.connection() as conn:
+            start = time.perf_counter()
+            try:
+                yield conn
+            finally:
+                elapsed = time.perf_counter() - start
+                SQLITE_SECONDS.observe(elapsed, operation=operation)
+                record_phase("db", elapsed)
+
+    def init_schema(self) -> int:
+        with self._connection("init_schema") as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS clients (
+                    client_id TEXT PRIMARY KEY,
+                    client_secret TEXT,
+                    scopes TEXT,
+                    redirect_uris TEXT,
+                    grant_types TEXT,
+                    response_types TEXT,
+                    token_endpoint_auth_method TEXT
+                )
+            """)
+            conn.commit()
+            migrated = migrate_legacy_revocations(conn)
+            create_revocation_table(conn)
+            conn.commit()
+            return migrated
+
+    def load_clients(self, client_ids):
+        client_ids = list(client_ids)
+        if not client_ids:
+            return {}
+        with self._connection("load_clients") as conn:
+            rows = conn.execute(
+                f"SELECT client_id, scopes FROM clients WHERE client_id IN ({_placeholders(client_ids)})",
+                client_ids
+            ).fetchall()
+        return dict(rows)
+
+    def registered_client_ids(self, client_ids):
+        client_ids = list(client_ids)
+        if not client_ids:
+            return set()
+        with self._connection("registered_client_ids") as conn:
+            rows = conn.execute(
+                f"SELECT client_id FROM clients WHERE client_id IN ({_placeholders(client_ids)})",
+                client_ids
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def add_clients(self, clients):
+        skipped = set()
+        with self._connection("add_clients") as conn, conn:
+            for client in clients:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO clients (client_id, client_secret, scopes) VALUES (?, ?, ?)", client
+                )
+                if not cursor.rowcount:
+                    skipped.add(client[0])
+        return skipped
+
+    def revoke(self, token_id, expires_at, revoked_at):
+        with self._connection("revoke") as conn:
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT INTO revoked_tokens (token_id, expires_at, revoked_at) VALUES (?, ?, ?)",
+                        (token_id, expires_at, revoked_at)
+                    )
+            except sqlite3.IntegrityError:
+                return False
+        return True
+
+    def find_revoked(self, token_ids):
+        token_ids = list(token_ids)
+        if not token_ids:
+            return set()
+        with self._connection("find_revoked") as conn:
+            rows = conn.execute(
+                f"SELECT token_id FROM revoked_tokens WHERE token_id IN ({_placeholders(token_ids)})",
+                token_ids
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def revoked_token_ids(self):
+        # The connection is held until the caller finishes iterating
+        with self._connection("revoked_token_ids") as conn:
+            for row in conn.execute("SELECT token_id FROM revoked_tokens"):
+                yield row[0]
+
+    def revocations_since(self, cursor, limit):
+        with self._connection("revocations_since") as conn:
+            return revocations_since(conn, cursor, limit)
+
+    def purge_expired_revocations(self):
+        with self._connection("purge_expired_revocations") as conn:
+            return purge_expired_revocations(conn)
+
+    def close(self):
+        self.pool.close()
+
+
+class AuditStore(abc.ABC):
+    """
+    Connections to the audit log's databases.
+
+    AuditLogger keeps the audit SQL and the day-segment layout, and reaches
+    each segment, named by its file path, only through this interface.
+    """
+
+    @abc.abstractmethod
+    def connection(self, path: str, operation: str) -> ContextManager[sqlite3.Connection]:
+        """Hold a connection to the segment at ``path`` for one ``operation``."""
+
+    @abc.abstractmethod
+    def discard(self, path: str) -> None:
+        """Close connections to a segment that has been compressed or deleted."""
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteAuditStore(AuditStore):
+    """
+    AuditStore with a bounded connection pool per segment file.
+
+    Pools for the ``max_segments`` most recently used segments are kept, so
+    queries over many days don't leave connections open to each of them.
+    Time spent holding a connection is recorded as for SQLiteAuthStore.
+    """
+
+    def __init__(self, pool_size: int = 4, max_segments: int = 4,
+                 connect: Callable[[str], sqlite3.Connection] = connect_sqlite):
+        self.pool_size = pool_size
+        self.max_segments = max_segments
+        self._connect = connect
+        self._pools: "collections.OrderedDict[str, ConnectionPool]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self, path, operation):
+        with self._pool(path).connection() as conn:
+            start = time.perf_counter()
+            try:
+                yield conn
+            finally:
+                elapsed = time.perf_counter() - start
+                SQLITE_SECONDS.observe(elapsed, operation=operation)
+                record_phase("db", elapsed)
+
+    def _pool(self, path: str) -> ConnectionPool:
+        with self._lock:
+            pool = self._pools.pop(path, None)
+            if pool is None:
+                pool = ConnectionPool(lambda: self._connect(path), max_size=self.pool_size)
+            self._pools[path] = pool
+            evicted = []
+            while len(self._pools) > self.max_segments:
+                evicted.append(self._pools.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+        return pool
+
+    def discard(self, path):
+        with self._lock:
+            pool = self._pools.pop(path, None)
+        if pool is not None:
+            pool.close()
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), collections.OrderedDict()
+        for pool in pools:
+            pool.close()
+
+
+def _placeholders(values) -> str:
+    return ",".join("?" * len(values))
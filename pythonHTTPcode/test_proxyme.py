@@ -1,6 +1,7 @@
 import unittest
 import json
 import jwt
+import tests  # noqa: F401  keeps the service's data files out of the working tree
 from packages.server.proxyme_service import (
     app,
     SECRET_KEY,
@@ -0,0 +1,45 @@
+# The service opens its databases and revocation index, and picks its
+# metrics directory, when it is imported. Point them at a temporary directory
+# so test runs leave no files behind.
+import atexit
+import os
+import shutil
+import tempfile
+import unittest
+
+_data_dir = tempfile.mkdtemp(prefix="proxyme-tests-")
+atexit.register(shutil.rmtree, _data_dir, ignore_errors=True)
+for _name, _file in (("PROXYME_DB_FILE", "auth.db"),
+                     ("PROXYME_AUDIT_DB_FILE", "audit.db"),
+                     ("PROXYME_REVOCATION_INDEX_FILE", "revoked_tokens.idx")):
+    os.environ.setdefault(_name, os.path.join(_data_dir, _file))
+os.environ.setdefault("PROXYME_METRICS_DIR", os.path.join(_data_dir, "metrics"))
+
+# For tests that run the service with an otherwise empty environment
+DATA_FILES = {name: os.environ[name] for name in
+              ("PROXYME_DB_FILE", "PROXYME_AUDIT_DB_FILE", "PROXYME_REVOCATION_INDEX_FILE")}
+
+
+class AgentTestCase(unittest.TestCase):
+    """
+    Registers an agent granted ``scopes`` before each test.
+
+    ``delegate`` issues ``self.agent_id`` a token. Subclasses that exercise
+    another front end override ``register_agent`` and ``delegate``.
+    """
+    scopes = ["read"]
+
+    def setUp(self):
+        # Imported here so the environment above is in place first
+        from packages.server.proxyme_service import app
+        self.client = app.test_client()
+        self.agent_id = self.register_agent(self.scopes)
+
+    def register_agent(self, scopes):
+        return self.client.post('/register_agent', json={'scopes': scopes}).get_json()['client_id']
+
+    def delegate(self, scopes=None, user_id="test_user"):
+        response = self.client.post('/delegate', json={
+            'user_id': user_id, 'agent_id': self.agent_id, 'scopes': self.scopes if scopes is None else scopes
+        })
+        return response.get_json()['delegation_token']
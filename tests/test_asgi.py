@@ -0,0 +1,145 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+import jwt
+
+from packages.server import asgi, keys, proxyme_service
+from tests import AgentTestCase
+
+
+def call(method, path, body=None, chunks=None):
+    """Run one request through the ASGI app and return (status, headers, json body)."""
+    if chunks is None:
+        chunks = [b"" if body is None else json.dumps(body).encode()]
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "client": ("127.0.0.1", 1234)}
+    asyncio.run(asgi.app(scope, receive, send))
+    headers = {k.decode(): v.decode() for k, v in sent[0]["headers"]}
+    payload = sent[1]["body"]
+    return sent[0]["status"], headers, json.loads(payload) if payload else None
+
+
+class TestAsgiApp(AgentTestCase):
+    # Registration and delegation go through the ASGI app too
+    def register_agent(self, scopes):
+        status, _, body = call("POST", "/register_agent", {"scopes": scopes})
+        self.assertEqual(status, 200)
+        return body["client_id"]
+
+    def delegate(self, scopes=None, user_id="test_user"):
+        status, _, body = call("POST", "/delegate", {
+            "user_id": user_id, "agent_id": self.agent_id, "scopes": self.scopes if scopes is None else scopes
+        })
+        self.assertEqual(status, 200)
+        return body["delegation_token"]
+
+    def test_token_lifecycle(self):
+        token = self.delegate()
+        status, _, body = call("POST", "/validate_delegation", {"delegation_token": token})
+        self.assertEqual((status, body["valid"], body["user_id"]), (200, True, "test_user"))
+
+        self.assertEqual(call("POST", "/revoke_delegation", {"delegation_token": token})[2],
+                         {"status": "revoked"})
+        self.assertEqual(call("POST", "/revoke_delegation", {"delegation_token": token})[2],
+                         {"status": "already_revoked"})
+        status, _, body = call("POST", "/validate_delegation", {"delegation_token": token})
+        self.assertEqual((status, body["error"]), (401, "Token revoked"))
+
+    def test_matches_flask_errors(self):
+        status, _, body = call("POST", "/delegate", {
+            "user_id": "u", "agent_id": self.agent_id, "scopes": ["write"]
+        })
+        self.assertEqual((status, body), (403, {"error": "Invalid scope request"}))
+        self.assertEqual(call("POST", "/register_agent", {})[0], 500)
+        self.assertEqual(call("POST", "/validate_delegation", {})[0], 401)
+        self.assertEqual(call("POST", "/validate_delegation", {"delegation_token": 123})[0], 401)
+        self.assertEqual(call("POST", "/revoke_delegation", {"delegation_token": 123})[0], 400)
+
+    def test_audit_logs_paginate(self):
+        self.delegate()
+        self.delegate()
+        proxyme_service.audit_logger.flush()
+        status, headers, logs = call("POST", "/audit_logs", {"event_type": "token_delegation", "limit": 1})
+        self.assertEqual((status, len(logs)), (200, 1))
+        self.assertIn("x-next-cursor", headers)
+        for body in ({"since": [1]}, {"limit": [1]}, {"cursor": 5}):
+            self.assertEqual(call("POST", "/audit_logs", body)[0], 400)
+
+    def test_blocking_work_offloaded(self):
+        with mock.patch.object(asgi, "run_blocking", wraps=asgi.run_blocking) as run_blocking:
+            self.delegate()
+        run_blocking.assert_called()
+
+    @unittest.skipIf(keys.serialization is None, "cryptography is not installed")
+    def test_key_reloads_offloaded(self):
+        with mock.patch.object(proxyme_service, "key_manager", keys.KeyManager("ES256")):
+            token = self.delegate()
+            other = keys.KeyManager("ES256").signing_key()
+            unknown = jwt.encode({"sub": "u"}, other.private_key, algorithm="ES256",
+                                 headers={"kid": other.kid})
+            proxyme_service.key_manager._next_kid_refresh = 0
+            with mock.patch.object(asgi, "run_blocking", wraps=asgi.run_blocking) as run_blocking:
+                self.assertEqual(call("POST", "/validate_delegation", {"delegation_token": token})[0], 200)
+                run_blocking.assert_not_called()
+                self.assertEqual(call("POST", "/validate_delegation", {"delegation_token": unknown})[0], 401)
+            run_blocking.assert_any_call(proxyme_service.verify_delegation, unknown)
+
+    def test_request_errors(self):
+        self.assertEqual(call("POST", "/missing")[0], 404)
+        self.assertEqual(call("GET", "/delegate")[0], 405)
+        self.assertEqual(call("POST", "/delegate", chunks=[b"{not json"])[0], 400)
+        self.assertEqual(call("POST", "/delegate", chunks=[b"x" * asgi.MAX_BODY_BYTES, b"x"])[0], 413)
+        status, headers, _ = call("OPTIONS", "/delegate")
+        self.assertEqual((status, headers["access-control-allow-origin"]), (204, "*"))
+
+    def test_metrics(self):
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(asgi.app({"type": "http", "method": "GET", "path": "/metrics", "client": None},
+                             receive, send))
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertIn(b'proxyme_http_requests_total{route="/register_agent",method="POST",status="200"}',
+                      sent[1]["body"])
+
+    def test_concurrent_validations(self):
+        token = self.delegate()
+
+        async def validate_many():
+            async def one():
+                sent = []
+                messages = [{"type": "http.request",
+                             "body": json.dumps({"delegation_token": token}).encode()}]
+
+                async def receive():
+                    return messages.pop(0)
+
+                async def send(message):
+                    sent.append(message)
+
+                await asgi.app({"type": "http", "method": "POST", "path": "/validate_delegation",
+                                "client": None}, receive, send)
+                return sent[0]["status"]
+            return await asyncio.gather(*(one() for _ in range(200)))
+
+        self.assertEqual(set(asyncio.run(validate_many())), {200})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,296 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from packages.server.audit_logger import AuditLogger
+from packages.server.proxyme_service import app
+
+
+class TestAuditLoggerWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmpdir, "audit.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _log(self, logger, n=1):
+        for i in range(n):
+            logger.log_event(event_type="token_validation", action="validate_delegation",
+                             status="success", agent_id=f"agent-{i}", details={"n": i})
+
+    def test_events_are_committed_in_batches(self):
+        logger = AuditLogger(self.db_file, batch_size=5, flush_interval=10)
+        with mock.patch.object(logger, "_write_batch", wraps=logger._write_batch) as write:
+            self._log(logger, 10)
+            logger.flush()
+            self.assertEqual([len(c.args[0]) for c in write.call_args_list], [5, 5])
+        self.assertEqual(len(logger.get_events()), 10)
+        logger.close()
+
+    def test_log_events_commits_together(self):
+        logger = AuditLogger(self.db_file, batch_size=2, flush_interval=0)
+        events = [dict(event_type="token_validation", action="validate_delegation", status="success")] * 5
+        with mock.patch.object(logger, "_write_batch", wraps=logger._write_batch) as write:
+            logger.log_events(events)
+            logger.flush()
+            self.assertEqual([len(c.args[0]) for c in write.call_args_list], [5])
+        logger.close()
+
+    def test_close_flushes_pending_events(self):
+        logger = AuditLogger(self.db_file, flush_interval=10)
+        self._log(logger, 3)
+        logger.close()
+        self.assertEqual(len(AuditLogger(self.db_file, async_writes=False).get_events()), 3)
+
+    def test_drop_policy_counts_overflow(self):
+        logger = AuditLogger(self.db_file, queue_size=1, overflow="drop")
+        release = threading.Event()
+        original = logger._write_batch
+        with mock.patch.object(logger, "_write_batch", side_effect=lambda rows: (release.wait(), original(rows))):
+            self._log(logger, 5)
+            self.assertGreater(logger.dropped, 0)
+            release.set()
+            logger.close()
+        self.assertEqual(len(logger.get_events()) + logger.dropped, 5)
+
+    def test_sync_mode_writes_inline(self):
+        logger = AuditLogger(self.db_file, async_writes=False)
+        self._log(logger, 2)
+        self.assertEqual(logger.queue_depth(), 0)
+        self.assertEqual(len(logger.get_events()), 2)
+
+    def test_non_scalar_fields_are_stored_as_json(self):
+        logger = AuditLogger(self.db_file, batch_size=10, flush_interval=10)
+        self._log(logger, 2)
+        logger.log_event(event_type="token_validation", action="validate_delegation", status="error",
+                         token_id={"x": 1}, agent_id=[1], details=["a"])
+        logger.flush()
+        events = logger.get_events()
+        self.assertEqual(len(events), 3)
+        self.assertEqual((events[0]["token_id"], events[0]["agent_id"], events[0]["details"]),
+                         ('{"x": 1}', "[1]", ["a"]))
+        logger.close()
+
+    def test_failed_batch_is_retried_per_event(self):
+        logger = AuditLogger(self.db_file, batch_size=10, flush_interval=10)
+        self._log(logger, 3)
+        # A row the database rejects, queued in the same batch
+        logger._submit([("2024-01-01T00:00:00", "token_validation", "validate_delegation", "error",
+                         None, None, None, None, object(), int(time.time() * 1000))])
+        self._log(logger, 2)
+        with self.assertLogs("packages.server.audit_logger", "ERROR"):
+            logger.flush()
+        self.assertEqual(len(logger.get_events()), 5)
+        logger.close()
+
+    def test_rejects_unknown_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            AuditLogger(self.db_file, overflow="ignore")
+
+
+class TestAuditPagination(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmpdir, "audit.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_keyset_pages_cover_all_events_once(self):
+        logger = AuditLogger(self.db_file, async_writes=False)
+        for i in range(25):
+            logger.log_event(event_type="token_validation", action="validate_delegation",
+                             status="success", agent_id="agent")
+        seen, cursor, pages = [], None, 0
+        while True:
+            events, cursor = logger.get_events_page(agent_id="agent", limit=10, cursor=cursor)
+            seen.extend(event["id"] for event in events)
+            pages += 1
+            if not cursor:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(set(seen)), 25)
+
+    def test_time_range_filter(self):
+        logger = AuditLogger(self.db_file, async_writes=False)
+        logger.log_event(event_type="token_validation", action="validate_delegation", status="success")
+        self.assertEqual(len(logger.get_events(since="2000-01-01T00:00:00")), 1)
+        self.assertEqual(logger.get_events(until=946684800), [])
+
+    def test_invalid_cursor_raises_value_error(self):
+        logger = AuditLogger(self.db_file, async_writes=False)
+        with self.assertRaises(ValueError):
+            logger.get_events(cursor="not-a-cursor")
+        with self.assertRaises(ValueError):
+            logger.get_events(cursor=5)
+
+    def test_unsupported_time_types_raise_value_error(self):
+        logger = AuditLogger(self.db_file, async_writes=False)
+        for value in ([1], {"t": 1}, True):
+            with self.assertRaises(ValueError):
+                logger.get_events(since=value)
+
+    def test_adds_ts_column_to_existing_table(self):
+        conn = sqlite3.connect(self.db_file)
+        conn.execute("""
+            CREATE TABLE audit_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL,
+                event_type TEXT NOT NULL, action TEXT NOT NULL, status TEXT NOT NULL,
+                user_id TEXT, agent_id TEXT, details TEXT, ip_address TEXT, token_id TEXT
+            )
+        """)
+        conn.execute("INSERT INTO audit_logs (timestamp, event_type, action, status) "
+                     "VALUES ('2024-01-01T00:00:00', 'token_delegation', 'delegate', 'success')")
+        conn.commit()
+        conn.close()
+
+        events = AuditLogger(self.db_file, async_writes=False).get_events()
+        self.assertEqual(events[0]["ts"], 1704067200000)
+
+
+class TestAuditExport(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.logger = AuditLogger(os.path.join(self.tmpdir, "audit.db"), async_writes=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_streams_ndjson_in_chunks(self):
+        for i in range(5):
+            self.logger.log_event(event_type="token_delegation", action="delegate",
+                                  status="success", agent_id="agent", details={"n": i})
+        self.logger.log_event(event_type="token_validation", action="validate_delegation", status="error")
+
+        chunks = list(self.logger.export_events(event_type="token_delegation", chunk_size=2))
+        self.assertEqual(len(chunks), 3)
+        events = [json.loads(line) for line in "".join(chunks).splitlines()]
+        self.assertEqual([event["details"]["n"] for event in events], [0, 1, 2, 3, 4])
+
+    def test_details_are_copied_verbatim(self):
+        self.logger.log_event(event_type="token_delegation", action="delegate", status="success",
+                              details='{"b":1,   "a":2}')
+        self.logger.log_event(event_type="token_delegation", action="delegate", status="success")
+        lines = "".join(self.logger.export_events()).splitlines()
+        self.assertTrue(lines[0].endswith('"details": {"b":1,   "a":2}}'))
+        self.assertIsNone(json.loads(lines[1])["details"])
+
+    def test_invalid_time_range_fails_before_streaming(self):
+        with self.assertRaises(ValueError):
+            self.logger.export_events(since="yesterday")
+
+
+class TestAuditRollups(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmpdir, "audit.db")
+        self.logger = AuditLogger(self.db_file, async_writes=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _log(self, status, agent_id, ip_address, at):
+        with mock.patch("time.time", return_value=at):
+            self.logger.log_event(event_type="token_validation", action="validate_delegation",
+                                  status=status, agent_id=agent_id, ip_address=ip_address)
+
+    def test_counts_per_minute_and_agent(self):
+        self._log("success", "a1", "10.0.0.1", 1200)
+        self._log("success", "a1", "10.0.0.1", 1230)
+        self._log("error", "a2", "10.0.0.2", 1290)
+        self._log("success", None, None, 1290)
+
+        rows = self.logger.get_metrics(group_by=["minute", "agent_id"])
+        self.assertEqual(rows, [
+            {"minute": 1200, "agent_id": "a1", "count": 2},
+            {"minute": 1260, "agent_id": None, "count": 1},
+            {"minute": 1260, "agent_id": "a2", "count": 1},
+        ])
+        self.assertEqual(self.logger.get_metrics(group_by=["status"], since=1260),
+                         [{"status": "error", "count": 1}, {"status": "success", "count": 1}])
+        self.assertEqual(self.logger.get_top_ips(limit=1), [{"ip_address": "10.0.0.1", "count": 2}])
+
+    def test_rejects_unknown_dimension(self):
+        with self.assertRaises(ValueError):
+            self.logger.get_metrics(group_by=["ip_address"])
+
+    def test_backfills_rollups_for_existing_events(self):
+        self._log("success", "a1", "10.0.0.1", 1200)
+        conn = sqlite3.connect(self.db_file)
+        conn.execute("DROP TABLE audit_rollups")
+        conn.commit()
+        conn.close()
+
+        logger = AuditLogger(self.db_file, async_writes=False)
+        self.assertEqual(logger.get_metrics(group_by=[]), [{"count": 1}])
+
+
+class TestAuditPartitions(unittest.TestCase):
+    DAY = 86400
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.partition_dir = os.path.join(self.tmpdir, "segments")
+        self.logger = AuditLogger(os.path.join(self.tmpdir, "audit.db"), async_writes=False,
+                                  partition_dir=self.partition_dir, retention_days=5,
+                                  auto_rotate=False)
+        self.now = time.time()
+        # One event per day for the last 7 days, oldest first
+        for days_ago in range(6, -1, -1):
+            with mock.patch("time.time", return_value=self.now - days_ago * self.DAY):
+                self.logger.log_event(event_type="token_validation", action="validate_delegation",
+                                      status="success", details={"days_ago": days_ago})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_writes_one_file_per_day(self):
+        files = [name for name in os.listdir(self.partition_dir) if name.endswith(".db")]
+        self.assertEqual(len(files), 7)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "audit.db")))
+
+    def test_time_range_prunes_segments(self):
+        since = self.now - 2 * self.DAY
+        self.assertEqual(len(self.logger.segments(since=since * 1000)), 3)
+        events = self.logger.get_events(since=since)
+        self.assertEqual([event["details"]["days_ago"] for event in events], [0, 1, 2])
+
+    def test_pagination_spans_segments(self):
+        events, cursor = self.logger.get_events_page(limit=4)
+        more, last = self.logger.get_events_page(limit=4, cursor=cursor)
+        self.assertIsNone(last)
+        self.assertEqual([e["details"]["days_ago"] for e in events + more], list(range(7)))
+
+    def test_rotate_compresses_and_expires_segments(self):
+        result = self.logger.rotate(now=self.now)
+        self.assertEqual(len(result["deleted"]), 2)
+        self.assertEqual(len(result["compressed"]), 3)
+        names = sorted(os.listdir(self.partition_dir))
+        self.assertEqual(sum(name.endswith(".db.gz") for name in names), 3)
+
+        # Archived days stay queryable
+        events = [json.loads(line) for line in "".join(self.logger.export_events()).splitlines()]
+        self.assertEqual([event["details"]["days_ago"] for event in events], [4, 3, 2, 1, 0])
+
+
+class TestAuditEndpoints(unittest.TestCase):
+    def test_malformed_queries_are_rejected(self):
+        client = app.test_client()
+        for body in ({"since": [1]}, {"until": {"t": 1}}, {"limit": [1]}, {"cursor": 5}):
+            self.assertEqual(client.post('/audit_logs', json=body).status_code, 400)
+        self.assertEqual(client.post('/audit_metrics', json={"since": [1]}).status_code, 400)
+        for limit in ([1], 0, -1):
+            response = client.post('/audit_metrics', json={"metric": "top_ips", "limit": limit})
+            self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from packages.server.audit_logger import AuditLogger, encode_cursor
+from packages.server.audit_stream import AuditBroadcaster, sse_events
+
+
+class TestAuditStream(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.logger = AuditLogger(os.path.join(self.tmpdir, "audit.db"), async_writes=False)
+        self.broadcaster = AuditBroadcaster(buffer_size=3)
+        self.logger.add_listener(self.broadcaster.publish)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _log(self, agent_id, event_type="token_validation"):
+        self.logger.log_event(event_type=event_type, action="validate_delegation",
+                              status="success", agent_id=agent_id, details={"agent": agent_id})
+
+    def _data(self, message):
+        return json.loads(message.split("data: ", 1)[1])
+
+    def test_subscribers_receive_matching_events(self):
+        subscription = self.broadcaster.subscribe(agent_id="a1")
+        self._log("a1")
+        self._log("a2")
+        rows = subscription.take(0)
+        self.assertEqual([row[6] for row in rows], ["a1"])
+        self.assertGreater(rows[0][0], 0)
+
+    def test_overflow_marks_subscription(self):
+        subscription = self.broadcaster.subscribe()
+        for _ in range(4):
+            self._log("a1")
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(len(subscription.take(0)), 3)
+
+    def test_stream_replays_then_follows_live_events(self):
+        self._log("a1")
+        self._log("a1")
+        first = self.logger.get_events()[-1]
+        subscription = self.broadcaster.subscribe(agent_id="a1")
+        stream = sse_events(self.logger, subscription, (first["ts"], first["id"]), keepalive=0)
+
+        self.assertTrue(next(stream).startswith("retry:"))
+        replayed = next(stream)
+        self.assertEqual(self._data(replayed)["id"], first["id"] + 1)
+
+        self._log("a1")
+        live = next(stream)
+        event = self._data(live)
+        self.assertEqual(event["details"], {"agent": "a1"})
+        self.assertIn(f"id: {encode_cursor(event['ts'], event['id'])}", live)
+        self.assertEqual(next(stream), ": keep-alive\n\n")
+
+    def test_stream_ends_after_overflow(self):
+        subscription = self.broadcaster.subscribe()
+        stream = sse_events(self.logger, subscription, keepalive=0)
+        next(stream)
+        for _ in range(5):
+            self._log("a1")
+        self.assertEqual(len(list(stream)), 3)
+
+
+class TestFollowingDatabase(unittest.TestCase):
+    # Two loggers on one database stand in for two worker processes
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        db_file = os.path.join(self.tmpdir, "audit.db")
+        self.writer = AuditLogger(db_file, async_writes=False)
+        self.reader = AuditLogger(db_file, async_writes=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _log(self, logger, agent_id):
+        logger.log_event(event_type="token_validation", action="validate_delegation",
+                         status="success", agent_id=agent_id)
+
+    def test_committed_since_reads_other_writers(self):
+        self._log(self.writer, "before")
+        rows, positions = self.reader.committed_since()
+        self.assertEqual(rows, [])
+        self._log(self.writer, "a1")
+        self._log(self.writer, "a2")
+        rows, positions = self.reader.committed_since(positions)
+        self.assertEqual([row[6] for row in rows], ["a1", "a2"])
+        self.assertEqual(self.reader.committed_since(positions)[0], [])
+
+    def test_subscribers_see_events_from_other_processes(self):
+        broadcaster = AuditBroadcaster()
+        broadcaster.follow(self.reader, interval=0.01)
+        self.addCleanup(setattr, broadcaster, "_follower_pid", None)
+        subscription = broadcaster.subscribe(agent_id="a1")
+        self._log(self.writer, "a1")
+        self._log(self.writer, "a2")
+        rows = []
+        for _ in range(100):
+            rows.extend(subscription.take(0.05))
+            if rows:
+                break
+        self.assertEqual([row[6] for row in rows], ["a1"])
+
+    def test_stream_skips_replayed_events_buffered_again(self):
+        broadcaster = AuditBroadcaster()
+        self._log(self.writer, "a1")
+        first = self.writer.get_events()[0]
+        subscription = broadcaster.subscribe()
+        self._log(self.writer, "a1")
+        # A poll that ran late delivers the event the replay also returns
+        rows, _ = self.reader.committed_since({self.reader.db_file: first["id"]})
+        broadcaster.publish(rows)
+        stream = sse_events(self.reader, subscription, (first["ts"], first["id"]), keepalive=0)
+
+        next(stream)
+        self.assertEqual(json.loads(next(stream).split("data: ", 1)[1])["id"], first["id"] + 1)
+        self.assertEqual(next(stream), ": keep-alive\n\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
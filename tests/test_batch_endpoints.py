@@ -0,0 +1,103 @@
+import json
+import unittest
+from unittest import mock
+
+from packages.server import proxyme_service
+from packages.server.proxyme_service import app, audit_logger
+from tests import AgentTestCase
+
+
+class TestBatchValidation(AgentTestCase):
+
+    def test_results_follow_request_order(self):
+        valid, revoked = self.delegate(), self.delegate()
+        self.client.post('/revoke_delegation', json={'delegation_token': revoked})
+
+        with mock.patch.object(audit_logger, 'log_events', wraps=audit_logger.log_events) as log_events:
+            response = self.client.post('/validate_delegation/batch', json={
+                'delegation_tokens': [valid, 'garbage', revoked, None]
+            })
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()['results']
+        self.assertEqual(results[0], {'valid': True, 'user_id': 'test_user',
+                                      'agent_id': self.agent_id, 'scopes': ['read']})
+        self.assertEqual(results[1], {'valid': False, 'error': 'Invalid token'})
+        self.assertEqual(results[2], {'valid': False, 'error': 'Token revoked'})
+        self.assertEqual(results[3], {'valid': False, 'error': 'No token provided'})
+        log_events.assert_called_once()
+        self.assertEqual(len(log_events.call_args.args[0]), 3)
+
+    def test_revocations_checked_in_one_query(self):
+        tokens = [self.delegate() for _ in range(3)]
+        with mock.patch.object(proxyme_service, 'find_revoked', return_value=set()) as find_revoked:
+            self.client.post('/validate_delegation/batch', json={'delegation_tokens': tokens})
+        find_revoked.assert_called_once()
+        self.assertEqual(len(find_revoked.call_args.args[0]), 3)
+
+    def test_rejects_oversized_batch(self):
+        with mock.patch.object(proxyme_service, 'MAX_BATCH_SIZE', 2):
+            response = self.client.post('/validate_delegation/batch', json={'delegation_tokens': ['a', 'b', 'c']})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestBulkDelegation(AgentTestCase):
+    def test_per_item_results(self):
+        with mock.patch.object(audit_logger, 'log_events', wraps=audit_logger.log_events) as log_events:
+            response = self.client.post('/delegate/batch', json={'delegations': [
+                {'user_id': 'u1', 'agent_id': self.agent_id, 'scopes': ['read']},
+                {'user_id': 'u2', 'agent_id': self.agent_id, 'scopes': ['write']},
+                {'user_id': 'u3', 'agent_id': 'unknown', 'scopes': ['read']},
+                'not-an-object',
+                {'user_id': 'u4', 'agent_id': [1], 'scopes': ['read']},
+                {'user_id': {'id': 5}, 'agent_id': self.agent_id, 'scopes': ['read']},
+                {'user_id': 'u6', 'agent_id': self.agent_id, 'scopes': [['read']]},
+            ]})
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()['results']
+        self.assertIn('delegation_token', results[0])
+        self.assertEqual(results[1:], [
+            {'error': 'Invalid scope request'},
+            {'error': 'Invalid agent ID'},
+            {'error': 'Invalid request data'},
+        ] + [{'error': 'Invalid request data'}] * 3)
+        log_events.assert_called_once()
+
+        response = self.client.post('/validate_delegation', json={'delegation_token': results[0]['delegation_token']})
+        self.assertEqual(response.get_json()['user_id'], 'u1')
+
+    def test_clients_loaded_in_one_query(self):
+        items = [{'user_id': f'u{i}', 'agent_id': self.agent_id, 'scopes': ['read']} for i in range(5)]
+        proxyme_service.client_registry.clear()
+        with mock.patch.object(proxyme_service.client_registry, '_load',
+                               wraps=proxyme_service.client_registry._load) as load:
+            self.client.post('/delegate/batch', json={'delegations': items})
+        load.assert_called_once_with({self.agent_id})
+
+
+class TestBulkRegistration(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_streams_credentials(self):
+        with mock.patch.object(proxyme_service, 'hash_pool', return_value=None):
+            response = self.client.post('/register_agent/batch', json={'agents': [
+                {'scopes': ['read']}, {'scopes': 'read write'}, {'scopes': 5},
+            ]})
+            lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[2], {'error': 'Invalid scopes'})
+
+        response = self.client.post('/delegate', json={
+            'user_id': 'u1', 'agent_id': lines[1]['client_id'], 'scopes': ['write']
+        })
+        self.assertEqual(response.status_code, 200)
+
+    def test_rejects_oversized_batch(self):
+        with mock.patch.object(proxyme_service, 'MAX_BATCH_SIZE', 1):
+            response = self.client.post('/register_agent/batch', json={'agents': [{}, {}]})
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import copy
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from benchmarks import lifecycle
+from benchmarks.lifecycle import OPERATIONS, compare, inprocess_server, percentile, run_load
+
+
+class TestLifecycleBenchmark(unittest.TestCase):
+    def test_percentile_interpolates(self):
+        values = [1.0, 2.0, 3.0, 4.0]
+        self.assertEqual(percentile(values, 0.0), 1.0)
+        self.assertEqual(percentile(values, 0.5), 2.5)
+        self.assertEqual(percentile(values, 1.0), 4.0)
+        self.assertEqual(percentile([], 0.99), 0.0)
+
+    def test_run_against_inprocess_server(self):
+        with inprocess_server() as url:
+            results = run_load(url, concurrency=2, iterations=1, validations=2, warmup=0)
+
+        self.assertEqual(set(results["operations"]), set(OPERATIONS))
+        self.assertEqual(results["operations"]["validate"]["count"], 4)
+        self.assertEqual(results["total"]["count"], 10)
+        self.assertEqual(results["total"]["errors"], 0)
+        self.assertLessEqual(results["total"]["p50_ms"], results["total"]["p99_ms"])
+
+    def test_compare_flags_regressions(self):
+        stats = {"count": 10, "errors": 0, "rps": 100.0, "p50_ms": 1.0, "p95_ms": 2.0, "p99_ms": 3.0}
+        baseline = {"operations": {"validate": dict(stats)}, "total": dict(stats)}
+        self.assertEqual(compare(baseline, copy.deepcopy(baseline), threshold=0.1), [])
+
+        slower = copy.deepcopy(baseline)
+        slower["operations"]["validate"]["p95_ms"] = 2.5
+        slower["total"]["rps"] = 80.0
+        self.assertEqual(compare(baseline, slower, threshold=0.1),
+                         ["validate p95_ms: 2.0 -> 2.5", "total rps: 100.0 -> 80.0"])
+
+    def test_gunicorn_waits_for_workers(self):
+        ready = mock.Mock(ok=True)
+        process = mock.Mock(returncode=None)
+        process.poll.return_value = None
+        with tempfile.TemporaryDirectory() as workdir, \
+                mock.patch("subprocess.Popen", return_value=process), \
+                mock.patch("time.sleep"), \
+                mock.patch("requests.get", side_effect=[requests.ConnectionError(),
+                                                        requests.exceptions.ReadTimeout(),
+                                                        ready]) as get:
+            with lifecycle.gunicorn_server(2, 1, 8000, workdir) as url:
+                self.assertEqual(url, "http://127.0.0.1:8000")
+        self.assertEqual(get.call_count, 3)
+        process.terminate.assert_called_once()
+
+    def test_gunicorn_startup_deadline(self):
+        process = mock.Mock(returncode=None)
+        process.poll.return_value = None
+        with tempfile.TemporaryDirectory() as workdir, \
+                mock.patch("subprocess.Popen", return_value=process), \
+                mock.patch("time.sleep"), \
+                mock.patch("time.monotonic", side_effect=[0, lifecycle.STARTUP_TIMEOUT + 1]), \
+                mock.patch("requests.get", side_effect=requests.exceptions.ReadTimeout()):
+            with self.assertRaisesRegex(RuntimeError, "did not become ready"):
+                with lifecycle.gunicorn_server(2, 1, 8000, workdir):
+                    pass
+        process.terminate.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
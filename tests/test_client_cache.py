@@ -0,0 +1,81 @@
+import time
+import unittest
+from unittest import mock
+
+from packages.server.cache import LRUCache
+from packages.server.clients import ClientRegistry
+from packages.server.proxyme_service import app, client_registry
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_entries_expire(self):
+        cache = LRUCache(ttl=60)
+        cache.put("a", 1)
+        cache.put("b", 2, expires_at=time.time() - 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 1)
+
+    def test_stats(self):
+        cache = LRUCache()
+        cache.put("a", 1)
+        cache.get("a")
+        cache.get("missing")
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_rate"]), (1, 1, 0.5))
+
+
+class TestClientRegistry(unittest.TestCase):
+    def setUp(self):
+        self.clients = {'agent': 'read,write'}
+        self.registry = ClientRegistry(
+            lambda ids: {i: self.clients[i] for i in ids if i in self.clients}
+        )
+
+    def test_scopes_parsed_once_and_cached(self):
+        with mock.patch.object(self.registry, '_load', wraps=self.registry._load) as load:
+            client = self.registry.get('agent')
+            self.assertEqual(self.registry.get('agent'), client)
+        load.assert_called_once()
+        self.assertEqual(client.scopes, ('read', 'write'))
+        self.assertEqual(client.scope_set, frozenset({'read', 'write'}))
+
+    def test_unknown_clients_cached_briefly(self):
+        self.assertIsNone(self.registry.get('new'))
+        self.clients['new'] = 'read'
+        self.assertIsNone(self.registry.get('new'))
+        self.registry.invalidate(['new'])
+        self.assertEqual(self.registry.get('new').scopes, ('read',))
+
+    def test_get_many_loads_misses_in_one_query(self):
+        self.clients['other'] = 'read'
+        self.registry.get('agent')
+        with mock.patch.object(self.registry, '_load', wraps=self.registry._load) as load:
+            found = self.registry.get_many(['agent', 'other', 'unknown', 'other'])
+        load.assert_called_once_with({'other', 'unknown'})
+        self.assertEqual(set(found), {'agent', 'other'})
+
+
+class TestDelegateUsesRegistry(unittest.TestCase):
+    def test_repeat_delegation_served_from_cache(self):
+        client = app.test_client()
+        agent_id = client.post('/register_agent', json={'scopes': ['read']}).get_json()['client_id']
+        client.post('/delegate', json={'user_id': 'u', 'agent_id': agent_id, 'scopes': ['read']})
+        with mock.patch.object(client_registry, '_load') as load:
+            response = client.post('/delegate', json={'user_id': 'u', 'agent_id': agent_id, 'scopes': ['read']})
+        self.assertEqual(response.status_code, 200)
+        load.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import time
+import unittest
+from unittest import mock
+
+import requests
+from requests.adapters import BaseAdapter
+
+from packages.client import DelegationError, ProxymeClient, RevocationSet
+from packages.server import keys, proxyme_service
+from packages.server.keys import KeyManager
+from packages.server.proxyme_service import OIDC_ISSUER, app
+
+
+class FlaskAdapter(BaseAdapter):
+    """Route requests made through a Session to the Flask test client."""
+
+    def __init__(self):
+        super().__init__()
+        self.client = app.test_client()
+        self.calls = []
+
+    def send(self, request, **kwargs):
+        path = request.path_url
+        self.calls.append(path.split("?")[0])
+        result = self.client.open(path, method=request.method, data=request.body,
+                                  headers=dict(request.headers))
+        response = requests.Response()
+        response.status_code = result.status_code
+        response.headers.update(result.headers)
+        response._content = result.get_data()
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class TestRevocationSet(unittest.TestCase):
+    def test_prunes_expired_tokens(self):
+        revocations = RevocationSet()
+        revocations.add(b"a", 100)
+        revocations.add(b"b", 300)
+        self.assertEqual(revocations.prune(now=200), 1)
+        self.assertNotIn(b"a", revocations)
+        self.assertIn(b"b", revocations)
+
+
+@unittest.skipIf(keys.serialization is None, "cryptography is not installed")
+class TestProxymeClient(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(proxyme_service, 'key_manager', KeyManager("ES256"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.adapter = FlaskAdapter()
+        session = requests.Session()
+        session.mount("http://", self.adapter)
+        self.sdk = ProxymeClient("http://proxyme", issuer=OIDC_ISSUER, session=session)
+
+        server = self.adapter.client
+        self.agent_id = server.post('/register_agent', json={'scopes': ['read', 'write']}).get_json()['client_id']
+
+    def _delegate(self, scopes=('read',)):
+        response = self.adapter.client.post('/delegate', json={
+            'user_id': 'u1', 'agent_id': self.agent_id, 'scopes': list(scopes)
+        })
+        return response.get_json()['delegation_token']
+
+    def test_verifies_locally(self):
+        token = self._delegate()
+        claims = self.sdk.verify(token, audience=self.agent_id, required_scopes=['read'])
+        self.assertEqual(claims['sub'], 'u1')
+
+        self.adapter.calls.clear()
+        self.sdk.verify(token)
+        self.assertEqual(self.adapter.calls, [])
+
+        with self.assertRaisesRegex(DelegationError, "Insufficient scope"):
+            self.sdk.verify(token, required_scopes=['write'])
+        with self.assertRaisesRegex(DelegationError, "Invalid token"):
+            self.sdk.verify(token, audience='someone-else')
+
+    def test_revocations_synced_incrementally(self):
+        token, other = self._delegate(), self._delegate()
+        self.sdk.verify(token)
+        self.adapter.client.post('/revoke_delegation', json={'delegation_token': token})
+
+        self.sdk.sync_revocations()
+        with self.assertRaisesRegex(DelegationError, "revoked"):
+            self.sdk.verify(token)
+        self.assertEqual(self.sdk.verify(other)['sub'], 'u1')
+
+        # Later syncs only re-read the overlap window
+        store = proxyme_service.auth_store
+        with mock.patch.object(store, 'revocations_since', wraps=store.revocations_since) as feed:
+            self.sdk.sync_revocations()
+        since = int(feed.call_args[0][0])
+        self.assertGreaterEqual(since, int(time.time()) - self.sdk.sync_overlap - 1)
+
+    def test_unknown_kid_refetches_keys(self):
+        self.sdk.verify(self._delegate())
+        proxyme_service.key_manager.rotate()
+        self.sdk._keys_fetched_at -= 10
+        self.assertEqual(self.sdk.verify(self._delegate())['sub'], 'u1')
+
+    def test_fails_closed_when_feed_unreachable(self):
+        token = self._delegate()
+        self.sdk.verify(token)
+        with mock.patch.object(self.sdk.session, 'get', side_effect=requests.ConnectionError):
+            self.sdk._next_sync = 0
+            self.sdk.verify(token)
+            self.sdk._synced_at -= self.sdk.max_staleness
+            self.sdk._next_sync = 0
+            with self.assertRaisesRegex(DelegationError, "unavailable"):
+                self.sdk.verify(token)
+
+
+if __name__ == '__main__':
+    unittest.main()
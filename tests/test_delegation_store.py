@@ -0,0 +1,49 @@
+import time
+import unittest
+
+from packages.server.delegation_store import DelegationStore, token_digest
+from packages.server.proxyme_service import DelegationToken
+
+
+class TestDelegationStore(unittest.TestCase):
+    def test_keys_are_fixed_size_digests(self):
+        store = DelegationStore()
+        store.put("a" * 500, DelegationToken("user", "agent", ["read"]))
+        self.assertEqual(list(store._entries), [token_digest("a" * 500)])
+        self.assertEqual(len(token_digest("a" * 500)), 16)
+
+    def test_get_counts_hits_and_misses(self):
+        store = DelegationStore()
+        delegation = DelegationToken("user", "agent", ["read"])
+        store.put("token", delegation)
+        self.assertIs(store.get("token"), delegation)
+        self.assertIsNone(store.get("other"))
+        stats = store.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_expired_entries_are_purged(self):
+        store = DelegationStore()
+        store.put("old", DelegationToken("user", "agent", [], expires_in=-1))
+        store.put("new", DelegationToken("user", "agent", []))
+        self.assertIsNone(store.get("old"))
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.stats()["expirations"], 1)
+
+    def test_size_cap_evicts_soonest_expiring(self):
+        store = DelegationStore(max_size=2)
+        store.put("short", DelegationToken("user", "agent", [], expires_in=10))
+        store.put("long", DelegationToken("user", "agent", [], expires_in=1000))
+        store.put("newest", DelegationToken("user", "agent", [], expires_in=500))
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get("short"))
+        self.assertIsNotNone(store.get("long"))
+        self.assertEqual(store.stats()["evictions"], 1)
+
+    def test_delegation_token_uses_slots(self):
+        delegation = DelegationToken("user", "agent", ["read"])
+        self.assertFalse(hasattr(delegation, "__dict__"))
+        self.assertAlmostEqual(delegation.expires_at, time.time() + 3600, delta=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,6 @@ import os
 import subprocess
 import time
 import threading
-import sqlite3
 import unittest
 from functools import partial
 from http.server import HTTPServer, SimpleHTTPRequestHandler
@@ -50,8 +49,6 @@ class TestFrontendBackend(unittest.TestCase):
 
         # Configure Flask app for testing
         proxyme_service.app.testing = True
-        proxyme_service.thread_local.auth_conn = sqlite3.connect(":memory:")
-        proxyme_service.thread_local.audit_conn = sqlite3.connect(":memory:")
         proxyme_service.init_db()
 
         cls.flask_thread = FlaskServerThread(proxyme_service.app)
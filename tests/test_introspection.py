@@ -0,0 +1,54 @@
+import unittest
+from unittest import mock
+
+from packages.server import proxyme_service
+from tests import AgentTestCase
+
+
+class TestIntrospection(AgentTestCase):
+    scopes = ['read', 'write']
+
+    def setUp(self):
+        super().setUp()
+        self.token = self.delegate()
+
+    def test_active_token(self):
+        response = self.client.post('/introspect', data={'token': self.token})
+        body = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body['scope'], 'read write')
+        self.assertEqual((body['active'], body['sub'], body['client_id']), (True, 'test_user', self.agent_id))
+        self.assertEqual(response.headers['Cache-Control'],
+                         f"private, max-age={proxyme_service.REVOCATION_PROPAGATION_SECONDS}")
+
+    def test_max_age_bounded_by_token_lifetime(self):
+        with mock.patch.object(proxyme_service, 'REVOCATION_PROPAGATION_SECONDS', 10 ** 6):
+            response = self.client.post('/introspect', json={'token': self.token})
+        max_age = int(response.headers['Cache-Control'].split('max-age=')[1])
+        self.assertLessEqual(max_age, 3600)
+        self.assertGreater(max_age, 3500)
+
+    def test_revoked_and_invalid_tokens_inactive(self):
+        self.client.post('/revoke_delegation', json={'delegation_token': self.token})
+        for token in (self.token, 'garbage'):
+            response = self.client.post('/introspect', data={'token': token})
+            self.assertEqual(response.get_json(), {'active': False})
+        self.assertEqual(self.client.post('/introspect', data={}).status_code, 400)
+
+    def test_conditional_post_not_answered_with_304(self):
+        response = self.client.post('/introspect', data={'token': self.token}, headers={'If-None-Match': '*'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response.headers)
+
+    def test_local_store_miss_not_cached(self):
+        with mock.patch.object(proxyme_service.delegations, 'get', return_value=None):
+            response = self.client.post('/introspect', data={'token': self.token})
+        self.assertEqual(response.get_json(), {'active': False})
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+
+        response = self.client.post('/introspect', data={'token': 'garbage'})
+        self.assertTrue(response.headers['Cache-Control'].startswith('private, max-age='))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import jwt
+
+from packages.server import keys, proxyme_service
+from packages.server.keys import KeyManager
+from packages.server.proxyme_service import app
+
+
+@unittest.skipIf(keys.serialization is None, "cryptography is not installed")
+class TestKeyManager(unittest.TestCase):
+    def test_tokens_verify_against_jwks(self):
+        for algorithm in keys.ASYMMETRIC_ALGORITHMS:
+            manager = KeyManager(algorithm)
+            key = manager.signing_key()
+            token = jwt.encode({"sub": "user"}, key.private_key, algorithm=algorithm,
+                               headers={"kid": key.kid})
+            jwk = jwt.PyJWKSet.from_dict(manager.jwks())[key.kid]
+            self.assertEqual(jwt.decode(token, jwk.key, algorithms=[algorithm])["sub"], "user")
+            self.assertNotIn("d", manager.jwks()["keys"][0])
+
+    def test_rotation_keeps_previous_key_for_overlap(self):
+        with tempfile.TemporaryDirectory() as key_dir:
+            now = time.time()
+            manager = KeyManager("ES256", key_dir=key_dir, rotation_interval=100, overlap=50,
+                                 publish_ahead=10)
+            first = manager.signing_key()
+
+            manager.refresh(now + 95)
+            second = manager._keys[-1]
+            self.assertNotEqual(first.kid, second.kid)
+            self.assertEqual([k["kid"] for k in manager.jwks()["keys"]], [second.kid, first.kid])
+
+            with mock.patch("time.time", return_value=now + 95):
+                self.assertEqual(manager.signing_key().kid, first.kid)
+            with mock.patch("time.time", return_value=now + 120):
+                self.assertEqual(manager.signing_key().kid, second.kid)
+
+            manager.refresh(now + 180)
+            self.assertIsNone(manager.verification_key(first.kid))
+            self.assertEqual(sorted(os.listdir(key_dir)), [".lock", f"{second.kid}.pem"])
+
+    def test_rotated_key_is_published_before_it_signs(self):
+        manager = KeyManager("EdDSA", publish_ahead=600)
+        active = manager.signing_key()
+        rotated = manager.rotate()
+        self.assertIn(rotated.kid, [k["kid"] for k in manager.jwks()["keys"]])
+        self.assertEqual(manager.signing_key().kid, active.kid)
+        with mock.patch("time.time", return_value=rotated.created_at):
+            self.assertEqual(manager.signing_key().kid, rotated.kid)
+
+    def test_workers_share_key_directory(self):
+        with tempfile.TemporaryDirectory() as key_dir:
+            first = KeyManager("EdDSA", key_dir=key_dir, kid_refresh_interval=0)
+            second = KeyManager("EdDSA", key_dir=key_dir, kid_refresh_interval=0)
+            self.assertEqual(first.signing_key().kid, second.signing_key().kid)
+
+            # An unknown kid reloads the directory without waiting for the refresh
+            rotated = first.rotate()
+            self.assertEqual(second.verification_key(rotated.kid).algorithm, "EdDSA")
+
+    def test_unknown_kid_reloads_are_rate_limited(self):
+        with tempfile.TemporaryDirectory() as key_dir:
+            first = KeyManager("EdDSA", key_dir=key_dir)
+            second = KeyManager("EdDSA", key_dir=key_dir, kid_refresh_interval=60)
+            self.assertFalse(second.refresh_due("unknown"))
+            self.assertIsNone(second.verification_key(first.rotate().kid))
+
+            second._next_kid_refresh = 0
+            self.assertTrue(second.refresh_due("unknown"))
+            self.assertFalse(second.refresh_due(second.signing_key().kid))
+            with mock.patch.object(second, "refresh", wraps=second.refresh) as refresh:
+                second.verification_key("unknown")
+                second.verification_key("unknown")
+            self.assertEqual(refresh.call_count, 1)
+
+
+@unittest.skipIf(keys.serialization is None, "cryptography is not installed")
+class TestAsymmetricService(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        patcher = mock.patch.object(proxyme_service, 'key_manager', KeyManager("RS256"))
+        self.key_manager = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_delegated_tokens_verify_offline_and_online(self):
+        agent_id = self.client.post('/register_agent', json={'scopes': ['read']}).get_json()['client_id']
+        token = self.client.post('/delegate', json={
+            'user_id': 'u1', 'agent_id': agent_id, 'scopes': ['read']
+        }).get_json()['delegation_token']
+
+        jwks = self.client.get('/.well-known/jwks.json').get_json()
+        kid = jwt.get_unverified_header(token)['kid']
+        public_key = jwt.PyJWKSet.from_dict(jwks)[kid].key
+        claims = jwt.decode(token, public_key, algorithms=['RS256'], audience=agent_id)
+        self.assertEqual(claims['sub'], 'u1')
+
+        response = self.client.post('/validate_delegation', json={'delegation_token': token})
+        self.assertEqual(response.status_code, 200)
+
+    def test_workers_default_to_shared_key_directory(self):
+        if "PROXYME_SIGNING_KEY_DIR" not in os.environ:
+            db_dir = os.path.dirname(os.path.abspath(proxyme_service.DB_FILE))
+            self.assertEqual(proxyme_service.SIGNING_KEY_DIR, os.path.join(db_dir, "signing_keys"))
+
+    def test_unknown_kid_rejected(self):
+        other = KeyManager("RS256").signing_key()
+        token = jwt.encode({'sub': 'u1', 'exp': int(time.time()) + 60}, other.private_key,
+                           algorithm='RS256', headers={'kid': other.kid})
+        response = self.client.post('/validate_delegation', json={'delegation_token': token})
+        self.assertEqual(response.status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import json
+import os
+import re
+import tempfile
+import subprocess
+import sys
+import threading
+import unittest
+
+from packages.server import metrics
+from packages.server.metrics import Registry, render_snapshots
+from packages.server.proxyme_service import app
+
+
+def sample(text, line_prefix):
+    for line in text.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+class TestRegistry(unittest.TestCase):
+    def test_counter_sums_across_threads(self):
+        registry = Registry()
+        counter = registry.counter("test_total", "Test", ("kind",))
+
+        def work():
+            for _ in range(1000):
+                counter.inc(kind="a")
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc(5, kind="b")
+
+        text = registry.render()
+        self.assertIn("# TYPE test_total counter", text)
+        self.assertEqual(sample(text, 'test_total{kind="a"}'), 8000)
+        self.assertEqual(sample(text, 'test_total{kind="b"}'), 5)
+
+    def test_exited_threads_are_folded(self):
+        registry = Registry()
+        counter = registry.counter("test_total", "Test")
+        histogram = registry.histogram("test_seconds", "Test", buckets=(1.0,))
+        for _ in range(50):
+            thread = threading.Thread(target=lambda: (counter.inc(), histogram.observe(0.5)))
+            thread.start()
+            thread.join()
+        counter.inc()
+        histogram.observe(0.5)
+
+        self.assertEqual(len(counter._shards), 1)
+        text = registry.render()
+        self.assertEqual(sample(text, "test_total"), 51)
+        self.assertEqual(sample(text, "test_seconds_count"), 51)
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry()
+        histogram = registry.histogram("test_seconds", "Test", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 2.0):
+            histogram.observe(value)
+
+        text = registry.render()
+        self.assertEqual(sample(text, 'test_seconds_bucket{le="0.1"}'), 1)
+        self.assertEqual(sample(text, 'test_seconds_bucket{le="1"}'), 3)
+        self.assertEqual(sample(text, 'test_seconds_bucket{le="+Inf"}'), 4)
+        self.assertEqual(sample(text, "test_seconds_count"), 4)
+        self.assertAlmostEqual(sample(text, "test_seconds_sum"), 3.05)
+
+    def test_escapes_label_values(self):
+        registry = Registry()
+        registry.counter("test_total", "Test", ("path",)).inc(path='a"b\\c')
+        self.assertIn('test_total{path="a\\"b\\\\c"} 1', registry.render())
+        registry.counter("lines_total", "Test", ("text",)).inc(text="a\nb")
+        self.assertIn('lines_total{text="a\\nb"} 1', registry.render())
+
+    def test_aggregates_worker_snapshots(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = Registry(directory)
+            registry.counter("test_total", "Test").inc(2)
+            registry.add_collector("test", lambda: [("test_depth", "gauge", "Test", {}, 3)])
+
+            # Another live worker, and one that has exited
+            other = registry.snapshot()
+            other["pid"] = os.getppid()
+            exited = registry.snapshot()
+            exited["pid"] = 2 ** 22 + 1
+            for snapshot in (other, exited):
+                with open(os.path.join(directory, f"metrics-{snapshot['pid']}.json"), "w") as f:
+                    json.dump(snapshot, f)
+
+            text = registry.render()
+            # Counters keep the exited worker's totals, gauges drop them
+            self.assertEqual(sample(text, "test_total"), 6)
+            self.assertEqual(sample(text, "test_depth"), 6)
+
+    def test_default_directory_shared_by_process_group(self):
+        child = subprocess.run(
+            [sys.executable, "-c", "from packages.server import metrics; print(metrics.default_directory())"],
+            capture_output=True, text=True, check=True
+        )
+        self.assertEqual(child.stdout.strip(), metrics.default_directory())
+
+    def test_metric_without_merge_cannot_be_created(self):
+        class Partial(metrics._Metric):
+            kind = "counter"
+
+        with self.assertRaises(TypeError):
+            Partial("test_total", "Test")
+
+    def test_render_without_samples(self):
+        self.assertEqual(render_snapshots([]), "\n")
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_records_routes_and_caches(self):
+        self.client.post("/register_agent", json={"scopes": ["read"]})
+        text = self.client.get("/metrics").get_data(as_text=True)
+
+        self.assertIn('proxyme_http_requests_total{route="/register_agent",method="POST",status="200"}', text)
+        self.assertIsNotNone(sample(text, 'proxyme_http_request_duration_seconds_count{route="/register_agent"}'))
+        self.assertIsNotNone(sample(text, 'proxyme_cache_hits_total{cache="clients"}'))
+        self.assertIsNotNone(sample(text, "proxyme_delegation_store_size"))
+        self.assertIsNotNone(sample(text, "proxyme_audit_queue_depth"))
+        self.assertTrue(re.search(r'proxyme_sqlite_query_duration_seconds_count\{operation="add_clients"\} \d+', text))
+
+    def test_unmatched_paths_share_a_label(self):
+        self.client.get("/no/such/path")
+        text = self.client.get("/metrics").get_data(as_text=True)
+        self.assertIn('route="unmatched"', text)
+        self.assertNotIn("/no/such/path", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
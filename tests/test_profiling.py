@@ -0,0 +1,95 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from packages.server import proxyme_service
+from packages.server.profiling import (
+    SlowRequestProfiler,
+    finish_timing,
+    phase,
+    server_timing_header,
+    start_timing,
+)
+from packages.server.proxyme_service import app
+
+
+def phases(header):
+    return {entry.split(";")[0] for entry in header.split(", ")}
+
+
+class TestPhaseTiming(unittest.TestCase):
+    def test_phases_only_recorded_while_timing(self):
+        with phase("jwt"):
+            pass
+        self.assertEqual(finish_timing(), {})
+
+        start_timing()
+        for _ in range(2):
+            with phase("db"):
+                time.sleep(0.001)
+        timings = finish_timing()
+        self.assertEqual(list(timings), ["db"])
+        self.assertGreaterEqual(timings["db"], 0.002)
+
+    def test_header_format(self):
+        self.assertEqual(server_timing_header({"jwt": 0.0015}, 0.002),
+                         "jwt;dur=1.500, total;dur=2.000")
+
+
+class TestServerTimingHeader(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_disabled_by_default(self):
+        response = self.client.post('/register_agent', json={'scopes': ['read']})
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_reports_handler_phases(self):
+        with mock.patch.object(proxyme_service, 'SERVER_TIMING', True):
+            response = self.client.post('/register_agent', json={'scopes': ['read']})
+            self.assertEqual(phases(response.headers['Server-Timing']), {'hash', 'db', 'total'})
+
+            agent_id = response.get_json()['client_id']
+            response = self.client.post('/delegate', json={
+                'user_id': 'test_user', 'agent_id': agent_id, 'scopes': ['read']
+            })
+            self.assertIn('sign', phases(response.headers['Server-Timing']))
+            self.assertIn('audit', phases(response.headers['Server-Timing']))
+
+            proxyme_service.verified_tokens.clear()
+            response = self.client.post('/validate_delegation', json={
+                'delegation_token': response.get_json()['delegation_token']
+            })
+            self.assertIn('jwt', phases(response.headers['Server-Timing']))
+
+
+class TestSlowRequestProfiler(unittest.TestCase):
+    def test_keeps_slowest_requests(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "slow-{pid}.folded")
+            profiler = SlowRequestProfiler(path, slowest=2, interval=0.001)
+
+            def handle_request(seconds):
+                profiler.start()
+                time.sleep(seconds)
+                profiler.finish(f"POST /slow{int(seconds * 1000)}", seconds)
+
+            for seconds in (0.05, 0.02, 0.08):
+                thread = threading.Thread(target=handle_request, args=(seconds,))
+                thread.start()
+                thread.join()
+
+            with open(path.format(pid=os.getpid())) as f:
+                lines = f.read().splitlines()
+
+        requests = {line.split(";", 1)[0] for line in lines}
+        self.assertEqual(requests, {"POST /slow80 80.0ms", "POST /slow50 50.0ms"})
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+        self.assertTrue(any("handle_request (test_profiling.py:" in line for line in lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import io
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from werkzeug.security import check_password_hash
+
+from packages.server import proxyme_service
+from packages.server.provisioning import hash_secrets, provision_agents, read_agent_records
+from packages.server.storage import SQLiteAuthStore
+
+
+class TestReadAgentRecords(unittest.TestCase):
+    def test_csv(self):
+        stream = io.StringIO("client_id,scopes\nagent-1,read write\n,read\n")
+        self.assertEqual(list(read_agent_records(stream, "csv")), [
+            {"client_id": "agent-1", "scopes": ["read", "write"]},
+            {"scopes": ["read"]},
+        ])
+
+    def test_ndjson_and_array(self):
+        ndjson = io.StringIO('\n{"scopes": ["read"]}\n\n{"scopes": ["write"]}\n')
+        array = io.StringIO('[{"scopes": ["read"]}, {"scopes": ["write"]}]')
+        expected = [{"scopes": ["read"]}, {"scopes": ["write"]}]
+        self.assertEqual(list(read_agent_records(ndjson)), expected)
+        self.assertEqual(list(read_agent_records(array)), expected)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            list(read_agent_records(io.StringIO(""), "xml"))
+
+
+class TestProvisionAgents(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = SQLiteAuthStore(os.path.join(self.tmpdir.name, "auth.db"))
+        self.store.init_schema()
+        self.store.add_clients([("taken", "x", "read")])
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_results_follow_input_order(self):
+        records = [
+            {"scopes": ["read"]},
+            {"client_id": "taken", "scopes": ["read"]},
+            {"scopes": ["read", 1]},
+            {"client_id": "agent-1", "scopes": "read write"},
+            {"client_id": "agent-1", "scopes": ["read"]},
+            "not-an-object",
+        ]
+        results = list(provision_agents(self.store, records, batch_size=2))
+        self.assertIn("client_secret", results[0])
+        self.assertEqual(results[1], {"client_id": "taken", "error": "Client already registered"})
+        self.assertEqual(results[2], {"error": "Invalid scopes"})
+        self.assertEqual(results[3]["scopes"], ["read", "write"])
+        self.assertEqual(results[4], {"client_id": "agent-1", "error": "Client already registered"})
+        self.assertEqual(results[5], {"error": "Invalid request data"})
+
+        with self.store.pool.connection() as conn:
+            stored = dict(conn.execute("SELECT client_id, client_secret FROM clients"))
+        self.assertEqual(len(stored), 3)
+        self.assertTrue(check_password_hash(stored["agent-1"], results[3]["client_secret"]))
+
+    def test_concurrent_registration_of_same_id(self):
+        # Another request registers the id between the check and the insert
+        original = self.store.registered_client_ids
+        with mock.patch.object(self.store, "registered_client_ids",
+                               side_effect=lambda ids: (original(ids),
+                                                        self.store.add_clients([("racer", "x", "read")]))[0]):
+            results = list(provision_agents(self.store, [{"client_id": "racer", "scopes": ["read"]},
+                                                         {"client_id": "other", "scopes": ["read"]}]))
+        self.assertEqual(results[0], {"client_id": "racer", "error": "Client already registered"})
+        self.assertIn("client_secret", results[1])
+        self.assertEqual(self.store.load_clients(["racer", "other"]), {"racer": "read", "other": "read"})
+
+    def test_records_consumed_in_batches(self):
+        consumed = []
+
+        def records():
+            for i in range(5):
+                consumed.append(i)
+                yield {"scopes": ["read"]}
+
+        results = provision_agents(self.store, records(), batch_size=2)
+        next(results)
+        self.assertEqual(consumed, [0, 1])
+
+    def test_hash_secrets_with_executor(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            hashes = hash_secrets(["a", "b", "c"], executor, workers=2)
+        self.assertTrue(all(check_password_hash(h, s) for h, s in zip(hashes, "abc")))
+
+
+class TestRegisterAgent(unittest.TestCase):
+    def test_single_registration_stores_secret_hash(self):
+        client = proxyme_service.app.test_client()
+        credentials = client.post('/register_agent', json={'scopes': ['read']}).get_json()
+        with proxyme_service.auth_store.pool.connection() as conn:
+            stored = conn.execute("SELECT client_secret FROM clients WHERE client_id = ?",
+                                  (credentials['client_id'],)).fetchone()[0]
+        self.assertNotEqual(stored, credentials['client_secret'])
+        self.assertTrue(check_password_hash(stored, credentials['client_secret']))
+
+    def test_single_registration_keeps_baseline_scope_rules(self):
+        client = proxyme_service.app.test_client()
+        for scopes in ([], ['read,write']):
+            self.assertEqual(client.post('/register_agent', json={'scopes': scopes}).status_code, 200)
+        for scopes in ('read', ['read', 1]):
+            response = client.post('/register_agent', json={'scopes': scopes})
+            self.assertEqual((response.status_code, response.get_json()), (400, {'error': 'Invalid scopes'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
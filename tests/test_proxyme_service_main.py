@@ -5,6 +5,8 @@ import unittest
 from unittest import mock
 from flask import Flask
 
+from tests import DATA_FILES
+
 # Utility function for patching sqlite3.connect to in-memory
 _real_connect = sqlite3.connect
 def memory_connect(*args, **kwargs):
@@ -12,7 +14,7 @@ def memory_connect(*args, **kwargs):
 
 class TestProxymeServiceMain(unittest.TestCase):
     def test_env_variables_used(self):
-        env = {"PORT": "5055", "DEBUG": "1"}
+        env = {"PORT": "5055", "DEBUG": "1", **DATA_FILES}
         with mock.patch.dict(os.environ, env, clear=True), \
              mock.patch('sqlite3.connect', memory_connect), \
              mock.patch.object(Flask, 'run') as run_mock:
@@ -20,7 +22,7 @@ class TestProxymeServiceMain(unittest.TestCase):
             run_mock.assert_called_once_with(host='0.0.0.0', port=5055, debug=True)
 
     def test_defaults_used(self):
-        with mock.patch.dict(os.environ, {}, clear=True), \
+        with mock.patch.dict(os.environ, DATA_FILES, clear=True), \
              mock.patch('sqlite3.connect', memory_connect), \
              mock.patch.object(Flask, 'run') as run_mock:
             runpy.run_module('packages.server.proxyme_service', run_name='__main__')
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import jwt
+
+from packages.server.delegation_store import token_digest
+from packages.server.revocation import (
+    RevocationIndex,
+    create_revocation_table,
+    migrate_legacy_revocations,
+    purge_expired_revocations,
+    revocations_since,
+)
+from packages.server.proxyme_service import app
+
+
+class TestRevocationIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "revoked_tokens.idx")
+
+    def test_add_and_lookup(self):
+        index = RevocationIndex(capacity=1000)
+        index.add(token_digest("revoked"))
+        self.assertTrue(index.might_contain(token_digest("revoked")))
+        self.assertFalse(index.might_contain(token_digest("active")))
+
+    def test_shared_between_instances(self):
+        writer = RevocationIndex(self.path, capacity=1000)
+        reader = RevocationIndex(self.path, capacity=1000)
+        writer.add(token_digest("revoked"))
+        self.assertTrue(reader.might_contain(token_digest("revoked")))
+        writer.close()
+        reader.close()
+
+    def test_rebuild_drops_missing_keys(self):
+        index = RevocationIndex(self.path, capacity=1000)
+        index.add(token_digest("purged"))
+        index.rebuild(iter([token_digest("kept")]))
+        self.assertTrue(index.might_contain(token_digest("kept")))
+        self.assertFalse(index.might_contain(token_digest("purged")))
+        index.close()
+
+    def test_parameter_change_uses_own_file(self):
+        old = RevocationIndex(self.path, capacity=1000)
+        old.add(token_digest("revoked"))
+        index = RevocationIndex(self.path, capacity=5000)
+        self.assertNotEqual(index.path, old.path)
+        self.assertFalse(index.might_contain(token_digest("revoked")))
+        # Workers still running with the old capacity keep their bits
+        self.assertTrue(old.might_contain(token_digest("revoked")))
+        self.assertTrue(RevocationIndex(self.path, capacity=1000).might_contain(token_digest("revoked")))
+        index.close()
+        old.close()
+
+    def test_damaged_file_replaced_not_truncated(self):
+        reader = RevocationIndex(self.path, capacity=1000)
+        reader.add(token_digest("revoked"))
+        with open(reader.path, "r+b") as f:
+            f.write(b"garbage!")
+        index = RevocationIndex(self.path, capacity=1000)
+        self.assertFalse(index.might_contain(token_digest("revoked")))
+        # The old mapping is untouched until its worker reopens the file
+        self.assertTrue(reader.might_contain(token_digest("revoked")))
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), [os.path.basename(index.path)])
+        index.close()
+        reader.close()
+
+
+class TestRevocationTable(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_migrates_legacy_table(self):
+        token = jwt.encode({"sub": "user", "exp": 2000000000}, "secret", algorithm="HS256")
+        self.conn.execute("CREATE TABLE revoked_tokens (token TEXT PRIMARY KEY, revoked_at TEXT NOT NULL)")
+        self.conn.execute("INSERT INTO revoked_tokens VALUES (?, ?)", (token, "2024-01-01T00:00:00"))
+        self.conn.commit()
+
+        self.assertEqual(migrate_legacy_revocations(self.conn), 1)
+        row = self.conn.execute("SELECT token_id, expires_at, revoked_at FROM revoked_tokens").fetchone()
+        self.assertEqual(row, (token_digest(token), 2000000000, 1704067200))
+        self.assertEqual(migrate_legacy_revocations(self.conn), 0)
+
+    def test_purge_removes_expired_rows(self):
+        create_revocation_table(self.conn)
+        now = int(time.time())
+        rows = [(token_digest(str(i)), now - 10 if i % 2 else now + 3600, now) for i in range(2000)]
+        self.conn.executemany("INSERT INTO revoked_tokens VALUES (?, ?, ?)", rows)
+        self.conn.commit()
+
+        result = purge_expired_revocations(self.conn, now=now)
+        self.assertEqual(result["rows"], 1000)
+        self.assertEqual(result["bytes"], 1000 * 32)
+        count = self.conn.execute("SELECT COUNT(*) FROM revoked_tokens").fetchone()[0]
+        self.assertEqual(count, 1000)
+
+    def test_feed_pages_in_revocation_order(self):
+        create_revocation_table(self.conn)
+        now = int(time.time())
+        rows = [(token_digest(str(i)), now + 3600, now - i // 2) for i in range(5)]
+        rows.append((token_digest("expired"), now - 1, now))
+        self.conn.executemany("INSERT INTO revoked_tokens VALUES (?, ?, ?)", rows)
+        self.conn.commit()
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = revocations_since(self.conn, cursor, limit=2, now=now)
+            seen.extend(page)
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 5)
+        self.assertEqual([r["revoked_at"] for r in seen], sorted(r["revoked_at"] for r in seen))
+        self.assertNotIn(token_digest("expired").hex(), [r["token_id"] for r in seen])
+
+        recent, _ = revocations_since(self.conn, str(now - 1), now=now)
+        self.assertEqual({r["token_id"] for r in recent},
+                         {token_digest(str(i)).hex() for i in range(4)})
+
+
+class TestNonStringTokens(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_rejected_before_hashing(self):
+        for token in (123, {"x": 1}, ["a"]):
+            response = self.client.post('/revoke_delegation', json={'delegation_token': token})
+            self.assertEqual(response.status_code, 400)
+            response = self.client.post('/validate_delegation', json={'delegation_token': token})
+            self.assertEqual(response.status_code, 401)
+            response = self.client.post('/introspect', json={'token': token})
+            self.assertEqual(response.get_json(), {'active': False})
+        response = self.client.post('/validate_delegation/batch', json={'delegation_tokens': [123, {"x": 1}]})
+        self.assertEqual(response.get_json()['results'], [{'valid': False, 'error': 'Invalid token'}] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from benchmarks.soak import growth_per_100k
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestSoak(unittest.TestCase):
+    def test_growth_is_rss_slope(self):
+        points = [{"operations": 100000, "rss_mb": 50.0},
+                  {"operations": 200000, "rss_mb": 52.0},
+                  {"operations": 300000, "rss_mb": 54.0}]
+        self.assertAlmostEqual(growth_per_100k(points), 2.0)
+        self.assertEqual(growth_per_100k(points[:1]), 0.0)
+
+    def test_short_run_reports_allocation_sites(self):
+        # A separate process, as the simulated clock writes future timestamps
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "soak.json")
+            process = subprocess.run(
+                [sys.executable, "-m", "benchmarks.soak", "--operations", "600", "--report-every", "200",
+                 "--warmup", "200", "--threads", "2", "--batch", "100", "--seconds-per-op", "60",
+                 "--top", "3", "--max-growth-mb", "1000000", "-o", output],
+                cwd=REPO_ROOT, capture_output=True, text=True, timeout=120
+            )
+            self.assertEqual(process.returncode, 0, process.stderr)
+            with open(output) as f:
+                results = json.load(f)
+
+        self.assertTrue(results["passed"])
+        self.assertGreaterEqual(results["operations"], 600)
+        self.assertEqual(results["errors"], 0)
+        self.assertEqual(len([p for p in results["points"] if p.get("baseline")]), 1)
+        after = results["points"][-1]
+        self.assertLessEqual(len(after["top_growth"]), 3)
+        self.assertGreater(after["simulated_hours"], 9)
+        self.assertIn("RSS growth", process.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
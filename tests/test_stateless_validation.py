@@ -0,0 +1,49 @@
+import unittest
+from unittest import mock
+
+import jwt
+
+from packages.server import proxyme_service
+from packages.server.proxyme_service import delegations, SECRET_KEY
+from tests import AgentTestCase
+
+
+class TestStatelessValidation(AgentTestCase):
+    scopes = ['read', 'write']
+
+    def setUp(self):
+        super().setUp()
+        self.token = self.delegate(['read'])
+
+    def test_token_carries_jti(self):
+        payload = jwt.decode(self.token, options={"verify_signature": False})
+        self.assertEqual(len(payload['jti']), 32)
+
+    def test_validates_without_local_delegation(self):
+        # Simulate a worker that did not issue the token
+        delegations.clear()
+        with mock.patch.object(proxyme_service, 'VALIDATION_MODE', 'stateless'):
+            response = self.client.post('/validate_delegation', json={'delegation_token': self.token})
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertTrue(data['valid'])
+        self.assertEqual(data['user_id'], 'test_user')
+        self.assertEqual(data['agent_id'], self.agent_id)
+        self.assertEqual(data['scopes'], ['read'])
+
+    def test_stateful_mode_requires_local_delegation(self):
+        delegations.clear()
+        response = self.client.post('/validate_delegation', json={'delegation_token': self.token})
+        self.assertEqual(response.status_code, 401)
+
+    def test_stateless_rejects_token_without_jti(self):
+        payload = jwt.decode(self.token, options={"verify_signature": False})
+        del payload['jti']
+        token = jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+        with mock.patch.object(proxyme_service, 'VALIDATION_MODE', 'stateless'):
+            response = self.client.post('/validate_delegation', json={'delegation_token': token})
+        self.assertEqual(response.status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from packages.server.audit_logger import AuditLogger
+from packages.server.delegation_store import token_digest
+from packages.server.storage import (
+    AuthStore,
+    ConnectionPool,
+    PoolTimeout,
+    SQLiteAuditStore,
+    SQLiteAuthStore,
+    connect_sqlite,
+)
+
+
+class TestConnectSqlite(unittest.TestCase):
+    def test_pragmas_applied(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conn = connect_sqlite(os.path.join(tmpdir, "test.db"))
+            try:
+                self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+                self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], 5000)
+                self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)
+            finally:
+                conn.close()
+
+
+class TestConnectionPool(unittest.TestCase):
+    def test_reuses_connections_up_to_max_size(self):
+        pool = ConnectionPool(lambda: connect_sqlite(":memory:"), max_size=2, timeout=0.1)
+        with pool.connection() as first:
+            with pool.connection() as second:
+                self.assertIsNot(first, second)
+                with self.assertRaises(PoolTimeout):
+                    with pool.connection():
+                        pass
+        with pool.connection() as again:
+            self.assertIn(again, (first, second))
+        pool.close()
+
+    def test_waiting_thread_gets_released_connection(self):
+        pool = ConnectionPool(lambda: connect_sqlite(":memory:"), max_size=1, timeout=5)
+        acquired = []
+        with pool.connection() as conn:
+            waiter = threading.Thread(target=lambda: acquired.append(pool._acquire()))
+            waiter.start()
+            time.sleep(0.05)
+            self.assertEqual(acquired, [])
+        waiter.join()
+        self.assertEqual(acquired, [conn])
+
+    def test_open_transaction_rolled_back_on_release(self):
+        pool = ConnectionPool(lambda: connect_sqlite(":memory:"), max_size=1)
+        with pool.connection() as conn:
+            conn.execute("CREATE TABLE t (x)")
+            conn.commit()
+            conn.execute("INSERT INTO t VALUES (1)")
+        with pool.connection() as conn:
+            self.assertFalse(conn.in_transaction)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 0)
+
+    def test_close_closes_leased_connections_on_release(self):
+        pool = ConnectionPool(lambda: connect_sqlite(":memory:"), max_size=1, timeout=0.1)
+        with pool.connection() as conn:
+            pool.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+        with pool.connection() as fresh:
+            self.assertIsNot(fresh, conn)
+
+
+class TestSQLiteAuthStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = SQLiteAuthStore(os.path.join(self.tmpdir.name, "auth.db"), pool_size=2)
+        self.store.init_schema()
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_clients(self):
+        self.store.add_clients([("a", "hash", "read,write"), ("b", "hash", "read")])
+        self.assertEqual(self.store.load_clients(["a", "missing"]), {"a": "read,write"})
+        self.assertEqual(self.store.registered_client_ids(["a", "b", "c"]), {"a", "b"})
+        self.assertEqual(self.store.load_clients([]), {})
+
+    def test_revocations(self):
+        now = int(time.time())
+        token_id = token_digest("token")
+        self.assertTrue(self.store.revoke(token_id, now + 60, now))
+        self.assertFalse(self.store.revoke(token_id, now + 60, now))
+        self.assertEqual(self.store.find_revoked([token_id, token_digest("other")]), {token_id})
+        self.assertEqual(list(self.store.revoked_token_ids()), [token_id])
+        feed, _ = self.store.revocations_since(None, 10)
+        self.assertEqual([entry["token_id"] for entry in feed], [token_id.hex()])
+
+    def test_incomplete_backend_fails_on_creation(self):
+        class PartialStore(AuthStore):
+            def init_schema(self):
+                return 0
+
+        with self.assertRaises(TypeError):
+            PartialStore()
+
+
+class TestSQLiteAuditStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def _path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def test_pools_bounded_per_segment_and_in_number(self):
+        store = SQLiteAuditStore(pool_size=1, max_segments=2)
+        store._pool(self._path("a.db")).timeout = 0.1
+        with store.connection(self._path("a.db"), "audit_read") as first:
+            with self.assertRaises(PoolTimeout):
+                with store.connection(self._path("a.db"), "audit_read"):
+                    pass
+        for name in ("b.db", "c.db"):
+            with store.connection(self._path(name), "audit_read"):
+                pass
+        self.assertEqual(list(store._pools), [self._path("b.db"), self._path("c.db")])
+        with self.assertRaises(sqlite3.ProgrammingError):
+            first.execute("SELECT 1")
+        store.close()
+
+    def test_audit_logger_uses_store(self):
+        store = SQLiteAuditStore()
+        operations = []
+        connection = store.connection
+
+        def recording(path, operation):
+            operations.append(operation)
+            return connection(path, operation)
+
+        store.connection = recording
+        audit = AuditLogger(self._path("audit.db"), async_writes=False, store=store)
+        audit.log_event(event_type="token_validation", action="validate_delegation", status="success")
+        self.assertEqual(len(audit.get_events()), 1)
+        self.assertEqual(len(list(audit.export_events())), 1)
+        self.assertEqual(operations, ["audit_init_schema", "audit_write", "audit_read", "audit_export"])
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
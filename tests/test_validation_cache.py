@@ -0,0 +1,46 @@
+import unittest
+from unittest import mock
+
+from packages.server import proxyme_service
+from packages.server.delegation_store import token_digest
+from packages.server.proxyme_service import verified_tokens
+from tests import AgentTestCase
+
+
+class TestValidationCache(AgentTestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = self.delegate()
+
+    def _validate(self, token):
+        return self.client.post('/validate_delegation', json={'delegation_token': token})
+
+    def test_repeat_validation_skips_decode(self):
+        self.assertEqual(self._validate(self.token).status_code, 200)
+        with mock.patch.object(proxyme_service, 'decode_delegation') as decode:
+            response = self._validate(self.token)
+        self.assertEqual(response.status_code, 200)
+        decode.assert_not_called()
+
+    def test_entry_expires_with_token(self):
+        self._validate(self.token)
+        payload = verified_tokens.get(token_digest(self.token))
+        self.assertIsNotNone(payload)
+        self.assertEqual(verified_tokens._entries[token_digest(self.token)][1], payload['exp'])
+
+    def test_revocation_drops_entry(self):
+        self._validate(self.token)
+        self.client.post('/revoke_delegation', json={'delegation_token': self.token})
+        self.assertIsNone(verified_tokens.get(token_digest(self.token)))
+        self.assertEqual(self._validate(self.token).status_code, 401)
+
+    def test_invalid_tokens_not_cached(self):
+        size = len(verified_tokens)
+        self.assertEqual(self._validate(self.token + 'x').status_code, 401)
+        self.assertEqual(len(verified_tokens), size)
+        response = self.client.post('/validate_delegation/batch', json={'delegation_tokens': [123]})
+        self.assertEqual(response.get_json()['results'][0]['error'], 'Invalid token')
+
+
+if __name__ == '__main__':
+    unittest.main()